@@ -1,4 +1,5 @@
 from tables import *
+from auction.time_utils import fast_chicago_time_str
 import string
 
 class BookTable(IsDescription):
@@ -11,6 +12,28 @@ class BookTable(IsDescription):
     bid         = Int64Col(shape=(10,2))
     seqnum      = Int64Col()
 
+class BboTable(IsDescription):
+    """
+    Top of book table: the best bid and ask, a row each time either changes
+    """
+    timestamp   = Int64Col()
+    seqnum      = Int64Col()
+    bid_px      = Int64Col()
+    bid_qty     = Int64Col()
+    ask_px      = Int64Col()
+    ask_qty     = Int64Col()
+
+class ClosingBookTable(IsDescription):
+    """
+    Books of a symbol at the end of a day's parse, a row per symbol, the
+    set flags telling the levels holding a (px, qty) from those empty
+    """
+    symbol      = StringCol(32)
+    bid         = Int64Col(shape=(10,2))
+    ask         = Int64Col(shape=(10,2))
+    bid_set     = BoolCol(shape=10)
+    ask_set     = BoolCol(shape=10)
+
 class ImpliedBookTable(IsDescription):
     """
     Basic book table
@@ -21,6 +44,27 @@ class ImpliedBookTable(IsDescription):
     bid         = Int64Col(shape=(10,2))
     implied     = Int32Col()
 
+def table_description(description, store_timestamp_s=True):
+    """
+    Description to create a book or trade table with. Without
+    store_timestamp_s the timestamp_s column is left off and readers derive
+    it from timestamp (see record_timestamp_s).
+    """
+    if store_timestamp_s:
+        return description
+    return dict((name, col.copy()) for name, col in description.columns.iteritems()
+                if name != 'timestamp_s')
+
+def record_timestamp_s(record):
+    """
+    The timestamp_s of a book or trade record, computed from its timestamp
+    if it was stored without one
+    """
+    try:
+        return record['timestamp_s']
+    except (KeyError, ValueError):
+        return fast_chicago_time_str(record['timestamp'])
+
 class InMemoryBook(object):
     """ 
 
@@ -34,7 +78,7 @@ class InMemoryBook(object):
     def __init__(self, book_record):
         self.__data = {
             'timestamp' : book_record['timestamp'],
-            'timestamp_s' : book_record['timestamp_s'],
+            'timestamp_s' : record_timestamp_s(book_record),
             'ask' : book_record['ask'].copy(),
             'bid' : book_record['bid'].copy(),
             'seqnum' : book_record['seqnum']
@@ -82,7 +126,7 @@ class Book(object):
         return self.__record['timestamp']
 
     def timestamp_s(self):
-        return self.__record['timestamp_s']
+        return record_timestamp_s(self.__record)
 
     def seqnum(self):
         return self.__record['seqnum']
@@ -128,7 +172,7 @@ class Book(object):
         """
         Prints the book as ladder, asks then bids
         """
-        result = [ str((self.__record['timestamp_s'], self.__record['seqnum'])) ]
+        result = [ str((self.timestamp_s(), self.__record['seqnum'])) ]
         for ask in reversed(self.__record['ask']):
             result.append( str((ask[0], ask[1])) )
 
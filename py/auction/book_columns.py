@@ -0,0 +1,500 @@
+###############################################################################
+#
+# File: book_columns.py
+#
+# Description: Columnar layout of book data, an array per field and level,
+#              delta encoded layout storing only the levels changed per book,
+#              compact layout storing levels as int32 tick offsets, and
+#              reading projections of book fields from any layout
+#
+##############################################################################
+from attribute import readable
+from tables import Atom, UInt8Atom, Int64Atom, Col
+from numpy import dtype, empty, zeros, concatenate, cumsum, arange, repeat, \
+    flatnonzero, searchsorted, int32, int64, iinfo, minimum, maximum
+from auction.storage import get_storage_profile
+from auction.parser.async_writer import h5_lock
+import re
+
+# Name of the group holding the arrays, alongside where the books table would be
+__BOOK_COLUMNS__ = 'book_columns'
+
+# Name of the group holding the arrays of delta encoded books
+__BOOK_DELTAS__ = 'book_deltas'
+
+# Delta encoded books between keyframes, books storing every level
+__DELTA_KEYFRAME_BOOKS__ = 256
+
+# Name of the table of compact books
+__COMPACT_BOOKS__ = 'compact_books'
+
+# Compact price of an empty level (price 0), kept out of the range of ticks
+__EMPTY_TICKS__ = iinfo(int32).min
+
+# Level columns (bid and ask) are split into price and quantity per level
+__LEVEL_FIELD_RE__ = re.compile(r'^(\w+)_(px|qty)(\d+)$')
+__LEVEL_PARTS__ = { 'px' : 0, 'qty' : 1 }
+
+def level_field(name):
+    """
+    Tuple (column, level, part) for a level field name (e.g. 'bid_px0' gives
+    ('bid', 0, 0)), or None for any other name
+    """
+    m = __LEVEL_FIELD_RE__.match(name)
+    if m:
+        return (m.group(1), int(m.group(3)), __LEVEL_PARTS__[m.group(2)])
+    return None
+
+def level_fields(column, levels):
+    """
+    Field names, in order, for the levels of a bid or ask column
+    """
+    return [ '%s_%s%d' % (column, part, level) for level in range(levels)
+             for part in ('px', 'qty') ]
+
+def project(rows, fields):
+    """
+    Array of just the fields of the book rows, where fields may name any
+    column of the rows or a level field (e.g. 'ask_qty2')
+    """
+    columns = []
+    for name in fields:
+        level = level_field(name)
+        if level and name not in rows.dtype.names:
+            column, level, part = level
+            columns.append((name, rows[column][:, level, part]))
+        else:
+            columns.append((name, rows[name]))
+    result = empty(len(rows), dtype=[ (name, values.dtype) for name, values in columns ])
+    for name, values in columns:
+        result[name] = values
+    return result
+
+def book_dataset(node):
+    """
+    Book data of the symbol group node in whichever layout it was written:
+    the books table, BookColumns, BookDeltas or CompactBooks
+    """
+    children = node._v_children
+    if 'books' in children:
+        return children['books']
+    if __COMPACT_BOOKS__ in children:
+        return CompactBooks(children[__COMPACT_BOOKS__])
+    if __BOOK_DELTAS__ in children:
+        return BookDeltas(children[__BOOK_DELTAS__])
+    return BookColumns(children[__BOOK_COLUMNS__])
+
+def read_books(dataset, start, stop, fields = None):
+    """
+    Book rows [start, stop) of the dataset (see book_dataset), or only the
+    given fields of them (see project). Only BookColumns avoid reading the
+    other fields.
+    """
+    if isinstance(dataset, (BookColumns, BookDeltas, CompactBooks)):
+        return dataset.read(start, stop, fields)
+    rows = dataset.read(start, stop)
+    return project(rows, fields) if fields else rows
+
+class BookColumns(object):
+    """
+    Book data for a symbol stored by column: a group holding an extendable
+    array per scalar column of the book description and, for the bid and
+    ask, a price and a quantity array per level (bid_px0, bid_qty0, ...).
+    Reading a projection of fields reads and decompresses only their arrays.
+
+    Rows are appended and read whole with the same dtype as the books table,
+    so BookColumns can stand in for it when writing (see BlockRows) and
+    reading.
+    """
+    readable(group=None, dtype=None, colnames=None, coldflts=None)
+
+    @staticmethod
+    def create(h5_file, where, description, title, storage = None):
+        """
+        Create the arrays for the columns of description (an IsDescription
+        or dict of columns) in a new group under where
+        """
+        storage = get_storage_profile(storage)
+        group = h5_file.createGroup(where, __BOOK_COLUMNS__, title)
+        for name, col in getattr(description, 'columns', description).iteritems():
+            atom = Atom.from_dtype(col.dtype.base)
+            if col.shape:
+                for field in level_fields(name, col.shape[0]):
+                    storage.create_earray(h5_file, group, field, atom, field)
+            else:
+                storage.create_earray(h5_file, group, name, atom, name)
+        return BookColumns(group)
+
+    def __init__(self, group):
+        self.__group = group
+        # Loads each array on first access, so only the arrays read are opened
+        self.__arrays = group._v_children
+        levels = {}
+        columns = []
+        for name in self.__arrays.keys():
+            level = level_field(name)
+            if level:
+                levels[level[0]] = max(levels.get(level[0], 0), level[1] + 1)
+            else:
+                columns.append((name, self.__arrays[name].atom.dtype))
+        columns += [ (name, dtype((self.__arrays[name + '_px0'].atom.dtype, (count, 2))))
+                     for name, count in levels.iteritems() ]
+        columns.sort()
+        self.__dtype = dtype(columns)
+        self.__colnames = [ name for name, column_type in columns ]
+        self.__levels = levels
+        self.__coldflts = dict((name, '' if column_type.kind == 'S' else 0)
+                               for name, column_type in columns)
+
+    nrows = property(lambda self: self.__arrays['timestamp'].nrows, None, None,
+                     r"Number of books")
+
+    def append(self, rows):
+        """
+        Append rows of the books table dtype
+        """
+        for name in self.__colnames:
+            count = self.__levels.get(name)
+            if count:
+                values = rows[name]
+                for level in range(count):
+                    self.__arrays['%s_px%d' % (name, level)].append(values[:, level, 0])
+                    self.__arrays['%s_qty%d' % (name, level)].append(values[:, level, 1])
+            else:
+                self.__arrays[name].append(rows[name])
+
+    def read(self, start = 0, stop = None, fields = None):
+        """
+        Books [start, stop) as rows of the books table dtype or, if fields
+        are given, rows of just those arrays
+        """
+        stop = self.nrows if stop is None else stop
+        if fields:
+            result = empty(stop - start, dtype=[ (name, self.__arrays[name].atom.dtype)
+                                                 for name in fields ])
+            for name in fields:
+                result[name] = self.__arrays[name].read(start, stop)
+            return result
+        result = empty(stop - start, dtype=self.__dtype)
+        for name in self.__colnames:
+            count = self.__levels.get(name)
+            if count:
+                values = result[name]
+                for level in range(count):
+                    values[:, level, 0] = self.__arrays['%s_px%d' % (name, level)].read(start, stop)
+                    values[:, level, 1] = self.__arrays['%s_qty%d' % (name, level)].read(start, stop)
+            else:
+                result[name] = self.__arrays[name].read(start, stop)
+        return result
+
+    def __getitem__(self, index):
+        return self.read(index, index + 1)[0]
+
+class BookDeltas(object):
+    """
+    Book data for a symbol stored as the changes from one book to the next:
+    a group holding an extendable array per scalar column of the book
+    description and, for the levels of the bid and ask, only the cells
+    (level price and quantity) that differ from the previous book. Every
+    keyframe_books-th book is a keyframe storing all of its cells, so a read
+    starts from the keyframe at or before its first book.
+
+    The cells of book i are cell_counts[i] consecutive rows of cell_slots
+    (the column's index among the level columns times the levels, plus the
+    level), cell_px and cell_qty. keyframe_cells holds the first cell of each
+    keyframe.
+
+    Rows are appended and read whole with the same dtype as the books table,
+    so BookDeltas can stand in for it when writing (see BlockRows) and
+    reading, like BookColumns.
+    """
+    readable(group=None, dtype=None, colnames=None, coldflts=None)
+
+    @staticmethod
+    def create(h5_file, where, description, title, storage = None,
+               keyframe_books = __DELTA_KEYFRAME_BOOKS__):
+        """
+        Create the arrays for the columns of description (an IsDescription
+        or dict of columns) in a new group under where
+        """
+        storage = get_storage_profile(storage)
+        columns = getattr(description, 'columns', description)
+        ladder = sorted(name for name, col in columns.iteritems() if col.shape)
+        levels = columns[ladder[0]].shape[0]
+        assert all(columns[name].shape == (levels, 2) for name in ladder)
+        assert len(ladder)*levels < 256
+        group = h5_file.createGroup(where, __BOOK_DELTAS__, title)
+        for name, col in columns.iteritems():
+            if not col.shape:
+                storage.create_earray(h5_file, group, name, Atom.from_dtype(col.dtype.base), name)
+        cell = Atom.from_dtype(columns[ladder[0]].dtype.base)
+        storage.create_earray(h5_file, group, 'cell_counts', UInt8Atom(), 'Cells of each book')
+        storage.create_earray(h5_file, group, 'cell_slots', UInt8Atom(), 'Level of each cell')
+        storage.create_earray(h5_file, group, 'cell_px', cell, 'Price of each cell')
+        storage.create_earray(h5_file, group, 'cell_qty', cell, 'Quantity of each cell')
+        storage.create_earray(h5_file, group, 'keyframe_cells', Int64Atom(),
+                              'First cell of each keyframe')
+        group._v_attrs.ladder = ladder
+        group._v_attrs.levels = levels
+        group._v_attrs.keyframe_books = keyframe_books
+        return BookDeltas(group)
+
+    def __init__(self, group):
+        self.__group = group
+        # Loads each array on first access, so only the arrays read are opened
+        self.__arrays = group._v_children
+        self.__ladder = list(group._v_attrs.ladder)
+        self.__levels = group._v_attrs.levels
+        self.__keyframe_books = group._v_attrs.keyframe_books
+        self.__slots = len(self.__ladder)*self.__levels
+        cell = self.__arrays['cell_px'].atom.dtype
+        columns = [ (name, self.__arrays[name].atom.dtype) for name in self.__arrays.keys()
+                    if not name.startswith('cell_') and name != 'keyframe_cells' ]
+        columns += [ (name, dtype((cell, (self.__levels, 2)))) for name in self.__ladder ]
+        columns.sort()
+        self.__dtype = dtype(columns)
+        self.__colnames = [ name for name, column_type in columns ]
+        self.__coldflts = dict((name, '' if column_type.kind == 'S' else 0)
+                               for name, column_type in columns)
+        # cells of the last book appended, read from the file when first needed
+        self.__last = None
+
+    nrows = property(lambda self: self.__arrays['timestamp'].nrows, None, None,
+                     r"Number of books")
+
+    def append(self, rows):
+        """
+        Append rows of the books table dtype
+        """
+        first = self.nrows
+        if self.__last is None:
+            self.__last = self.__cells(self.read(first - 1, first))[0] if first else \
+                zeros((self.__slots, 2), dtype=self.__arrays['cell_px'].atom.dtype)
+        cells = self.__cells(rows)
+        previous = concatenate((self.__last[None], cells[:-1]))
+        changed = (cells != previous).any(axis=2)
+        keyframes = flatnonzero((first + arange(len(rows))) % self.__keyframe_books == 0)
+        changed[keyframes] = True
+        counts = changed.sum(axis=1)
+        books, slots = changed.nonzero()
+        starts = self.__arrays['cell_slots'].nrows + cumsum(counts) - counts
+        self.__arrays['keyframe_cells'].append(starts[keyframes])
+        self.__arrays['cell_counts'].append(counts.astype('uint8'))
+        self.__arrays['cell_slots'].append(slots.astype('uint8'))
+        self.__arrays['cell_px'].append(cells[books, slots, 0])
+        self.__arrays['cell_qty'].append(cells[books, slots, 1])
+        for name in self.__colnames:
+            if name not in self.__ladder:
+                self.__arrays[name].append(rows[name])
+        self.__last = cells[-1].copy()
+
+    def read(self, start = 0, stop = None, fields = None):
+        """
+        Books [start, stop) as rows of the books table dtype or, if fields
+        are given, rows of just those fields (see project). The levels are
+        decoded only if fields need them.
+        """
+        stop = self.nrows if stop is None else stop
+        if fields and not any(name in self.__ladder or level_field(name) for name in fields):
+            result = empty(stop - start, dtype=[ (name, self.__arrays[name].atom.dtype)
+                                                 for name in fields ])
+            for name in fields:
+                result[name] = self.__arrays[name].read(start, stop)
+            return result
+        result = empty(stop - start, dtype=self.__dtype)
+        for name in self.__colnames:
+            if name not in self.__ladder:
+                result[name] = self.__arrays[name].read(start, stop)
+        if stop > start:
+            cells = self.__decode(start, stop)
+            for index, name in enumerate(self.__ladder):
+                result[name] = cells[:, index*self.__levels:(index + 1)*self.__levels]
+        return project(result, fields) if fields else result
+
+    def __getitem__(self, index):
+        return self.read(index, index + 1)[0]
+
+    def __cells(self, rows):
+        """
+        Array of the level cells of each row, shape (rows, slots, 2)
+        """
+        return concatenate([ rows[name] for name in self.__ladder ], axis=1)
+
+    def __decode(self, start, stop):
+        """
+        Level cells of books [start, stop), carrying each slot forward from
+        the keyframe at or before start
+        """
+        keyframe = start // self.__keyframe_books
+        first = keyframe*self.__keyframe_books
+        counts = self.__arrays['cell_counts'].read(first, stop)
+        cell_start = self.__arrays['keyframe_cells'][keyframe]
+        cell_stop = cell_start + counts.sum()
+        slots = self.__arrays['cell_slots'].read(cell_start, cell_stop)
+        px = self.__arrays['cell_px'].read(cell_start, cell_stop)
+        qty = self.__arrays['cell_qty'].read(cell_start, cell_stop)
+        books = repeat(arange(len(counts)), counts)
+        wanted = arange(start - first, stop - first)
+        result = empty((stop - start, self.__slots, 2), dtype=px.dtype)
+        for slot in range(self.__slots):
+            at = flatnonzero(slots == slot)
+            # the keyframe has every slot, so each book finds its latest cell
+            latest = at[searchsorted(books[at], wanted, 'right') - 1]
+            result[:, slot, 0] = px[latest]
+            result[:, slot, 1] = qty[latest]
+        return result
+
+class CompactBooks(object):
+    """
+    Book data for a symbol in a compact_books table like the books table
+    but with the bid and ask levels stored as int32: each price as its
+    offset in ticks from a reference price (the first price appended for
+    the day) and each quantity as is. The tick_size, price_scale and
+    reference are attributes of the table. An empty level (price 0) is
+    stored with a price of __EMPTY_TICKS__.
+
+    Rows are appended and read with the int64 prices and quantities of the
+    books table dtype, encoding and decoding the levels, so CompactBooks can
+    stand in for it when writing (see BlockRows) and reading and Book sees
+    the usual prices. A price off the tick grid or too far from the
+    reference, or a quantity beyond int32, cannot be stored. check() raises
+    RuntimeError for a book with such a level, so the builder can drop just
+    that book before buffering it. Appending one raises the same rather
+    than store it wrongly.
+    """
+    readable(table=None, dtype=None, colnames=None, coldflts=None,
+             tick_size=1, price_scale=1, reference=0)
+
+    @staticmethod
+    def create(h5_file, where, description, title, storage = None,
+               tick_size = 1, price_scale = 1):
+        """
+        Create the table for the columns of description (an IsDescription or
+        dict of columns) under where, for prices of the instrument's
+        tick_size and price_scale (see auction.instruments)
+        """
+        storage = get_storage_profile(storage)
+        columns = dict((name, Col.from_dtype(dtype((int32, col.shape)) if col.shape else col.dtype,
+                                             pos=col._v_pos))
+                       for name, col in getattr(description, 'columns', description).iteritems())
+        table = storage.create_table(h5_file, where, __COMPACT_BOOKS__, columns, title)
+        table.attrs.tick_size = tick_size
+        table.attrs.price_scale = price_scale
+        # set by the first append with a price
+        table.attrs.reference = 0
+        return CompactBooks(table)
+
+    def __init__(self, table):
+        self.__table = table
+        self.__tick_size = int(table.attrs.tick_size)
+        self.__price_scale = int(table.attrs.price_scale)
+        self.__set_reference(int(table.attrs.reference))
+        self.__ladder = [ name for name in table.colnames if table.coldescrs[name].shape ]
+        self.__colnames = list(table.colnames)
+        self.__dtype = dtype([ (name, dtype((int64, table.coldescrs[name].shape))
+                                if name in self.__ladder else table.dtype[name])
+                               for name in self.__colnames ])
+        self.__coldflts = dict((name, 0 if name in self.__ladder else table.coldflts[name])
+                               for name in self.__colnames)
+
+    nrows = property(lambda self: self.__table.nrows, None, None,
+                     r"Number of books")
+
+    def append(self, rows):
+        """
+        Append rows of the books table dtype
+        """
+        encoded = empty(len(rows), dtype=self.__table.dtype)
+        for name in self.__colnames:
+            if name in self.__ladder:
+                encoded[name] = self.__encode(rows[name])
+            else:
+                encoded[name] = rows[name]
+        self.__table.append(encoded)
+
+    def read(self, start = 0, stop = None, fields = None):
+        """
+        Books [start, stop) as rows of the books table dtype or, if fields
+        are given, rows of just those fields (see project)
+        """
+        rows = self.__table.read(start, stop)
+        result = empty(len(rows), dtype=self.__dtype)
+        for name in self.__colnames:
+            if name in self.__ladder:
+                result[name] = self.__decode(rows[name])
+            else:
+                result[name] = rows[name]
+        return project(result, fields) if fields else result
+
+    def __getitem__(self, index):
+        return self.read(index, index + 1)[0]
+
+    def check(self, *ladders):
+        """
+        Raise RuntimeError unless the levels (price, quantity) of the ladders
+        of a book can be stored, fixing the reference on the first price.
+        The ladders may be passed as one array (e.g. bids and asks stacked).
+        """
+        for levels in ladders:
+            # cheap per book: only ladders outside the bounds go to __ticks
+            if not (self.__reference and minimum.reduce(levels, None) >= self.__low and
+                    maximum.reduce(levels, None) <= self.__high and
+                    (self.__tick_size == 1 or not (levels[..., 0] % self.__tick_size).any())):
+                self.__ticks(levels)
+
+    def __set_reference(self, reference):
+        """
+        Fix the reference price and the bounds check uses for the values of a
+        ladder (prices, quantities and 0 for empty levels) that can be stored.
+        With a reference off the grid check always goes to __ticks.
+        """
+        self.__reference = reference
+        limit = iinfo(int32)
+        self.__low = max(reference + (limit.min + 1) * self.__tick_size, limit.min)
+        self.__high = min(reference + limit.max * self.__tick_size, limit.max)
+        if reference % self.__tick_size or not (self.__low <= 0 <= self.__high):
+            self.__low, self.__high = 1, 0
+
+    def __ticks(self, levels):
+        """
+        Tick offsets of the prices of the levels, raising RuntimeError if a
+        level cannot be stored
+        """
+        px = levels[..., 0]
+        if not self.__reference:
+            prices = px[px != 0]
+            if len(prices):
+                self.__set_reference(int(prices[0]))
+                with h5_lock:
+                    self.__table.attrs.reference = self.__reference
+        ticks, off_grid = divmod(px - self.__reference, self.__tick_size)
+        empty_levels = px == 0
+        limit = iinfo(int32)
+        invalid = (~empty_levels & ((off_grid != 0) | (ticks <= limit.min) | (ticks > limit.max))) | \
+            (levels[..., 1] < limit.min) | (levels[..., 1] > limit.max)
+        if invalid.any():
+            bad = levels[invalid.nonzero()][0]
+            raise RuntimeError("Level %s not compact with tick size %d from reference %d" %
+                               (tuple(bad), self.__tick_size, self.__reference))
+        ticks[empty_levels] = __EMPTY_TICKS__
+        return ticks
+
+    def __encode(self, levels):
+        """
+        int32 array of the levels (price, quantity) of a column
+        """
+        ticks = self.__ticks(levels)
+        result = empty(levels.shape, dtype=int32)
+        result[..., 0] = ticks
+        result[..., 1] = levels[..., 1]
+        return result
+
+    def __decode(self, levels):
+        """
+        int64 array of the compact levels of a column
+        """
+        result = empty(levels.shape, dtype=int64)
+        result[..., 0] = levels[..., 0].astype(int64)*self.__tick_size + self.__reference
+        result[..., 1] = levels[..., 1]
+        result[..., 0][levels[..., 0] == __EMPTY_TICKS__] = 0
+        return result
@@ -2,6 +2,7 @@ from path import path
 from attribute import readable, writable
 from tables import *
 from auction.book import Book, BookTable
+from auction.book_columns import book_dataset
 import sys
 
 class RecordPointer(object):
@@ -53,7 +54,7 @@ A handle on an hdf file with standardized book data to read
         for symbol in symbols:
             for node in self.__book_file.root:
                 if symbol == node._v_name:
-                    self.__data_sets.append(RecordPointer(symbol, node.books))
+                    self.__data_sets.append(RecordPointer(symbol, book_dataset(node)))
                     break
 
     def ordered_visit(self, func):
@@ -1,13 +1,25 @@
 from path import path
 from attribute import readable, writable
 from tables import *
-from auction.book import Book, ImpliedBookTable, InMemoryBook, BookTable
+from auction.book import Book, ImpliedBookTable, InMemoryBook, BookTable, \
+    table_description, record_timestamp_s
 from auction.paths import *
+from auction.book_columns import book_dataset, read_books
+from auction.build_cache import build_record, write_build_record, stale_reason
+from auction.parser.utils import __BUFFER_ROWS__
+from auction.parser.closing_books import __CLOSING_BOOKS__
+from auction.storage import get_storage_profile, storage_profile_names
 from numpy import zeros
 import shutil
 import sys
 import re
 
+# Books read from the file at a time by a BookStream
+__READ_ROWS__ = 4096
+# Bump when a change alters the implied books written, so the build cache
+# rebuilds them
+__IMPLIED_VERSION__ = 1
+
 class H5Repository(object):
     """ 
     Keeps a map of path_to_file to hdf5 file object. 
@@ -25,7 +37,16 @@ class H5Repository(object):
             result = openFile(path_to_file)
             H5Repository._repository[path_to_file] = result
         return result    
-        
+
+    @staticmethod
+    def close_all():
+        """
+        Close every file opened through the repository, e.g. once the
+        streams reading them are done
+        """
+        for h5_file in H5Repository._repository.values():
+            h5_file.close()
+        H5Repository._repository = {}
 
     @staticmethod
     def find_data_file(date, symbol):
@@ -65,29 +86,63 @@ class BookStream(object):
        book = Book(record)
        ...
 
+    Books are read __READ_ROWS__ at a time, from a books table or
+    BookColumns. Given fields (e.g. ['timestamp', 'bid_px0', 'ask_px0'])
+    the stream yields records of just those fields instead of books, which
+    from BookColumns reads only their arrays (see book_columns.project).
+
+    With bbo=True the stream reads the symbol's bbo table instead, written
+    by a parse with bbo=True, and yields its records (timestamp, seqnum,
+    bid_px, bid_qty, ask_px, ask_qty), or just the given fields of them, for
+    each change to the top of book.
     """
-    readable(date=None, symbol=None, input_file=None, book=None, book_count=None, book_ds = None)
+    readable(date=None, symbol=None, input_file=None, book=None, book_count=None, book_ds = None,
+             fields = None, bbo = False)
 
-    def __init__(self, date, symbol):
+    def __init__(self, date, symbol, fields = None, bbo = False):
         self.__date = date
         self.__symbol = symbol
+        self.__fields = fields
+        self.__bbo = bbo
         self.__input_file = H5Repository.find_data_file(date, symbol)
         self.__index = 0
-        self.__book_ds = filter(lambda n: n._v_name == symbol, self.__input_file.root)[0].books
+        node = filter(lambda n: n._v_name == symbol, self.__input_file.root)[0]
+        if bbo:
+            if 'bbo' not in node._v_children:
+                raise RuntimeError("No bbo table for %s on %s, parse it with bbo" % (symbol, date))
+            self.__book_ds = node._v_children['bbo']
+        else:
+            self.__book_ds = book_dataset(node)
         self.__book_count = self.__book_ds.nrows
+        self.__block = []
+        self.__block_start = 0
         self._current_book = None
 
     def __iter__(self):
         return self
 
+    def __record(self, index):
+        """
+        Record at index, reading the block of records starting there if needed
+        """
+        offset = index - self.__block_start
+        if not (0 <= offset < len(self.__block)):
+            self.__block = read_books(self.__book_ds, index,
+                                      min(index + __READ_ROWS__, self.__book_count),
+                                      self.__fields)
+            self.__block_start = index
+            offset = 0
+        return self.__block[offset]
+
     def peek_book(self):
         if self.__index < self.__book_count:
-            return self.__book_ds[self.__index]
+            return self.__record(self.__index)
         return None
 
     def next(self):
         if self.__index < self.__book_count:
-            self._current_book = Book(self.__book_ds[self.__index])
+            record = self.__record(self.__index)
+            self._current_book = record if self.__fields or self.__bbo else Book(record)
             self.__index += 1
             return self._current_book
         else:
@@ -144,7 +199,7 @@ class CmeImpliedBookStream(BookStream):
 
                 # Use timestamp/seqnum of trade to push InMemoryBook forward
                 timestamp = next_trade['timestamp']
-                timestamp_s = next_trade['timestamp_s']
+                timestamp_s = record_timestamp_s(next_trade)
                 seqnum = next_trade['seqnum']
 
                 # Track how much of the book has been eaten at each price
@@ -208,31 +263,53 @@ class CmeImpliedBookStream(BookStream):
                     print "Next Book After Trade Through", result
             return result
 
+def implied_options(storage = None):
+    """
+    Options of CmeImpliedBookWriter affecting the implied books written
+    """
+    return dict(storage = get_storage_profile(storage).name)
+
+def implied_stale_reason(date, storage = None):
+    """
+    Why the implied books for the date need building from its CME books
+    (see build_cache), or None if they are up to date
+    """
+    inpath = CME_OUT_PATH / date
+    return stale_reason(inpath.parent / (str(inpath.name) + ".implied"), [ inpath ],
+                        __IMPLIED_VERSION__, implied_options(storage))
+
 class CmeImpliedBookWriter(object):
 
-    def __init__(self, date):
+    def __init__(self, date, buffer_rows = __BUFFER_ROWS__, storage = None):
         self.__infile = H5Repository.find_cme_file(date)
-        filters = Filters(complevel=1, complib='zlib')
+        build_options = implied_options(storage)
+        storage = get_storage_profile(storage)
         inpath = path(self.__infile.filename)
         self.__outpath = inpath.parent / (str(inpath.name) + ".implied")        
         print "Creating", self.__outpath
         self.__outfile = openFile(str(self.__outpath) + '.in_progress', mode = "w", title = "CME Implied")
         for symbol in self.__infile.root:
             symbol = symbol._v_name
-            if symbol == 'parse_results':
+            if symbol in ('parse_results', __CLOSING_BOOKS__):
                 continue
+            reader = CmeImpliedBookStream(date, symbol)
+            # implied books store timestamp_s only if the source books do
+            store_timestamp_s = 'timestamp_s' in reader.book_ds.colnames
             group = self.__outfile.createGroup("/", symbol, 'implied book')
-            table = self.__outfile.createTable(group, 'implied', ImpliedBookTable, "Books plus trades", filters=filters)            
+            table = storage.create_table(self.__outfile, group, 'implied', 
+                                         table_description(ImpliedBookTable, store_timestamp_s),
+                                         "Books plus trades")
+            if buffer_rows:
+                table.nrowsinbuf = buffer_rows
             row = table.row
             print "Processing symbol", symbol
 
-            reader = CmeImpliedBookStream(date, symbol)
-            
             for book in reader:
                 b = book.book()
                 row['implied'] = book.is_implied() and 1 or 0
                 row['timestamp'] = b['timestamp']
-                row['timestamp_s'] = b['timestamp_s']
+                if store_timestamp_s:
+                    row['timestamp_s'] = record_timestamp_s(b)
                 target_bid = row['bid']
                 target_ask = row['ask']
                 src_bid = b['bid']
@@ -252,6 +329,7 @@ class CmeImpliedBookWriter(object):
 
             table.flush()
 
+        write_build_record(self.__outfile, build_record([ inpath ], __IMPLIED_VERSION__, build_options))
         self.__outfile.close()
         shutil.move(str(self.__outpath)+'.in_progress', self.__outpath)
 
@@ -266,7 +344,41 @@ Takes a cme hdf5 file with book and trade data and generates the implied data
                         action='store',
                         help='Date to process, if empty all dates assumed')
 
+    parser.add_argument('--buffer-rows', 
+                        dest='buffer_rows',
+                        action='store',
+                        type=int,
+                        default=__BUFFER_ROWS__,
+                        help='Number of implied book rows buffered between appends')
+
+    parser.add_argument('--storage', 
+                        dest='storage',
+                        action='store',
+                        choices=storage_profile_names(),
+                        default=None,
+                        help='Storage profile for the implied books (see auction.storage)')
+
+    parser.add_argument('--stale', 
+                        dest='stale',
+                        action='store_true',
+                        help='Build only if the books, version or options changed since the last build')
+
+    parser.add_argument('--dry-run', 
+                        dest='dry_run',
+                        action='store_true',
+                        help='Only report whether the implied books would be built and why')
+
     options = parser.parse_args()
 
+    if options.stale or options.dry_run:
+        reason = implied_stale_reason(options.date, options.storage)
+        if options.dry_run:
+            if reason:
+                print "Would build implied books for", options.date, ":", reason
+            exit(0)
+        if not reason:
+            print "Implied books up to date for", options.date
+            exit(0)
+
     #CmeImpliedBookWriter('20111017')
-    CmeImpliedBookWriter(options.date)
+    CmeImpliedBookWriter(options.date, options.buffer_rows, options.storage)
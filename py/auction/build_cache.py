@@ -0,0 +1,103 @@
+###############################################################################
+#
+# File: build_cache.py
+#
+# Description: Records of what each output file was built from, so bulk
+#              runs rebuild only the outputs whose source, parser version or
+#              options have changed
+#
+##############################################################################
+from path import path
+from tables import openFile
+import hashlib
+import logging
+
+# Root attribute of an output file holding its build record
+__BUILD_RECORD__ = 'build_record'
+
+def source_fingerprint(src_path, digest = True):
+    """
+    Dict of the name, size, mtime and (if digest) md5 of the source file
+    """
+    src_path = path(src_path)
+    result = dict(name = str(src_path.basename()), size = src_path.size, mtime = src_path.mtime)
+    if digest:
+        md5 = hashlib.md5()
+        with open(src_path, 'rb') as src_file:
+            for chunk in iter(lambda: src_file.read(1 << 20), ''):
+                md5.update(chunk)
+        result['md5'] = md5.hexdigest()
+    return result
+
+def build_record(sources, version, options, digest = False):
+    """
+    The record of an output built from the source files by the given
+    version of its parser with the options (a dict of everything affecting
+    the output). Sources are fingerprinted by size and mtime, and by md5
+    only if digest, since that reads each source through once more.
+    """
+    return dict(sources = [ source_fingerprint(src, digest) for src in sources ],
+                version = version,
+                options = options)
+
+def write_build_record(h5_file, record):
+    """
+    Store the build record in the output, once it is complete
+    """
+    setattr(h5_file.root._v_attrs, __BUILD_RECORD__, record)
+
+def read_build_record(output_path):
+    """
+    The build record of the output, None if it has none or is unreadable
+    """
+    try:
+        h5_file = openFile(output_path)
+    except Exception as e:
+        logging.info("Unable to read %s: %s" % (output_path, e))
+        return None
+    try:
+        return getattr(h5_file.root._v_attrs, __BUILD_RECORD__, None)
+    finally:
+        h5_file.close()
+
+def source_changed(fingerprint, src_path):
+    """
+    True if the source file differs from its fingerprint. A file with the
+    same size but another mtime (e.g. copied or touched) is compared by md5
+    if the fingerprint has one, and is otherwise taken to have changed.
+    """
+    src_path = path(src_path)
+    if not src_path.exists():
+        return True
+    current = source_fingerprint(src_path, digest = False)
+    if current['name'] != fingerprint['name'] or current['size'] != fingerprint['size']:
+        return True
+    if current['mtime'] == fingerprint['mtime']:
+        return False
+    if 'md5' not in fingerprint:
+        return True
+    return source_fingerprint(src_path)['md5'] != fingerprint['md5']
+
+def stale_reason(output_path, sources, version, options):
+    """
+    Why the output must be built from the source files by that version of
+    its parser with the options, or None if it is up to date
+    """
+    output_path = path(output_path)
+    if not output_path.exists():
+        return 'missing'
+    record = read_build_record(output_path)
+    if record is None:
+        return 'no build record'
+    if record['version'] != version:
+        return 'parser version %s, now %s' % (record['version'], version)
+    if record['options'] != options:
+        changed = sorted(name for name in set(record['options']) | set(options)
+                         if record['options'].get(name) != options.get(name))
+        return 'options changed: ' + ', '.join(changed)
+    if len(record['sources']) != len(sources):
+        return 'sources changed'
+    for fingerprint, src in zip(record['sources'], sources):
+        if source_changed(fingerprint, src):
+            return 'source %s changed' % fingerprint['name']
+    return None
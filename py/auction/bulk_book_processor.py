@@ -8,6 +8,25 @@ import os
 import re
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser("""
+Run book_processor over every day of CME books, in parallel
+""")
+
+    parser.add_argument('--stale', 
+                        dest='flags',
+                        action='append_const',
+                        const='--stale',
+                        help='Build only days whose books, version or options changed (see build_cache)')
+
+    parser.add_argument('--dry-run', 
+                        dest='flags',
+                        action='append_const',
+                        const='--dry-run',
+                        help='Only list the days that would be built and why')
+
+    options = parser.parse_args()
+    flags = options.flags or []
 
     logging.basicConfig(level=logging.INFO)
 
@@ -15,7 +34,7 @@ if __name__ == "__main__":
     __HERE__ = path(os.path.realpath(__file__))
 
     def generate_book_data(input):
-        args = ["python", __HERE__.parent / "book_processor.py",] + [ '-d', get_date_string(get_date_of_file(input)) ]
+        args = ["python", __HERE__.parent / "book_processor.py",] + [ '-d', get_date_string(get_date_of_file(input)) ] + flags
         logging.info("Generating data input: %s =>\n\t%s"%(input.name, args))
         subprocess.call(args)
 
@@ -0,0 +1,76 @@
+###############################################################################
+#
+# File: instruments.py
+#
+# Description: Instrument reference data - tick size and price scale per
+#              symbol - used to store prices as integer tick offsets
+#
+##############################################################################
+from attribute import readable
+from auction.paths import DATA_PATH
+import csv
+
+# Optional reference file with a header and rows of
+# symbol,exchange,tick_size,price_scale overriding the exchange defaults
+__INSTRUMENTS_PATH__ = DATA_PATH / 'instruments.csv'
+
+# (tick_size, price_scale) of symbols not in the reference file. ARCA prices
+# are dollars scaled by 1e6 (see arca_parser.int_price) with up to 6
+# decimals, not always on a tick, so their default tick is one unit. CME
+# prices are the integer MDEntryPx as sent.
+__EXCHANGE_DEFAULTS__ = {
+    'ARCA' : (1, 1000000),
+    'CME' : (1, 1),
+    }
+
+class Instrument(object):
+    """
+    Reference data for a symbol: its prices are integers, price_scale of
+    which make one unit of the quote currency, moving in multiples of
+    tick_size
+    """
+    readable(symbol=None, exchange=None, tick_size=1, price_scale=1)
+
+    def __init__(self, symbol, exchange, tick_size = 1, price_scale = 1):
+        self.__symbol = symbol
+        self.__exchange = exchange
+        self.__tick_size = tick_size
+        self.__price_scale = price_scale
+
+    def __str__(self):
+        return "%s(%s tick %d scale %d)" % \
+            (self.__symbol, self.__exchange, self.__tick_size, self.__price_scale)
+
+# (symbol, exchange) -> Instrument of the reference file, loaded on first use
+__instruments__ = None
+
+def load_instruments(instruments_path = __INSTRUMENTS_PATH__):
+    """
+    Dict of (symbol, exchange) to Instrument read from the reference file,
+    empty if there is none
+    """
+    result = {}
+    if instruments_path.exists():
+        with open(instruments_path, 'rb') as instruments_file:
+            for row in csv.DictReader(instruments_file):
+                instrument = Instrument(row['symbol'], row['exchange'],
+                                        int(row['tick_size']), int(row['price_scale']))
+                result[(instrument.symbol, instrument.exchange)] = instrument
+    return result
+
+def get_instrument(symbol, exchange):
+    """
+    The Instrument for the symbol on the exchange, from the reference file
+    or else the exchange defaults
+    """
+    global __instruments__
+    if __instruments__ is None:
+        __instruments__ = load_instruments()
+    instrument = __instruments__.get((symbol, exchange))
+    if instrument:
+        return instrument
+    if exchange not in __EXCHANGE_DEFAULTS__:
+        raise RuntimeError("No reference data for %s on %s, exchange not one of %s" %
+                           (symbol, exchange, sorted(__EXCHANGE_DEFAULTS__)))
+    tick_size, price_scale = __EXCHANGE_DEFAULTS__[exchange]
+    return Instrument(symbol, exchange, tick_size, price_scale)
@@ -0,0 +1,278 @@
+###############################################################################
+#
+# File: arca_block_parser.py
+#
+# Description: Block oriented decoding of arca record data files
+#
+##############################################################################
+from attribute import readable
+from numpy import *
+
+__BLOCK_SIZE__ = 1 << 24
+__SYMBOL_WIDTH__ = 16
+__PX_DECIMAL_DIGITS__ = 6
+__NEWLINE__ = ord('\n')
+__COMMA__ = ord(',')
+__SPACE__ = ord(' ')
+__TAB__ = ord('\t')
+__CR__ = ord('\r')
+__DOT__ = ord('.')
+__ZERO__ = ord('0')
+__NINE__ = ord('9')
+
+# Record layout of a decoded block - one row per Add/Modify/Delete line. The
+# line is the zero based line number within the source file.
+ARCA_BATCH_DTYPE = dtype([
+        ('code', 'S1'),
+        ('seq_num', int64),
+        ('order_id', int64),
+        ('side', 'S1'),
+        ('qty', int64),
+        ('symbol', 'S%d' % __SYMBOL_WIDTH__),
+        ('price', int64),
+        ('seconds', int64),
+        ('millis', int64),
+        ('timestamp', int64),
+        ('line', int64),
+        ])
+
+# Position of the fields of interest in each record type, matching the
+# indices used by AddRecord, DeleteRecord and ModifyRecord
+__FIELD_POSITIONS__ = {
+    'A' : dict(seq_num=1, order_id=2, side=4, qty=5, symbol=6, price=7, seconds=8, millis=9),
+    'D' : dict(seq_num=1, order_id=2, seconds=3, millis=4, symbol=5, side=9),
+    'M' : dict(seq_num=1, order_id=2, qty=3, price=4, seconds=5, millis=6, symbol=7, side=11),
+    }
+
+def _is_blank(chars):
+    return (chars == __SPACE__) | (chars == __TAB__) | (chars == __CR__)
+
+def _field_matrix(buf, starts, ends):
+    """
+    Gather the bytes of variable width fields [starts, ends) into a 2D
+    matrix, one row per field, along with a mask of which cells are in the
+    field.
+    """
+    width = max(int((ends - starts).max()), 1)
+    offsets = arange(width)
+    mask = offsets < (ends - starts)[:, newaxis]
+    index = minimum(starts[:, newaxis] + offsets, len(buf) - 1)
+    chars = where(mask, buf[index], 0).astype(uint8)
+    return chars, mask
+
+def parse_ints(buf, starts, ends, allow_empty=False):
+    """
+    Convert the ascii integer fields [starts, ends) of buf to int64.
+    Surrounding whitespace is ignored, anything else non-numeric is an
+    error. Empty fields are 0 when allow_empty, otherwise an error.
+    """
+    result = zeros(len(starts), dtype=int64)
+    if not len(starts):
+        return result
+    chars, mask = _field_matrix(buf, starts, ends)
+    is_digit = mask & (chars >= __ZERO__) & (chars <= __NINE__)
+    if (mask & ~is_digit & ~_is_blank(chars)).any():
+        raise RuntimeError("Invalid integer field")
+    if not allow_empty and not is_digit.any(axis=1).all():
+        raise RuntimeError("Empty integer field")
+    digits = chars.astype(int64) - __ZERO__
+    for j in range(chars.shape[1]):
+        result = where(is_digit[:, j], result*10 + digits[:, j], result)
+    return result
+
+def parse_prices(buf, starts, ends):
+    """
+    Vectorized equivalent of arca_parser.int_price - convert the ascii
+    decimal prices [starts, ends) of buf to integers with 6 implied decimals
+    """
+    result = zeros(len(starts), dtype=int64)
+    if not len(starts):
+        return result
+    chars, mask = _field_matrix(buf, starts, ends)
+    is_digit = mask & (chars >= __ZERO__) & (chars <= __NINE__)
+    is_dot = mask & (chars == __DOT__)
+    if (mask & ~is_digit & ~is_dot & ~_is_blank(chars)).any():
+        raise RuntimeError("Invalid price field")
+    digits = chars.astype(int64) - __ZERO__
+    seen_dot = zeros(len(starts), dtype=bool)
+    decimals = zeros(len(starts), dtype=int64)
+    for j in range(chars.shape[1]):
+        result = where(is_digit[:, j], result*10 + digits[:, j], result)
+        decimals += is_digit[:, j] & seen_dot
+        seen_dot |= is_dot[:, j]
+    if (decimals > __PX_DECIMAL_DIGITS__).any():
+        raise RuntimeError("Invalid price - more than 6 decimal places")
+    return result * (10 ** (__PX_DECIMAL_DIGITS__ - decimals))
+
+def parse_strings(buf, starts, ends, width=__SYMBOL_WIDTH__):
+    """
+    Extract the fields [starts, ends) of buf, stripped of whitespace, as a
+    fixed width string array
+    """
+    starts = starts.copy()
+    ends = ends.copy()
+    if not len(starts):
+        return zeros(0, dtype='S%d' % width)
+    while True:
+        lead = (starts < ends) & _is_blank(buf[minimum(starts, len(buf) - 1)])
+        if not lead.any():
+            break
+        starts += lead
+    while True:
+        trail = (ends > starts) & _is_blank(buf[maximum(ends - 1, 0)])
+        if not trail.any():
+            break
+        ends -= trail
+    if ((ends - starts) > width).any():
+        raise RuntimeError("Field wider than %d characters" % width)
+    offsets = arange(width)
+    mask = offsets < (ends - starts)[:, newaxis]
+    index = minimum(starts[:, newaxis] + offsets, len(buf) - 1)
+    chars = ascontiguousarray(where(mask, buf[index], 0).astype(uint8))
+    return chars.view('S%d' % width).ravel()
+
+def first_chars(buf, starts, ends):
+    """
+    First non-blank character of each field as a single character string
+    array
+    """
+    return parse_strings(buf, starts, minimum(ends, starts + 8), 8).astype('S1')
+
+def symbols_present(data, symbols):
+    """
+    The symbols appearing anywhere in data. A symbol absent from the raw
+    bytes cannot be in any record, so a block containing none of the
+    symbols of interest need not be decoded.
+    """
+    return [ symbol for symbol in symbols if data.find(symbol) >= 0 ]
+
+def decode_block(data, start_of_date, first_line=0, symbols=None):
+    """
+    Decode a block of complete lines (data must end with a newline) from an
+    arca file. All Add, Modify and Delete records are returned as an array
+    of ARCA_BATCH_DTYPE in file order, other record types are dropped.
+
+    If symbols (sorted array of symbols) is given only records for those
+    symbols are decoded, plus the last record of the block so its timestamp
+    is still known. The symbol field is checked before any other field is
+    decoded, and blocks with none of the symbols are skipped outright.
+
+    Returns tuple (batch, number of lines in data)
+    """
+    buf = frombuffer(data, dtype=uint8)
+    line_ends = flatnonzero(buf == __NEWLINE__)
+    line_count = len(line_ends)
+    if not line_count:
+        return zeros(0, dtype=ARCA_BATCH_DTYPE), 0
+
+    line_starts = empty(line_count, dtype=int64)
+    line_starts[0] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+    codes = buf[line_starts]
+
+    if symbols is not None:
+        records = flatnonzero(in1d(codes, [ ord(code) for code in __FIELD_POSITIONS__ ]))
+        if not len(records):
+            return zeros(0, dtype=ARCA_BATCH_DTYPE), line_count
+        last_record = records[-1]
+        if not symbols_present(data, symbols):
+            last_line = data[line_starts[last_record]:line_ends[last_record] + 1]
+            return (decode_block(last_line, start_of_date, first_line + last_record)[0],
+                    line_count)
+
+    commas = flatnonzero(buf == __COMMA__)
+    first_comma = searchsorted(commas, line_starts)
+    comma_count = searchsorted(commas, line_ends) - first_comma
+
+    parts = []
+    for code, positions in __FIELD_POSITIONS__.iteritems():
+        rows = flatnonzero(codes == ord(code))
+        if not len(rows):
+            continue
+
+        needed = max(positions.values())
+        short = comma_count[rows] <= needed
+        if short.any():
+            raise RuntimeError("Too few fields for '%s' record at line %d" %
+                               (code, first_line + rows[short][0] + 1))
+
+        def bounds(field):
+            return (commas[first_comma[rows] + field - 1] + 1,
+                    commas[first_comma[rows] + field])
+
+        if symbols is not None:
+            wanted = in1d(parse_strings(buf, *bounds(positions['symbol'])), symbols)
+            rows = rows[wanted | (rows == last_record)]
+            if not len(rows):
+                continue
+
+        part = zeros(len(rows), dtype=ARCA_BATCH_DTYPE)
+        part['code'] = code
+        part['line'] = first_line + rows
+        for name in ('seq_num', 'order_id', 'qty'):
+            if name in positions:
+                part[name] = parse_ints(buf, *bounds(positions[name]))
+        part['seconds'] = parse_ints(buf, *bounds(positions['seconds']))
+        part['millis'] = parse_ints(buf, *bounds(positions['millis']), allow_empty=True)
+        part['symbol'] = parse_strings(buf, *bounds(positions['symbol']))
+        part['side'] = where(first_chars(buf, *bounds(positions['side'])) == 'B', 'B', 'S')
+        if 'price' in positions:
+            part['price'] = parse_prices(buf, *bounds(positions['price']))
+        parts.append(part)
+
+    if not parts:
+        return zeros(0, dtype=ARCA_BATCH_DTYPE), line_count
+
+    batch = concatenate(parts)
+    batch = batch[argsort(batch['line'], kind='mergesort')]
+    batch['timestamp'] = start_of_date + batch['seconds']*1000000 + batch['millis']*1000
+    return batch, line_count
+
+class ArcaBlockReader(object):
+    r"""
+
+Reads an arca record stream in large blocks, yielding each block decoded into
+an array of ARCA_BATCH_DTYPE records
+
+"""
+
+    readable(line_count=0)
+
+    def __init__(self, stream, start_of_date, block_size=__BLOCK_SIZE__, first_line=0,
+                 symbols=None):
+        """
+        stream - file like object with decompressed record data
+        start_of_date - timestamp for start of the date of the data
+        block_size - number of bytes to read per block
+        first_line - line number of the first line in the stream
+        symbols - if given, only decode records for these symbols (see decode_block)
+        """
+        self.__stream = stream
+        self.__start_of_date = start_of_date
+        self.__symbols = symbols
+        self.__block_size = block_size
+        self.__first_line = first_line
+        self.__line_count = 0
+
+    def __iter__(self):
+        carry = ''
+        while True:
+            data = self.__stream.read(self.__block_size)
+            if not data:
+                break
+            if carry:
+                data = carry + data
+            cut = data.rfind('\n') + 1
+            carry = data[cut:]
+            if cut:
+                yield self.__decode(data[:cut])
+
+        if carry:
+            yield self.__decode(carry + '\n')
+
+    def __decode(self, data):
+        batch, lines = decode_block(data, self.__start_of_date,
+                                    self.__first_line + self.__line_count,
+                                    self.__symbols)
+        self.__line_count += lines
+        return batch
@@ -9,14 +9,42 @@ import os
 __ARCA_SRC_PATH__ = DATA_PATH / 'NYSE_ARCA2'
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser("""
+Run arca_parser over every day of the archive, in parallel
+""")
+
+    parser.add_argument('-f', '--force', 
+                        dest='flags',
+                        action='append_const',
+                        const='--force',
+                        help='Rebuild every day')
+
+    parser.add_argument('--stale', 
+                        dest='flags',
+                        action='append_const',
+                        const='--stale',
+                        help='Rebuild days whose input, parser version or options changed (see build_cache)')
+
+    parser.add_argument('--dry-run', 
+                        dest='dry_run',
+                        action='store_true',
+                        help='Only list the days that would be built and why')
+
+    options = parser.parse_args()
+    flags = options.flags or []
 
     logging.basicConfig(level=logging.INFO)
 
     import pprint
     __HERE__ = path(os.path.realpath(__file__))
 
+    if options.dry_run:
+        subprocess.call(["python", __HERE__.parent / "arca_parser.py", '--dry-run'] + flags)
+        exit(0)
+
     def generate_book_data(input):
-        args = ["python", __HERE__.parent / "arca_parser.py",] + [ '-d', get_date_string(get_date_of_file(input)) ]
+        args = ["python", __HERE__.parent / "arca_parser.py",] + [ '-d', get_date_string(get_date_of_file(input)) ] + flags
         logging.info("Generating data input: %s =>\n\t%s"%(input.name, args))
         subprocess.call(args)
 
@@ -15,7 +15,15 @@ from auction.time_utils import *
 
 from tables import *
 from sets import Set
-from auction.parser.utils import PriceOrderedDict, FileRecordCounter, BookBuilder
+from auction.parser.utils import PriceOrderedDict, FileRecordCounter, BookBuilder, OrderTable, \
+    BookOptions, __BUFFER_ROWS__
+from auction.parser.arca_block_parser import ArcaBlockReader, ARCA_BATCH_DTYPE
+from auction.parser.block_gzip import BlockGzipIndex
+from auction.parser.checkpoint import Checkpoint
+from auction.parser.keyframes import keyframe_tables, append_keyframe, find_keyframe
+from auction.build_cache import build_record, write_build_record, stale_reason
+from auction.storage import get_storage_profile, storage_profile_names
+from auction.instruments import get_instrument
 import os
 import zipfile
 import re
@@ -26,7 +34,11 @@ import time
 import string
 import pprint
 import traceback
-from numpy import zeros, array
+from numpy import zeros, array, argsort, flatnonzero, split, in1d, unique, sort, concatenate
+from multiprocessing import Process, Queue
+from Queue import Full
+from zlib import crc32
+from bisect import bisect_right
 
 __PriceRe__ = re.compile(r"\s*(\d*)(?:\.(\d+))?\s*")
 __DateRe__ = re.compile(r"(\d\d\d\d)(\d\d)(\d\d)")
@@ -37,6 +49,14 @@ __LEVELS__ = 10
 __PX_MULTIPLIER__ = 1000000
 __PX_DECIMAL_DIGITS__ = 6
 __TICK_SIZE__ = 10000
+__SHARD_QUEUE_DEPTH__ = 8
+# Records read from an _AMD_.h5 archive at a time when replaying it
+__REPLAY_ROWS__ = 1 << 20
+# Symbols per in-kernel query when replaying an archive for a list of symbols
+__QUERY_SYMBOLS__ = 32
+# Bump when a change alters the files written, so the build cache rebuilds them
+# 2: _AMD_.h5 archives have a line column, compact ARCA books a tick of 1
+__PARSER_VERSION__ = 2
 
 def get_date_of_file(fileName):
     """
@@ -157,6 +177,23 @@ Stores fields for single Modify record
         self.__is_buy = fields[11] == 'B'
         self.__timestamp = make_timestamp(start_of_date, fields[5], fields[6])
 
+__RECORD_TYPES__ = { 'A' : AddRecord, 'D' : DeleteRecord, 'M' : ModifyRecord }
+__SYMBOL_FIELD__ = { 'A' : 6, 'D' : 5, 'M' : 7 }
+
+def record_code(line):
+    """
+    The record code of the raw line, without splitting the whole line
+    """
+    return line.split(',', 1)[0].rstrip()
+
+def record_symbol(line, code):
+    """
+    The symbol of the raw line of the given record code, without splitting
+    the whole line
+    """
+    position = __SYMBOL_FIELD__[code]
+    return line.split(',', position + 1)[position].strip()
+
 
 class ArcaRecord(IsDescription):
     asc_ts      = StringCol(12)
@@ -168,100 +205,259 @@ class ArcaRecord(IsDescription):
     quantity    = Int32Col()
     record_type = StringCol(1) # 'A', 'M', 'D'
     buy_sell    = StringCol(1) # 'B', 'S'
+    line        = Int64Col()   # zero based line of the gz file
+
+def records_batch(rows):
+    """
+    Batch of decoded records (see arca_block_parser) of rows of an AMD
+    records table, with line -1 for rows of archives without lines
+    """
+    batch = zeros(len(rows), dtype=ARCA_BATCH_DTYPE)
+    batch['code'] = rows['record_type']
+    batch['seq_num'] = rows['seq_num']
+    batch['order_id'] = rows['order_id']
+    batch['side'] = rows['buy_sell']
+    batch['qty'] = rows['quantity']
+    batch['symbol'] = rows['symbol']
+    batch['price'] = rows['price']
+    batch['timestamp'] = rows['ts']
+    batch['line'] = rows['line'] if 'line' in rows.dtype.names else -1
+    return batch
 
 class ArcaBookBuilder(BookBuilder):
+    """
+    Builds books from the orders of a symbol.
+
+    With keyframe_seconds or keyframe_events a keyframe of the orders is
+    written after the first record that many seconds or records since the
+    last one (see keyframes), for replay_from() to start from.
+    """
     def __init__(self, symbol, h5_file, **rest):
         BookBuilder.__init__(self, symbol, h5_file, **rest)
-        self._bid_orders = {}
-        self._ask_orders = {}
+        self._orders = OrderTable()
+        self._keyframe_seconds = rest.get('keyframe_seconds', 0)
+        self._keyframe_events = rest.get('keyframe_events', 0)
+        self._keyframe_start = None
+        self._keyframe_count = 0
+        self._keyframe_tables = None
+        if self._keyframe_seconds or self._keyframe_events:
+            self._keyframe_tables = keyframe_tables(self._file_record_counter.h5_file, symbol,
+                                                    rest.get('storage'), rest.get('resume', False))
 
     def hanging_orders(self):
-        return len(self._bid_orders) + len(self._ask_orders)
+        return len(self._orders)
 
-    def process_record(self, amd_record):
+    def add_order(self, order_id, is_buy, price, quantity):
         """
-        Incorporate the contents of the new record into the bids/asks
+        Add a new order to the bids/asks. Duplicate adds of an order id are
+        stacked, the last one added is the first deleted.
         """
+        self._orders.add(int(order_id), is_buy, price, quantity)
 
-        is_buy = amd_record.is_buy
-        orders = self._bid_orders if is_buy else self._ask_orders
-        side = "B" if is_buy else "A"
-
-        if isinstance(amd_record, AddRecord):
-            entry = (amd_record.price, amd_record.quantity)
-            #current = orders.setdefault(amd_record.order_id, entry)
-            current = orders.get(amd_record.order_id)
-            if not current:
-                orders[amd_record.order_id] = entry
-            else:
-                #print "Dealing with multi add", self._symbol, side, amd_record.order_id
-                # Don't raise an error - turn the entry into a list if it is not
-                if type(current) != list:
-                    orders[amd_record.order_id] = [current]
+        if is_buy:
+            self._bids_to_qty.update_quantity(price, quantity)
+        else:
+            self._asks_to_qty.update_quantity(price, quantity)
 
-                # Put this new add at front of list so pop effects FIFO
-                #orders[amd_record.order_id].insert(0, entry)
-                orders[amd_record.order_id].append(entry)
+    def delete_order(self, order_id, is_buy):
+        """
+        Remove an existing order from the bids/asks
+        """
+        current = self._orders.pop(int(order_id), is_buy)
+        if not current:
+            raise RuntimeError("Record not found for delete: " + str(order_id))
 
-            if amd_record.is_buy:
-                self._bids_to_qty.update_quantity(entry[0], entry[1])
-            else:
-                self._asks_to_qty.update_quantity(entry[0], entry[1])
+        if is_buy:
+            self._bids_to_qty.update_quantity(current[0], -current[1])
+        else:
+            self._asks_to_qty.update_quantity(current[0], -current[1])
 
-        elif isinstance(amd_record, DeleteRecord):
-            assert(amd_record.symbol == self._symbol)
-            current = orders.get(amd_record.order_id, None)
-            if not current:
-                raise RuntimeError("Record not found for delete: " + amd_record.order_id)
-
-            is_list = (type(current) == list)
-            if is_list:
-                # If it is a list, pop off the first entry (FIFO) and "delete" that qty
-                #print "Deleting", amd_record.order_id, "one elm of list", side, orders,
-                original_list = current
-                current = orders[amd_record.order_id].pop()
-                #print "with current volume at", current[0], (self._bids_to_qty.get_quantity(current[0]) if amd_record.is_buy else \
-                #                                                 self._asks_to_qty.get_quantity(current[0]))
-
-            if amd_record.is_buy:
-                self._bids_to_qty.update_quantity(current[0], -current[1])
-            else:
-                self._asks_to_qty.update_quantity(current[0], -current[1])
+    def modify_order(self, order_id, is_buy, price, quantity):
+        """
+        Replace the price and quantity of an existing order
+        """
+        order_id = int(order_id)
+        current = self._orders.get(order_id, is_buy)
 
-            if is_list:
-                if len(original_list) == 0:
-                    #print "Deleting multi-order list", amd_record.order_id
-                    del orders[amd_record.order_id]
-            else:
-                del orders[amd_record.order_id]
+        if not current:
+            raise RuntimeError("Record not found for modify: " + str(order_id))
 
-        elif isinstance(amd_record, ModifyRecord):
-            assert(amd_record.symbol == self._symbol)
-            current = orders.get(amd_record.order_id)
+        if current[2]:
+            print "UNABLE TO SUPPORT MODIFY with duplicate adds!", order_id, "current", current
+            raise RuntimeError("Record not found for modify: " + str(order_id))
 
-            if not current:
-                raise RuntimeError("Record not found for modify: " + amd_record.order_id)
+        if is_buy:
+            self._bids_to_qty.update_quantity(current[0], -current[1])
+            self._bids_to_qty.update_quantity(price, quantity)
+        else:
+            self._asks_to_qty.update_quantity(current[0], -current[1])
+            self._asks_to_qty.update_quantity(price, quantity)
 
-            if type(current) == list:
-                print "UNABLE TO SUPPORT MODIFY with duplicate adds!", amd_record.order_id, "mod", amd_record, "current", current
-                raise RuntimeError("Record not found for modify: " + amd_record.order_id)
+        self._orders.replace(order_id, is_buy, price, quantity)
 
-            if amd_record.is_buy:
-                self._bids_to_qty.update_quantity(current[0], -current[1])
-                self._bids_to_qty.update_quantity(amd_record.price, amd_record.quantity)
+    def note_record(self, ts, seqnum, line):
+        """
+        Count a record processed, successfully or not, writing a keyframe if
+        one is due
+        """
+        if self._keyframe_tables is None:
+            return
+        if self._keyframe_start is None:
+            self._keyframe_start = ts
+        self._keyframe_count += 1
+        if (self._keyframe_events and self._keyframe_count >= self._keyframe_events) or \
+                (self._keyframe_seconds and ts - self._keyframe_start >= self._keyframe_seconds*1000000):
+            append_keyframe(self._keyframe_tables, ts, seqnum, line, self._orders.snapshot())
+            self._keyframe_start = ts
+            self._keyframe_count = 0
+
+    def load_keyframe(self, orders):
+        """
+        Start the bids/asks from the orders of a keyframe
+        """
+        self._orders.load(orders)
+        for order_id, is_buy, price, quantity, stacked in orders:
+            if is_buy:
+                self._bids_to_qty.update_quantity(price, quantity)
             else:
-                self._asks_to_qty.update_quantity(current[0], -current[1])
-                self._asks_to_qty.update_quantity(amd_record.price, amd_record.quantity)
+                self._asks_to_qty.update_quantity(price, quantity)
+        self.update_levels(self._bids, self._bids_to_qty)
+        self.update_levels(self._asks, self._asks_to_qty)
+
+    def process_record(self, amd_record):
+        """
+        Incorporate the contents of the new record into the bids/asks
+        """
+
+        if isinstance(amd_record, AddRecord):
+            self.add_order(amd_record.order_id, amd_record.is_buy,
+                           amd_record.price, amd_record.quantity)
+
+        elif isinstance(amd_record, DeleteRecord):
+            assert(amd_record.symbol == self._symbol)
+            self.delete_order(amd_record.order_id, amd_record.is_buy)
 
-            orders[amd_record.order_id] = (amd_record.price, amd_record.quantity)
+        elif isinstance(amd_record, ModifyRecord):
+            assert(amd_record.symbol == self._symbol)
+            self.modify_order(amd_record.order_id, amd_record.is_buy,
+                              amd_record.price, amd_record.quantity)
         else:
             raise RuntimeError("Invalid record: " + amd_record)
 
         # bids and asks have been updated, now update the record and append to the table
-        self.make_record(amd_record.timestamp, 
-                         chicago_time_str(amd_record.timestamp),
+        self.make_record(amd_record.timestamp, None,
                          amd_record.seq_num)
 
+    def process_batch(self, batch):
+        """
+        Incorporate a batch of decoded records (see arca_block_parser) for
+        this symbol into the bids/asks, in order. Records that fail are
+        skipped, just as process_record would raise on them.
+
+        Returns list of (exception, timestamp, line) for the failures
+        """
+        failures = []
+        keyframes = self._keyframe_tables is not None
+        for code, order_id, side, price, quantity, ts, seq_num, line in \
+                zip(batch['code'].tolist(), batch['order_id'].tolist(),
+                    batch['side'].tolist(), batch['price'].tolist(),
+                    batch['qty'].tolist(), batch['timestamp'].tolist(),
+                    batch['seq_num'].tolist(), batch['line'].tolist()):
+            try:
+                is_buy = side == 'B'
+                if code == 'A':
+                    self.add_order(order_id, is_buy, price, quantity)
+                elif code == 'D':
+                    self.delete_order(order_id, is_buy)
+                elif code == 'M':
+                    self.modify_order(order_id, is_buy, price, quantity)
+                else:
+                    raise RuntimeError("Invalid record code: " + code)
+
+                self.make_record(ts, None, seq_num)
+            except Exception as e:
+                failures.append((e, ts, line))
+            if keyframes:
+                self.note_record(ts, seq_num, line)
+        return failures
+
+class RunOptions(object):
+    """
+    How ArcaParser.parse runs, apart from how it writes its books (see
+    BookOptions):
+
+    block_mode - if True the file is decoded in large blocks into record
+    batches (see arca_block_parser) rather than line by line into record
+    objects. The line by line parse is the reference implementation.
+
+    shards - if > 1 books are built by that many worker processes, each
+    owning a hash partition of the symbols (see ArcaParser.start_shards).
+    Sharding implies block_mode and applies only when building books.
+
+    start_line, stop_line, start_time, stop_time - the window of the input
+    to parse: zero based lines [start_line, stop_line) and records with
+    timestamps in [start_time, stop_time). A stop of 0 means the end of
+    the file.
+
+    checkpoint_lines - if > 0 the state of the parse is saved every that
+    many input lines, next to the output (see Checkpoint)
+
+    resume - if True a parse continues from its last checkpoint, if any
+
+    force - if True an existing output is rebuilt
+
+    stale - if True an existing output is rebuilt if its build record shows
+    it was built from another input, parser version or options (see
+    build_cache)
+
+    dry_run - if True nothing is parsed, only the reason to is returned
+
+    replay - if True the input is an _AMD_.h5 archive and books are built
+    from its records rather than from the text (see replay_records)
+
+    keyframe_seconds, keyframe_events - the book builders write keyframes
+    of their orders every that many seconds or records of their symbol
+    (see ArcaBookBuilder)
+    """
+    readable(block_mode=False, shards=0, start_line=0, stop_line=0, start_time=0,
+             stop_time=0, checkpoint_lines=0, resume=False, force=False, stale=False,
+             dry_run=False, replay=False, keyframe_seconds=0, keyframe_events=0)
+
+    def __init__(self, block_mode = False, shards = 0, start_line = 0, stop_line = 0,
+                 start_time = 0, stop_time = 0, checkpoint_lines = 0, resume = False,
+                 force = False, stale = False, dry_run = False, replay = False,
+                 keyframe_seconds = 0, keyframe_events = 0):
+        if replay and checkpoint_lines:
+            raise RuntimeError("Checkpoints do not apply to replaying an archive")
+        if shards > 1 and (checkpoint_lines or resume):
+            raise RuntimeError("Checkpoints do not apply to sharded parses")
+        self.__block_mode = block_mode
+        self.__shards = shards
+        self.__start_line = start_line
+        self.__stop_line = stop_line
+        self.__start_time = start_time
+        self.__stop_time = stop_time
+        self.__checkpoint_lines = checkpoint_lines
+        self.__resume = resume
+        self.__force = force
+        self.__stale = stale
+        self.__dry_run = dry_run
+        self.__replay = replay
+        self.__keyframe_seconds = keyframe_seconds
+        self.__keyframe_events = keyframe_events
+
+    def window(self):
+        """
+        Tuple (start_line, stop_line, start_time, stop_time) of the window
+        """
+        return (self.__start_line, self.__stop_line, self.__start_time, self.__stop_time)
+
+    def keyframes(self):
+        """
+        Tuple (keyframe_seconds, keyframe_events)
+        """
+        return (self.__keyframe_seconds, self.__keyframe_events)
+
     
 class ArcaParser(object):
     r"""
@@ -287,11 +483,13 @@ Parse arca files and create book
                                              self.__date.day, NY_TZ)
 
         self.__book_builders = {}
+        self.__shard_queues = []
 
         if not self.__input_path.exists():
             raise RuntimeError("Input path does not exist " + self.__input_path)
 
-    def parse(self, build_book = True, force = False, stop_early_at_hit=0):
+    def parse(self, build_book = True, stop_early_at_hit = 0, run_options = None,
+              book_options = None):
         """
         Parse the input file. There are two modes: build_book=True and
         build_book=False. If build_book=False, the h5 file is simply the same
@@ -299,35 +497,336 @@ Parse arca files and create book
         the hdf5 file created has book data for all matching inputs. Each
         symbol gets it's own dataset.
 
+        run_options is the RunOptions for the parse, None for the defaults:
+        block or line mode, shards, the window of the input, checkpoints,
+        when to rebuild an existing output, replay and keyframes.
+
+        In a sharded parse this process only reads and decodes the input,
+        handing batches to the workers over bounded queues. When the input
+        is exhausted the shard files are stitched into the single output
+        file.
+
+        If the input has been block compressed (see block_gzip) a windowed
+        parse seeks directly to the start of the window, otherwise it reads
+        up to it. Windowed parses write to their own output file.
+
+        A resumed parse continues from its last checkpoint, if there is one,
+        given the same input, window and book options.
+
+        book_options is the BookOptions for writing the books, None for the
+        defaults: whether to store timestamp_s, the rows buffered per table,
+        the background writer queue, the storage profile (of the record
+        table too), the book layout and whether to write a bbo table.
+
+        Returns why the output was (or with dry_run would be) built, or None
+        if it was left as is.
+
+        A replayed archive is an _AMD_.h5 written by a parse with
+        build_book=False. It holds only the symbols it was parsed for.
+
         The ParseManager is used to store summary information for the parse of
         this data.
         """
-        self.__output_path = self.__output_base + (build_book and ".h5" or "_AMD_.h5")
+        run_options = run_options or RunOptions()
+        block_mode, force, replay = run_options.block_mode, run_options.force, run_options.replay
+        self.__window = run_options.window()
+        self.__book_options = book_options = book_options or BookOptions()
+        self.__storage = get_storage_profile(book_options.storage)
+        self.__keyframes = run_options.keyframes()
+        window_tag = any(self.__window) and ('_W%d-%d-%d-%d' % self.__window) or ''
+        self.__output_path = self.__output_base + window_tag + (build_book and ".h5" or "_AMD_.h5")
         logging.info("Parsing file %s\n\tto create %s"% (self.__input_path, self.__output_path))
-        if self.__output_path.exists() and not force:
-            return
+        self.__checkpoint = Checkpoint(self.__output_path + '.checkpoint',
+                                       run_options.checkpoint_lines)
+        self.__resumed = run_options.resume and self.__checkpoint.load() or None
+        if run_options.resume and not self.__resumed and self.__output_path.exists():
+            # a parse that died before its first checkpoint starts over
+            force = force or ParseManager.get_summary_record(self.__output_path) is None
+        build_options = dict(symbols = sorted(self.__symbols or []), window = self.__window,
+                             build_book = build_book,
+                             store_timestamp_s = book_options.store_timestamp_s,
+                             storage = self.__storage.name, book_layout = book_options.book_layout)
+        if any(self.__keyframes):
+            build_options['keyframes'] = self.__keyframes
+        if book_options.bbo:
+            build_options['bbo'] = book_options.bbo
+        if self.__resumed:
+            reason = 'resuming from checkpoint'
+        elif force or not self.__output_path.exists():
+            reason = force and 'forced' or 'missing'
+        else:
+            reason = stale_reason(self.__output_path, [ self.__input_path ],
+                                  __PARSER_VERSION__, build_options) if run_options.stale else None
+        if run_options.dry_run or not reason:
+            return reason
+        logging.info("Building %s: %s" % (self.__output_path, reason))
         if not self.__output_path.parent.exists():
             os.makedirs(self.__output_path.parent)
-        self.__h5_file = openFile(self.__output_path, mode = "w", title = "ARCA Equity Data")
+        if replay:
+            assert build_book, "Replaying an archive only applies when building books"
+        if run_options.shards > 1:
+            assert build_book, "Sharding only applies when building books"
+            block_mode = True
+            # workers must be forked before this process opens any hdf5 file
+            self.start_shards(run_options.shards)
+        self.__parse_options = (self.__input_path, self.__window, build_book,
+                                book_options.store_timestamp_s, book_options.book_layout,
+                                self.__keyframes, book_options.bbo)
+        if self.__resumed:
+            if self.__resumed['options'] != self.__parse_options:
+                raise RuntimeError("Checkpoint %s is of a parse with other options %s" %
+                                   (self.__checkpoint.checkpoint_path, self.__resumed['options']))
+            logging.info("Resuming at line %d" % self.__resumed['line'])
+            self.__h5_file = openFile(self.__output_path, mode = "a")
+            self.__checkpoint.restore(self.__h5_file, self.__resumed)
+        else:
+            self.__h5_file = openFile(self.__output_path, mode = "w", title = "ARCA Equity Data")
+        self.__amd_table = None
         if not build_book:
             ## If not building book, then just writing out AMD data as hdf5
-            filters = Filters(complevel=1, complib='zlib')
-            group = self.__h5_file.createGroup("/", '_AMD_Data_', 'Add-Modify-Delete data')
-            table = self.__h5_file.createTable(group, 'records', ArcaRecord, 
-                                               "Data for "+str(self.__date), filters=filters)
-            h5Record = table.row
+            if self.__resumed:
+                self.__amd_table = self.__h5_file.root._AMD_Data_.records
+            else:
+                group = self.__h5_file.createGroup("/", '_AMD_Data_', 'Add-Modify-Delete data')
+                self.__amd_table = self.__storage.create_table(self.__h5_file, group, 'records', ArcaRecord, 
+                                                               "Data for "+str(self.__date))
+
+        self.__parse_manager = ParseManager(self.__input_path, self.__h5_file,
+                                            resume = bool(self.__resumed))
+        self.__parse_manager.mark_start()
+        if build_book and book_options.writer_queue and not self.__shard_queues:
+            BookBuilder.start_writer(self.__h5_file, book_options.writer_queue)
+        if self.__resumed:
+            self.__parse_manager.restore_state(self.__resumed['parse_manager'])
+            for symbol, state in self.__resumed['builders'].iteritems():
+                self.get_builder(symbol, resume = True).restore_state(state)
+
+        self.__window_first_line = self.__resumed['first_line'] if self.__resumed else None
+        if replay:
+            data_start_timestamp, data_stop_timestamp, processed = \
+                self.replay_records(stop_early_at_hit)
+        elif block_mode:
+            data_start_timestamp, data_stop_timestamp = \
+                self.__parse_blocks(build_book, stop_early_at_hit)
+            processed = self.lines_processed()
+        else:
+            data_start_timestamp, data_stop_timestamp = \
+                self.__parse_lines(build_book, stop_early_at_hit)
+            processed = self.lines_processed()
+
+        if self.__shard_queues:
+            books_good, total_unchanged = self.stitch_shards()
+        else:
+            books_good, total_unchanged = self.summarize_builders()
+        self.__parse_manager.writer_stats(BookBuilder.flush_books(self.__h5_file))
+
+        ############################################################
+        # Finish filling in the parse summary info and close up
+        ############################################################
+        self.__parse_manager.data_start(data_start_timestamp)
+        self.__parse_manager.data_stop(data_stop_timestamp)
+        self.__parse_manager.irrelevants(total_unchanged)
+        self.__parse_manager.processed(processed)
+        self.__parse_manager.mark_stop(books_good)
+        write_build_record(self.__h5_file, build_record([ self.__input_path ], __PARSER_VERSION__,
+                                                        build_options))
+        self.__h5_file.close()
+        self.__checkpoint.remove()
+        ParseManager.summarize_file(self.__output_path)
+        return reason
+
+    def lines_processed(self):
+        """
+        Lines from the first read inside the parse window, by the parse
+        resumed if resuming, to the last parsed. The count is the same
+        whether or not a block index let the parse skip to the window.
+        """
+        if self.__window_first_line is None:
+            return 0
+        return max(0, self.__line_number + 1 - self.__window_first_line)
+
+    def resume_progress(self):
+        """
+        Tuple (line, hit count, data start, data stop, last line skipped by
+        the prefilter) to continue the parse from - that of the checkpoint
+        resumed, if any
+        """
+        if self.__resumed:
+            return self.__resumed['progress']
+        return (0, 0, 0, 0, None)
+
+    def save_checkpoint(self, line, hit_count, data_start_timestamp, data_stop_timestamp,
+                        last_skipped = None):
+        """
+        Checkpoint the parse with line the next to parse and the progress so far
+        """
+        progress = (line, hit_count, data_start_timestamp, data_stop_timestamp, last_skipped)
+        builders = dict((symbol, builder.checkpoint_state())
+                        for symbol, builder in self.__book_builders.iteritems())
+        self.__checkpoint.save(self.__h5_file, line,
+                               dict(options = self.__parse_options,
+                                    first_line = self.__window_first_line,
+                                    progress = progress,
+                                    builders = builders,
+                                    parse_manager = self.__parse_manager.checkpoint_state()))
+
+    def summarize_builders(self):
+        """
+        Summarize each BookBuilder
+
+        Returns tuple (all books good, total unchanged records)
+        """
+        books_good = True
+        total_unchanged = 0
+        for symbol, builder in self.__book_builders.iteritems():
+            books_good = books_good and builder.summary()
+            total_unchanged += builder.unchanged
+        return (books_good, total_unchanged)
 
+    def start_shards(self, shards):
+        """
+        Fork one book building worker process per shard
+        """
+        self.__shard_paths = []
+        self.__shard_workers = []
+        self.__shard_queues = []
+        for shard in range(shards):
+            shard_path = path(self.__output_path + '.shard%d' % shard)
+            queue = Queue(__SHARD_QUEUE_DEPTH__)
+            worker = Process(target=self.build_shard, args=(shard_path, queue))
+            worker.start()
+            self.__shard_paths.append(shard_path)
+            self.__shard_workers.append(worker)
+            self.__shard_queues.append(queue)
+
+    def build_shard(self, shard_path, queue):
+        """
+        Body of a shard worker process. Builds books for the batches arriving
+        on the queue, until a None arrives, into its own shard file with its
+        own parse results.
+        """
+        self.__shard_queues = []
+        self.__book_builders = {}
+        self.__h5_file = openFile(shard_path, mode = "w", title = "ARCA Equity Data Shard")
         self.__parse_manager = ParseManager(self.__input_path, self.__h5_file)
         self.__parse_manager.mark_start()
+        if self.__book_options.writer_queue:
+            BookBuilder.start_writer(self.__h5_file, self.__book_options.writer_queue)
+        for batch in iter(queue.get, None):
+            self.build_books_from_batch(batch)
+        books_good, total_unchanged = self.summarize_builders()
+        self.__parse_manager.writer_stats(BookBuilder.flush_books(self.__h5_file))
+        self.__parse_manager.irrelevants(total_unchanged)
+        self.__parse_manager.mark_stop(books_good)
+        self.__h5_file.close()
 
-        hit_count = 0
-        data_start_timestamp = None
+    def send_to_shards(self, batch):
+        """
+        Partition the batch by hash of symbol and queue each piece for the
+        worker owning those symbols. Blocks while that worker's queue is full.
+        """
+        shard_count = len(self.__shard_queues)
+        symbols, index = unique(batch['symbol'], return_inverse=True)
+        symbol_shards = array([ (crc32(symbol) & 0xffffffff) % shard_count 
+                                for symbol in symbols ])
+        batch_shards = symbol_shards[index]
+        for shard in unique(symbol_shards):
+            shard_batch = batch[batch_shards == shard]
+            while True:
+                try:
+                    self.__shard_queues[shard].put(shard_batch, True, 1.0)
+                    break
+                except Full:
+                    if not self.__shard_workers[shard].is_alive():
+                        raise RuntimeError("Shard worker %d died" % shard)
+
+    def stitch_shards(self):
+        """
+        Wait for the shard workers to finish and fold their books and parse
+        results into the output file, removing the shard files.
+
+        Returns tuple (all books good, total unchanged records)
+        """
+        for queue in self.__shard_queues:
+            queue.put(None)
+        for shard, worker in enumerate(self.__shard_workers):
+            worker.join()
+            if worker.exitcode:
+                raise RuntimeError("Shard worker %d failed with %d" % (shard, worker.exitcode))
 
-        for self.__line_number, line in enumerate(gzip.open(self.__input_path, 'rb')):
+        books_good = True
+        total_unchanged = 0
+        for shard_path in self.__shard_paths:
+            shard_file = openFile(shard_path)
+            for node in shard_file.root:
+                if node._v_name != 'parse_results':
+                    shard_file.copyNode(node, newparent=self.__h5_file.root, recursive=True)
+            summary = self.__parse_manager.merge_results(shard_file)
+            books_good = books_good and bool(summary['is_valid'])
+            total_unchanged += summary['irrelevants']
+            shard_file.close()
+            shard_path.remove()
+        self.__shard_queues = []
+        return (books_good, total_unchanged)
+
+    def open_input(self):
+        """
+        Open the input positioned as close to the start of the parse window
+        as its block index, if any, allows.
+
+        Returns tuple (stream, line number of first line in stream)
+        """
+        start_line, stop_line, start_time, stop_time = self.__window
+        start_line = max(start_line, self.resume_progress()[0])
+        index = (start_line or start_time) and BlockGzipIndex.find(self.__input_path)
+        if index:
+            return index.open(max(index.block_for_line(start_line),
+                                  index.block_for_time(start_time)))
+        return (gzip.open(self.__input_path, 'rb'), 0)
+
+    def prefilter_symbols(self):
+        """
+        True if lines for symbols not of interest can be dropped by looking
+        only at their record code and symbol field, before the rest of the
+        line is decoded. Time windows need the timestamp of every record, so
+        they turn the prefilter off.
+        """
+        start_line, stop_line, start_time, stop_time = self.__window
+        return bool(self.__symbols) and not (start_time or stop_time)
+
+    def __parse_lines(self, build_book, stop_early_at_hit):
+        """
+        Parse the input one line at a time, creating a record object per line
+
+        Returns tuple (data_start, data_stop) timestamps
+        """
+        resume_line, hit_count, data_start_timestamp, data_stop_timestamp, last_skipped = \
+            self.resume_progress()
+        table = self.__amd_table
+        if table is not None:
+            h5Record = table.row
+
+        start_line, stop_line, start_time, stop_time = self.__window
+        start_line = max(start_line, resume_line)
+        stream, self.__first_line = self.open_input()
+        self.__line_number = self.__first_line - 1
+        prefilter = self.prefilter_symbols()
+
+        for self.__line_number, line in enumerate(stream, self.__first_line):
 
             if stop_early_at_hit and hit_count == stop_early_at_hit:
                 break 
 
+            if self.__line_number < start_line:
+                continue
+
+            if stop_line and self.__line_number >= stop_line:
+                self.__line_number = stop_line - 1
+                break
+
+            if self.__window_first_line is None and not start_time:
+                self.__window_first_line = self.__line_number
+
             ###################################################
             # Show progress periodically
             ###################################################
@@ -337,23 +836,36 @@ Parse arca files and create book
                               (self.__symbols and 
                                self.__symbols or "*")))
 
-            fields = re.split(r'\s*,\s*', line)
-            code = fields[0]
-            record = None
-            if code == 'A':
-                record = AddRecord(fields, self.__start_of_date)
-            elif code == 'D':
-                record = DeleteRecord(fields, self.__start_of_date)
-            elif code == 'M':
-                record = ModifyRecord(fields, self.__start_of_date)
-            elif code == 'I' or code == 'V':
-                continue
-            else:
+            if self.__checkpoint.due(self.__line_number):
+                self.save_checkpoint(self.__line_number, hit_count, data_start_timestamp,
+                                     data_stop_timestamp, last_skipped)
+
+            code = record_code(line)
+            if code not in __RECORD_TYPES__:
+                # 'I' and 'V' records are not needed
                 continue
                 #raise RuntimeError("Unexpected record type '" + 
                 #                   code + "' at line " + str(self.__line_number) + 
                 #                   " of file " + self.__input_path)
 
+            if prefilter and record_symbol(line, code) not in self.__symbols:
+                last_skipped = line
+                continue
+
+            last_skipped = None
+            record = __RECORD_TYPES__[code](re.split(r'\s*,\s*', line), self.__start_of_date)
+
+            if record.timestamp < start_time:
+                continue
+
+            if stop_time and record.timestamp >= stop_time:
+                break
+
+            if self.__window_first_line is None:
+                self.__window_first_line = self.__line_number
+
+            data_stop_timestamp = record.timestamp
+
             if self.__symbols and (not record.symbol in self.__symbols):
                 continue
             else:
@@ -367,12 +879,13 @@ Parse arca files and create book
                     self.build_books(record)
                 else:
                     h5Record['ts'] = record.timestamp
-                    h5Record['asc_ts'] = chicago_time_str(record.timestamp)
+                    h5Record['asc_ts'] = fast_chicago_time_str(record.timestamp)
                     h5Record['symbol'] = record.symbol
                     h5Record['seq_num'] = record.seq_num
                     h5Record['order_id'] = record.order_id
                     h5Record['record_type'] = code
                     h5Record['buy_sell'] = (record.is_buy and 'B' or 'S')
+                    h5Record['line'] = self.__line_number
                     if code != 'D':
                         h5Record['price'] = record.price
                         h5Record['quantity'] = record.quantity
@@ -382,40 +895,312 @@ Parse arca files and create book
                     if 0 == hit_count % __FLUSH_FREQ__:
                         table.flush()
 
-        books_good = True
-        total_unchanged = 0
-        for symbol, builder in self.__book_builders.iteritems():
-            books_good = books_good and builder.summary()
-            total_unchanged += builder.unchanged
+        if last_skipped:
+            # The prefilter skipped the final record, but it still marks the end of the data
+            record = __RECORD_TYPES__[record_code(last_skipped)](
+                re.split(r'\s*,\s*', last_skipped), self.__start_of_date)
+            data_stop_timestamp = record.timestamp
 
-        ############################################################
-        # Finish filling in the parse summary info and close up
-        ############################################################
-        self.__parse_manager.data_start(data_start_timestamp)
-        self.__parse_manager.data_stop(record.timestamp)
-        self.__parse_manager.irrelevants(total_unchanged)
-        self.__parse_manager.processed(self.__line_number+1)
-        self.__parse_manager.mark_stop(books_good)
-        self.__h5_file.close()
-        ParseManager.summarize_file(self.__output_path)
+        return (data_start_timestamp, data_stop_timestamp)
+
+    def __parse_blocks(self, build_book, stop_early_at_hit):
+        """
+        Parse the input in large blocks, each decoded into a batch of records
+
+        Returns tuple (data_start, data_stop) timestamps
+        """
+        resume_line, hit_count, data_start_timestamp, data_stop_timestamp, last_skipped = \
+            self.resume_progress()
+        symbols = self.__symbols and array(sorted(self.__symbols))
+        start_line, stop_line, start_time, stop_time = self.__window
+        start_line = max(start_line, resume_line)
+        stream, self.__first_line = self.open_input()
+        reader = ArcaBlockReader(stream, self.__start_of_date, first_line=self.__first_line,
+                                 symbols=(symbols if self.prefilter_symbols() else None))
+        self.__line_number = self.__first_line - 1
+        if self.__window_first_line is None and not start_time:
+            self.__window_first_line = max(start_line, self.__first_line)
+
+        for batch in reader:
+            done = stop_line and (self.__first_line + reader.line_count >= stop_line)
+            if start_line:
+                batch = batch[batch['line'] >= start_line]
+            if stop_line:
+                batch = batch[batch['line'] < stop_line]
+            if start_time:
+                batch = batch[batch['timestamp'] >= start_time]
+            last_line = self.__first_line + reader.line_count - 1
+            if stop_line:
+                last_line = min(last_line, stop_line - 1)
+            if stop_time:
+                late = flatnonzero(batch['timestamp'] >= stop_time)
+                if len(late):
+                    last_line = batch['line'][late[0]]
+                    batch = batch[:late[0]]
+                    done = True
+
+            if len(batch):
+                data_stop_timestamp = batch['timestamp'][-1]
+                if self.__window_first_line is None:
+                    self.__window_first_line = int(batch['line'][0])
+
+            if self.__symbols:
+                batch = batch[in1d(batch['symbol'], symbols)]
+
+            if stop_early_at_hit:
+                batch = batch[:stop_early_at_hit - hit_count]
+
+            hit_count += len(batch)
+            logging.info("At %d hit count is %d on %s" % 
+                         (reader.line_count, hit_count, 
+                          (self.__symbols and self.__symbols or "*")))
+
+            if len(batch):
+                # record the timestamp of the first record as data_start
+                if not data_start_timestamp:
+                    data_start_timestamp = batch['timestamp'][0]
+
+                if build_book:
+                    self.build_books_from_batch(batch)
+                else:
+                    self.write_amd_batch(batch)
+
+            self.__line_number = last_line
+            if (stop_early_at_hit and hit_count == stop_early_at_hit) or done:
+                break
+
+            if self.__checkpoint.due(last_line + 1):
+                self.save_checkpoint(last_line + 1, hit_count, data_start_timestamp,
+                                     data_stop_timestamp)
+
+        return (data_start_timestamp, data_stop_timestamp)
+
+    def replay_records(self, stop_early_at_hit):
+        """
+        Build books from the records table of the _AMD_.h5 archive being
+        replayed, reading __REPLAY_ROWS__ records at a time. The records of
+        the symbols of interest within the parse window are selected by
+        in-kernel queries on each chunk, for up to __QUERY_SYMBOLS__ symbols
+        each, and handed to the book builders as a batch, just as decoded
+        blocks of text are.
+
+        Lines of the window are lines of the gz file the archive was parsed
+        from, which archives written before the line column was added lack.
+
+        Returns tuple (data_start, data_stop, archive rows scanned)
+        """
+        hit_count = 0
+        data_start_timestamp = 0
+        data_stop_timestamp = 0
+        start_line, stop_line, start_time, stop_time = self.__window
+        amd_file = openFile(self.__input_path)
+        try:
+            records = amd_file.root._AMD_Data_.records
+            has_lines = 'line' in records.colnames
+            if (start_line or stop_line) and not has_lines:
+                raise RuntimeError("%s has no lines to window by" % self.__input_path)
+            if any(self.__keyframes) and not has_lines:
+                raise RuntimeError("%s has no lines for keyframes" % self.__input_path)
+            window = []
+            if start_line:
+                window.append('(line >= %d)' % start_line)
+            if stop_line:
+                window.append('(line < %d)' % stop_line)
+            if start_time:
+                window.append('(ts >= %d)' % start_time)
+            window = ' & '.join(window)
+            symbols = sorted(self.__symbols or [])
+            # one huge expression of every symbol is slow for numexpr to compile
+            selections = []
+            for i in range(0, len(symbols), __QUERY_SYMBOLS__):
+                condition = '(%s)' % ' | '.join('(symbol == %r)' % symbol
+                                                for symbol in symbols[i:i+__QUERY_SYMBOLS__])
+                selections.append(window and window + ' & ' + condition or condition)
+
+            self.__first_line = 0
+            self.__line_number = -1
+            for start in range(0, records.nrows, __REPLAY_ROWS__):
+                stop = min(start + __REPLAY_ROWS__, records.nrows)
+                done = False
+                if stop_time:
+                    # as when parsing text, the first record at or after stop_time ends the parse
+                    late = flatnonzero(records.read(start, stop, field='ts') >= stop_time)
+                    if len(late):
+                        stop = start + late[0]
+                        done = True
+                in_window = records.readWhere(window, start=start, stop=stop, field='ts') \
+                    if window else records.read(start, stop, field='ts')
+                if len(in_window):
+                    data_stop_timestamp = in_window[-1]
+
+                if selections:
+                    rows = records.readCoordinates(sort(concatenate([
+                        records.getWhereList(selection, start=start, stop=stop)
+                        for selection in selections ])))
+                else:
+                    rows = records.readWhere(window, start=start, stop=stop) \
+                        if window else records.read(start, stop)
+                if stop_early_at_hit:
+                    rows = rows[:stop_early_at_hit - hit_count]
+                hit_count += len(rows)
+                logging.info("At %d hit count is %d on %s" % 
+                             (stop, hit_count, (self.__symbols and self.__symbols or "*")))
+
+                if len(rows):
+                    if not data_start_timestamp:
+                        data_start_timestamp = rows['ts'][0]
+                    self.build_books_from_batch(records_batch(rows))
 
+                self.__line_number = stop - 1
+                if (stop_early_at_hit and hit_count == stop_early_at_hit) or done:
+                    break
+        finally:
+            amd_file.close()
+
+        return (data_start_timestamp, data_stop_timestamp, self.__line_number + 1)
+
+    def write_amd_batch(self, batch):
+        """
+        Append a batch of decoded records to the AMD table
+        """
+        rows = zeros(len(batch), dtype=self.__amd_table.dtype)
+        rows['ts'] = batch['timestamp']
+        rows['asc_ts'] = [ fast_chicago_time_str(ts) for ts in batch['timestamp'].tolist() ]
+        rows['symbol'] = batch['symbol']
+        rows['seq_num'] = batch['seq_num']
+        rows['order_id'] = batch['order_id']
+        rows['record_type'] = batch['code']
+        rows['buy_sell'] = batch['side']
+        rows['price'] = batch['price']
+        rows['quantity'] = batch['qty']
+        rows['line'] = batch['line']
+        self.__amd_table.append(rows)
+        self.__amd_table.flush()
+
+    def get_builder(self, symbol, resume = False):
+        """
+        Get the BookBuilder for the symbol, creating it on first use.
+        resume=True has it continue the books already in the file.
+        """
+        builder = self.__book_builders.get(symbol, None)
+        if not builder:
+            instrument = get_instrument(symbol, 'ARCA')
+            builder = ArcaBookBuilder(symbol, self.__h5_file,
+                                      tick_size = instrument.tick_size,
+                                      price_scale = instrument.price_scale,
+                                      keyframe_seconds = self.__keyframes[0],
+                                      keyframe_events = self.__keyframes[1],
+                                      resume = resume,
+                                      **self.__book_options.builder_args())
+            self.__book_builders[symbol] = builder
+        return builder
 
     def build_books(self, record):
         """
         Dispatch the new record to the appropriate BookBuilder for the symbol
         """
-        builder = self.__book_builders.get(record.symbol, None)
-        if not builder:
-            builder = ArcaBookBuilder(record.symbol, self.__h5_file)
-            self.__book_builders[record.symbol] = builder
+        builder = self.get_builder(record.symbol)
 
         try:
             builder.process_record(record)
-        except PriceException as e:
-            #print traceback.format_exc()
-            self.__parse_manager.warning(record.symbol +': ' + e.message, e.tag, record.timestamp, self.__line_number+1)
         except Exception as e:
-            self.__parse_manager.warning(record.symbol +': ' + e.message, 'G', record.timestamp, self.__line_number+1)
+            self.book_warning(record.symbol, e, record.timestamp, self.__line_number)
+        builder.note_record(record.timestamp, int(record.seq_num), self.__line_number)
+
+    def build_books_from_batch(self, batch):
+        """
+        Split the batch by symbol and dispatch each piece, in order, to the
+        appropriate BookBuilder for the symbol (or shard)
+        """
+        if self.__shard_queues:
+            self.send_to_shards(batch)
+            return
+
+        order = argsort(batch['symbol'], kind='mergesort')
+        symbols = batch['symbol'][order]
+        breaks = flatnonzero(symbols[1:] != symbols[:-1]) + 1
+        for rows in split(order, breaks):
+            symbol_batch = batch[rows]
+            symbol = symbol_batch['symbol'][0]
+            builder = self.get_builder(symbol)
+            for e, ts, line in builder.process_batch(symbol_batch):
+                self.book_warning(symbol, e, ts, line)
+
+    def book_warning(self, symbol, e, ts, line):
+        """
+        Log a warning for a record the BookBuilder could not incorporate
+        """
+        if isinstance(e, PriceException):
+            #print traceback.format_exc()
+            self.__parse_manager.warning(symbol +': ' + e.message, e.tag, ts, line+1)
+        else:
+            self.__parse_manager.warning(symbol +': ' + e.message, 'G', ts, line+1)
+
+def replay_from(date, symbol, timestamp, h5_file, amd_path = None, book_path = None):
+    """
+    ArcaBookBuilder for the symbol with its orders as of timestamp on date,
+    so its bids() and asks() are the book then.
+
+    It starts from the latest keyframe (see find_keyframe) in the books file
+    book_path, by default the first of the date with one for the symbol,
+    and applies the records of the symbol after it from the AMD archive
+    amd_path, by default the first of the date, up to the first record
+    later than timestamp. Without a keyframe the archive is replayed from
+    its start.
+
+    The books of the records replayed are written to h5_file, which may be
+    an in-memory file (driver='H5FD_CORE') if they are not wanted. Replays
+    from keyframes are independent, so slices of a day can be replayed in
+    parallel.
+    """
+    date_string = get_date_string(date)
+    if amd_path is None:
+        archives = sorted(__ARCA_OUT_PATH__.files(date_string + '_*_AMD_.h5'))
+        if not archives:
+            raise RuntimeError("No AMD archive for %s in %s" % (date_string, __ARCA_OUT_PATH__))
+        amd_path = archives[0]
+    if book_path is None:
+        book_paths = [ book for book in sorted(__ARCA_OUT_PATH__.files(date_string + '_*.h5'))
+                       if not book.endswith('_AMD_.h5') ]
+    else:
+        book_paths = [ book_path ]
+
+    keyframe = None
+    for book_path in book_paths:
+        book_file = openFile(book_path)
+        try:
+            keyframe = find_keyframe(book_file, symbol, timestamp)
+        finally:
+            book_file.close()
+        if keyframe:
+            break
+
+    builder = ArcaBookBuilder(symbol, h5_file)
+    amd_file = openFile(amd_path)
+    try:
+        records = amd_file.root._AMD_Data_.records
+        start = 0
+        if keyframe:
+            keyframe_ts, seqnum, line, orders = keyframe
+            if 'line' not in records.colnames:
+                raise RuntimeError("%s has no lines to find keyframes in" % amd_path)
+            logging.info("Replaying %s from keyframe at %s" % (symbol, fast_chicago_time_str(keyframe_ts)))
+            builder.load_keyframe(orders)
+            start = bisect_right(records.cols.line, line)
+        for chunk in range(start, records.nrows, __REPLAY_ROWS__):
+            stop = min(chunk + __REPLAY_ROWS__, records.nrows)
+            late = flatnonzero(records.read(chunk, stop, field='ts') > timestamp)
+            if len(late):
+                stop = chunk + late[0]
+            rows = records.readWhere('symbol == %r' % symbol, start=chunk, stop=stop)
+            if len(rows):
+                for e, ts, line in builder.process_batch(records_batch(rows)):
+                    logging.info("%s: %s at line %d" % (symbol, e, line+1))
+            if len(late):
+                break
+    finally:
+        amd_file.close()
+    return builder
 
 if __name__ == "__main__":
     import argparse
@@ -442,6 +1227,143 @@ files for symbols present in the raw data.
                         action='store_true',
                         help='Overwrite existing files')
 
+    parser.add_argument('-b', '--block', 
+                        dest='block_mode',
+                        action='store_true',
+                        help='Decode the input in blocks rather than line by line')
+
+    parser.add_argument('-j', '--shards', 
+                        dest='shards',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Number of book building processes, each owning a share of the symbols')
+
+    parser.add_argument('--no-timestamp-s', 
+                        dest='store_timestamp_s',
+                        action='store_false',
+                        help='Do not store the timestamp_s column with the books')
+
+    parser.add_argument('--buffer-rows', 
+                        dest='buffer_rows',
+                        action='store',
+                        type=int,
+                        default=__BUFFER_ROWS__,
+                        help='Number of book rows buffered per table between appends')
+
+    parser.add_argument('--storage', 
+                        dest='storage',
+                        action='store',
+                        choices=storage_profile_names(),
+                        default=None,
+                        help='Storage profile for the book tables (see auction.storage)')
+
+    parser.add_argument('--columnar', 
+                        dest='book_layout',
+                        action='store_const',
+                        const='columns',
+                        default='rows',
+                        help='Store books an array per field and level (see BookColumns)')
+
+    parser.add_argument('--deltas', 
+                        dest='book_layout',
+                        action='store_const',
+                        const='deltas',
+                        help='Store only the levels changed per book (see BookDeltas)')
+
+    parser.add_argument('--compact', 
+                        dest='book_layout',
+                        action='store_const',
+                        const='compact',
+                        help='Store book levels as int32 tick offsets (see CompactBooks)')
+
+    parser.add_argument('--bbo', 
+                        dest='bbo',
+                        action='store_true',
+                        help='Also write a bbo table of the top of book changes (see BboTable)')
+
+    parser.add_argument('--checkpoint-lines', 
+                        dest='checkpoint_lines',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Checkpoint the parse every this many input lines, to --resume from')
+
+    parser.add_argument('--resume', 
+                        dest='resume',
+                        action='store_true',
+                        help='Continue the parse from its last checkpoint, if any')
+
+    parser.add_argument('--stale', 
+                        dest='stale',
+                        action='store_true',
+                        help='Rebuild existing files whose input, parser version or options changed')
+
+    parser.add_argument('--dry-run', 
+                        dest='dry_run',
+                        action='store_true',
+                        help='Only list the files that would be built and why')
+
+    parser.add_argument('--writer-queue', 
+                        dest='writer_queue',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Append books on a background thread queueing up to this many row blocks')
+
+    parser.add_argument('--blocked', 
+                        dest='blocked',
+                        action='store_true',
+                        help='Read the block compressed copies of the inputs (see block_gzip)')
+
+    parser.add_argument('--start-line', 
+                        dest='start_line',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Zero based line of the input to start at')
+
+    parser.add_argument('--stop-line', 
+                        dest='stop_line',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Zero based line of the input to stop before')
+
+    parser.add_argument('--start-time', 
+                        dest='start_time',
+                        action='store',
+                        help='Chicago time (HH:MM:SS) of the first record to include')
+
+    parser.add_argument('--stop-time', 
+                        dest='stop_time',
+                        action='store',
+                        help='Chicago time (HH:MM:SS) to stop before')
+
+    parser.add_argument('--keyframe-seconds', 
+                        dest='keyframe_seconds',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Write a keyframe of each book\'s orders every this many seconds (see replay_from)')
+
+    parser.add_argument('--keyframe-events', 
+                        dest='keyframe_events',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Write a keyframe of each book\'s orders every this many of its records')
+
+    parser.add_argument('--amd', 
+                        dest='amd',
+                        action='store_true',
+                        help='Write the records as an _AMD_.h5 archive, of all symbols unless given, rather than books')
+
+    parser.add_argument('--replay', 
+                        dest='replay',
+                        action='store_true',
+                        help='Build books from the _AMD_.h5 archives rather than the gz files')
+
     parser.add_argument('-v', '--verbose', 
                         dest='verbose',
                         action='store_true',
@@ -452,16 +1374,30 @@ files for symbols present in the raw data.
     if options.verbose:
         logging.basicConfig(level=logging.INFO)
 
+    src_path = options.blocked and (DATA_PATH / 'NYSE_ARCA2_BLOCKED') or __ARCA_SRC_PATH__
+    src_pattern = '*.gz'
+    if options.replay:
+        src_path, src_pattern = __ARCA_OUT_PATH__, '*_AMD_.h5'
     src_compressed_files = []
     if options.dates:
-        all_files = __ARCA_SRC_PATH__.files()
+        all_files = src_path.files(src_pattern)
         for date in options.dates:
             src_compressed_files += filter(lambda f: f.find(date)>=0, all_files)
     else:
-        src_compressed_files = __ARCA_SRC_PATH__.files()
+        src_compressed_files = src_path.files(src_pattern)
+
+    def chicago_timestamp(date, hhmmss):
+        if not hhmmss:
+            return 0
+        fields = map(int, hhmmss.split(':')) + [0, 0]
+        return start_of_date(date.year, date.month, date.day, CHI_TZ) + \
+            (fields[0]*3600 + fields[1]*60 + fields[2])*1000000
 
     symbol_text = None
-    if not options.symbols:
+    if not options.symbols and options.amd:
+        options.symbols = []
+        symbol_text = 'ALL'
+    elif not options.symbols:
         options.symbols = [ 
             # Index ETFs
             'SPY', 'DIA', 'QQQ', 
@@ -497,5 +1433,24 @@ files for symbols present in the raw data.
         if date:
             parser = ArcaParser(compressed_src, date, symbol_text, Set(options.symbols))
             #parser.parse(True, 50000)
-            parser.parse(True, False)
+            reason = parser.parse(not options.amd,
+                         run_options=RunOptions(block_mode=options.block_mode, shards=options.shards,
+                                                start_line=options.start_line,
+                                                stop_line=options.stop_line,
+                                                start_time=chicago_timestamp(date, options.start_time),
+                                                stop_time=chicago_timestamp(date, options.stop_time),
+                                                checkpoint_lines=options.checkpoint_lines,
+                                                resume=options.resume, force=options.force,
+                                                stale=options.stale, dry_run=options.dry_run,
+                                                replay=options.replay,
+                                                keyframe_seconds=options.keyframe_seconds,
+                                                keyframe_events=options.keyframe_events),
+                         book_options=BookOptions(store_timestamp_s=options.store_timestamp_s,
+                                                  buffer_rows=options.buffer_rows,
+                                                  writer_queue=options.writer_queue,
+                                                  storage=options.storage,
+                                                  book_layout=options.book_layout,
+                                                  bbo=options.bbo))
+            if options.dry_run and reason:
+                print "Would build", compressed_src.basename(), date, ":", reason
 
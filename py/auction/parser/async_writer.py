@@ -0,0 +1,139 @@
+###############################################################################
+#
+# File: async_writer.py
+#
+# Description: Background thread appending blocks of rows to hdf5 tables, so
+#              compression of the chunks overlaps with parsing
+#
+##############################################################################
+from attribute import readable
+from numpy import zeros
+from Queue import Queue, Full
+from threading import Thread, RLock
+import time
+
+__QUEUE_DEPTH__ = 8
+__BLOCK_ROWS__ = 4096
+
+# The hdf5 library is not thread safe. While an AsyncWriter is running every
+# hdf5 call, from any thread, must be made holding this lock.
+h5_lock = RLock()
+
+class AsyncWriter(object):
+    """
+    Appends blocks of rows to their tables on a dedicated thread. Blocks are
+    handed over through a queue of at most queue_depth blocks; when it is
+    full the parsing thread waits. PyTables releases the GIL while appending
+    (including zlib compression of the chunks), so the appends overlap with
+    parsing on another cpu.
+
+    Tracks the deepest the queue has been and the total seconds the parsing
+    thread has waited on a full queue.
+    """
+    readable(max_depth = 0, stall = 0.0)
+
+    def __init__(self, queue_depth = __QUEUE_DEPTH__):
+        self.__queue = Queue(queue_depth)
+        self.__max_depth = 0
+        self.__stall = 0.0
+        self.__error = None
+        self.__thread = Thread(target=self.__write_blocks)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __write_blocks(self):
+        for table, rows in iter(self.__queue.get, None):
+            try:
+                if not self.__error:
+                    with h5_lock:
+                        table.append(rows)
+            except Exception as e:
+                self.__error = e
+            self.__queue.task_done()
+        self.__queue.task_done()
+
+    def append(self, table, rows):
+        """
+        Queue the rows, a numpy structured array no longer to be modified by
+        the caller, to be appended to the table
+        """
+        self.check()
+        try:
+            self.__queue.put_nowait((table, rows))
+        except Full:
+            start = time.time()
+            self.__queue.put((table, rows))
+            self.__stall += time.time() - start
+        self.__max_depth = max(self.__max_depth, self.__queue.qsize())
+
+    def join(self):
+        """
+        Wait for all queued blocks to be appended
+        """
+        self.__queue.join()
+        self.check()
+
+    def close(self):
+        """
+        Append all queued blocks and stop the thread
+        """
+        self.__queue.put(None)
+        self.__thread.join()
+        self.check()
+
+    def check(self):
+        """
+        Raise any error the writer thread hit
+        """
+        if self.__error:
+            raise RuntimeError("Background write failed: " + str(self.__error))
+
+class BlockRows(object):
+    """
+    Collects rows for a table into numpy blocks of block_rows rows, handing
+    each full block to an AsyncWriter, or appending it directly if writer is
+    None. Each append() takes a tuple of values for the given columns, in
+    that order. Table columns not given take their defaults.
+    """
+
+    def __init__(self, table, columns, writer, block_rows = __BLOCK_ROWS__):
+        self.__table = table
+        self.__columns = tuple(columns)
+        self.__writer = writer
+        self.__block_rows = block_rows
+        self.__dtype = [ (name, table.dtype[name]) for name in self.__columns ]
+        if self.__columns == tuple(table.colnames):
+            self.__defaults = None
+        else:
+            self.__defaults = zeros(1, dtype=table.dtype)
+            for name, value in table.coldflts.iteritems():
+                self.__defaults[name] = value
+        self.__block = zeros(block_rows, dtype=self.__dtype)
+        self.__index = 0
+
+    def append(self, values):
+        self.__block[self.__index] = values
+        self.__index += 1
+        if self.__index == self.__block_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Hand the rows collected so far to the writer. The block is emptied
+        first, so should the append fail those rows are lost but later
+        rows still collect into a fresh block.
+        """
+        if not self.__index:
+            return
+        rows = self.__block[:self.__index]
+        self.__block = zeros(self.__block_rows, dtype=self.__dtype)
+        self.__index = 0
+        if self.__defaults is not None:
+            ordered = self.__defaults.repeat(len(rows))
+            for name in self.__columns:
+                ordered[name] = rows[name]
+            rows = ordered
+        if self.__writer:
+            self.__writer.append(self.__table, rows)
+        else:
+            self.__table.append(rows)
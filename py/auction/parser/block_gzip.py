@@ -0,0 +1,243 @@
+###############################################################################
+#
+# File: block_gzip.py
+#
+# Description: Block compressed copies of gzipped source files with a sidecar
+#              index for random access
+#
+##############################################################################
+from path import path
+from attribute import readable
+from auction.paths import *
+from tables import *
+from numpy import searchsorted, maximum
+import gzip
+import zlib
+import logging
+
+__BLOCK_SIZE__ = 1 << 22
+__COMPRESS_LEVEL__ = 6
+__GZIP_WBITS__ = 31
+
+class BlockIndexRecord(IsDescription):
+    """
+    One record per gzip member of a block compressed file
+    """
+    offset      = Int64Col() # byte offset of the member in the compressed file
+    length      = Int64Col() # compressed length of the member
+    size        = Int64Col() # uncompressed length of the member
+    line        = Int64Col() # zero based line number of first line in the member
+    line_count  = Int64Col()
+    timestamp   = Int64Col() # timestamp of first record in the member, 0 if none
+
+def index_path(data_path):
+    """
+    Path to the sidecar index for a block compressed file
+    """
+    return path(data_path + '.idx')
+
+def line_blocks(stream, block_size=__BLOCK_SIZE__):
+    """
+    Read the stream in blocks of roughly block_size bytes, each ending on a
+    line boundary (except possibly the last)
+    """
+    carry = ''
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        if carry:
+            data = carry + data
+        cut = data.rfind('\n') + 1
+        carry = data[cut:]
+        if cut:
+            yield data[:cut]
+    if carry:
+        yield carry
+
+def recompress(src, dst, timestamp_of=None, block_size=__BLOCK_SIZE__,
+               level=__COMPRESS_LEVEL__):
+    """
+    Recompress the gzip file src into dst as a sequence of independent gzip
+    members, each holding about block_size bytes of whole lines. The result
+    is still a valid gzip file (readable by gzip.open, zcat, ...). A sidecar
+    index records where each member starts, its first line number and, if
+    timestamp_of is given, the timestamp of its first record as returned by
+    timestamp_of(block).
+    """
+    src = path(src)
+    dst = path(dst)
+    if not dst.parent.exists():
+        dst.parent.makedirs()
+    in_progress = path(dst + '.in_progress')
+    index_in_progress = path(index_path(dst) + '.in_progress')
+    out = open(in_progress, 'wb')
+    index_file = openFile(index_in_progress, mode="w", title="Block index")
+    table = index_file.createTable('/', 'blocks', BlockIndexRecord,
+                                   "Blocks of " + str(src.basename()))
+    row = table.row
+    offset = 0
+    line = 0
+    for block in line_blocks(gzip.open(src, 'rb'), block_size):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, __GZIP_WBITS__)
+        member = compressor.compress(block) + compressor.flush()
+        out.write(member)
+        line_count = block.count('\n')
+        row['offset'] = offset
+        row['length'] = len(member)
+        row['size'] = len(block)
+        row['line'] = line
+        row['line_count'] = line_count
+        row['timestamp'] = (timestamp_of and timestamp_of(block)) or 0
+        row.append()
+        offset += len(member)
+        line += line_count
+        if 0 == table.nrows % 100:
+            logging.info("%s: %d lines in %d blocks" % (dst.basename(), line, table.nrows))
+
+    out.close()
+    index_file.close()
+    in_progress.rename(dst)
+    index_in_progress.rename(index_path(dst))
+
+class BlockGzipIndex(object):
+    r"""
+
+Random access into a block compressed file (see recompress) by line number
+or by timestamp
+
+"""
+
+    readable(data_path=None, blocks=None)
+
+    @staticmethod
+    def find(data_path):
+        """
+        The index for data_path, or None if it has not been block compressed
+        """
+        if index_path(data_path).exists():
+            return BlockGzipIndex(data_path)
+        return None
+
+    def __init__(self, data_path):
+        self.__data_path = path(data_path)
+        index_file = openFile(index_path(data_path))
+        self.__blocks = index_file.root.blocks.read()
+        index_file.close()
+        # Blocks with no records carry the timestamp of the block before
+        self.__timestamps = maximum.accumulate(self.__blocks['timestamp'])
+
+    def block_for_line(self, line):
+        """
+        Index of the block containing the line
+        """
+        return max(searchsorted(self.__blocks['line'], line, 'right') - 1, 0)
+
+    def block_for_time(self, ts):
+        """
+        Index of the block with the first record at or after timestamp ts.
+        Since records with the same timestamp may span blocks this is the
+        block before the first one starting at or after ts.
+        """
+        return max(searchsorted(self.__timestamps, ts, 'left') - 1, 0)
+
+    def open(self, block=0):
+        """
+        Open the file for reading from the start of the block onward.
+        Returns tuple (stream, line number of first line in stream)
+        """
+        f = open(self.__data_path, 'rb')
+        f.seek(self.__blocks['offset'][block])
+        return (gzip.GzipFile(fileobj=f, mode='rb'), int(self.__blocks['line'][block]))
+
+    def lines(self, line, count=1):
+        """
+        Get count lines starting at the zero based line number
+        """
+        stream, current = self.open(self.block_for_line(line))
+        result = []
+        for text in stream:
+            if current >= line:
+                result.append(text)
+                if len(result) == count:
+                    break
+            current += 1
+        stream.close()
+        return result
+
+if __name__ == "__main__":
+    import argparse
+    from auction.time_utils import *
+    from auction.parser.arca_block_parser import decode_block
+
+    parser = argparse.ArgumentParser("""
+Recompress raw ARCA data files into independently compressed blocks with a
+sidecar index, allowing parses to start at a line or time and warnings to be
+looked up by line.
+""")
+
+    parser.add_argument('-d', '--date',
+                        dest='dates',
+                        action='store',
+                        nargs='*',
+                        help='Date(s) to process, if empty all dates assumed')
+
+    parser.add_argument('-l', '--line',
+                        dest='line',
+                        action='store',
+                        type=int,
+                        help='Show lines of the (first) file starting at this line number (as in ParseWarnings src_line)')
+
+    parser.add_argument('-c', '--count',
+                        dest='count',
+                        action='store',
+                        type=int,
+                        default=1,
+                        help='Number of lines to show')
+
+    parser.add_argument('-f', '--force',
+                        dest='force',
+                        action='store_true',
+                        help='Overwrite existing files')
+
+    parser.add_argument('-v', '--verbose',
+                        dest='verbose',
+                        action='store_true',
+                        help='Output extra logging information')
+
+    options = parser.parse_args()
+
+    if options.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    __ARCA_SRC_PATH__ = DATA_PATH / 'NYSE_ARCA2'
+    __ARCA_BLOCKED_PATH__ = DATA_PATH / 'NYSE_ARCA2_BLOCKED'
+
+    src_files = __ARCA_SRC_PATH__.files('*.csv.gz')
+    if options.dates:
+        src_files = filter(lambda f: any(f.find(d) >= 0 for d in options.dates), src_files)
+
+    for src in sorted(src_files):
+        dst = __ARCA_BLOCKED_PATH__ / src.basename()
+
+        if options.line is not None:
+            index = BlockGzipIndex.find(dst)
+            if not index:
+                print "No block index for", src.basename()
+            else:
+                for text in index.lines(options.line - 1, options.count):
+                    print text,
+            break
+
+        if dst.exists() and not options.force:
+            continue
+
+        date = get_date_of_file(src)
+        sod = start_of_date(date.year, date.month, date.day, NY_TZ)
+
+        def first_timestamp(block):
+            batch = decode_block(block[:block.find('\n', 1 << 16) + 1] or block, sod)[0]
+            return len(batch) and int(batch['timestamp'][0])
+
+        print "Recompressing", src.basename()
+        recompress(src, dst, first_timestamp)
@@ -0,0 +1,122 @@
+###############################################################################
+#
+# File: checkpoint.py
+#
+# Description: Periodic checkpoints of a long parse, so one that dies part
+#              way through can resume from the last of them
+#
+##############################################################################
+from attribute import readable
+from path import path
+from auction.parser.async_writer import h5_lock
+from auction.parser.utils import BookBuilder
+import cPickle as pickle
+import logging
+import os
+
+# Input lines between checkpoints
+__CHECKPOINT_LINES__ = 5000000
+
+def h5_nodes(h5_file):
+    """
+    Tuple (group paths, { leaf path : rows }) of every group and leaf in the
+    file
+    """
+    groups = [ group._v_pathname for group in h5_file.walkGroups() ]
+    leaves = dict((leaf._v_pathname, leaf.nrows) for leaf in h5_file.walkNodes('/', 'Leaf'))
+    return (groups, leaves)
+
+def truncate_nodes(h5_file, groups, leaves):
+    """
+    Return the file to when h5_nodes gave the groups and leaves: remove the
+    groups and leaves created since and truncate the others to their rows
+    then
+    """
+    groups = set(groups)
+    for group_path in [ group._v_pathname for group in h5_file.walkGroups() ]:
+        if group_path not in groups and group_path in h5_file:
+            h5_file.removeNode(group_path, recursive=True)
+    for leaf in list(h5_file.walkNodes('/', 'Leaf')):
+        rows = leaves.get(leaf._v_pathname)
+        if rows is None:
+            leaf.remove()
+        elif leaf.nrows < rows:
+            raise RuntimeError("%s has %d rows, fewer than the %d at the checkpoint" %
+                               (leaf._v_pathname, leaf.nrows, rows))
+        elif leaf.nrows > rows:
+            leaf.truncate(rows)
+    h5_file.flush()
+
+class Checkpoint(object):
+    """
+    Saves the state of a parse to checkpoint_path every so many input lines
+    and, when resuming, returns its output file to that state.
+
+    Each save writes out the rows buffered for the output file and flushes
+    it, then pickles the state given by the parser - whatever it needs to
+    continue (input position, builder state, ...) - with the rows of every
+    table. The checkpoint file is replaced by a rename, so dying while
+    saving leaves the previous checkpoint. Restoring truncates each table to
+    its rows at the checkpoint and removes tables and groups created after
+    it.
+
+    HDF5 does not journal its metadata, so a process killed while writing
+    can leave the output unreadable, in which case the parse has to start
+    over.
+    """
+    readable(checkpoint_path=None, every=__CHECKPOINT_LINES__, saved_line=0)
+
+    def __init__(self, checkpoint_path, every = __CHECKPOINT_LINES__):
+        self.__checkpoint_path = path(checkpoint_path)
+        self.__every = every
+        self.__saved_line = 0
+
+    def due(self, line):
+        """
+        True if every or more lines have passed since the last checkpoint
+        """
+        return bool(self.__every) and line - self.__saved_line >= self.__every
+
+    def save(self, h5_file, line, state):
+        """
+        Checkpoint the parse writing h5_file with line the next input line
+        to parse and state a dict of anything else needed to continue
+        """
+        BookBuilder.sync_books(h5_file)
+        with h5_lock:
+            h5_file.flush()
+            groups, leaves = h5_nodes(h5_file)
+        state = dict(state, line=line, groups=groups, leaves=leaves)
+        saving = path(self.__checkpoint_path + '.saving')
+        with open(saving, 'wb') as checkpoint_file:
+            pickle.dump(state, checkpoint_file, pickle.HIGHEST_PROTOCOL)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.rename(saving, self.__checkpoint_path)
+        self.__saved_line = line
+        logging.info("Checkpoint at line %d in %s" % (line, self.__checkpoint_path))
+
+    def load(self):
+        """
+        The state of the last checkpoint, including its 'line', or None if
+        there is none
+        """
+        if not self.__checkpoint_path.exists():
+            return None
+        with open(self.__checkpoint_path, 'rb') as checkpoint_file:
+            state = pickle.load(checkpoint_file)
+        self.__saved_line = state['line']
+        return state
+
+    def restore(self, h5_file, state):
+        """
+        Truncate the output file, opened for append, to the loaded state
+        """
+        truncate_nodes(h5_file, state['groups'], state['leaves'])
+
+    def remove(self):
+        """
+        Discard the checkpoint, once the parse has completed
+        """
+        if self.__checkpoint_path.exists():
+            self.__checkpoint_path.remove()
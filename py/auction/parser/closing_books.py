@@ -0,0 +1,71 @@
+###############################################################################
+#
+# File: closing_books.py
+#
+# Description: Snapshot of the closing level books of each symbol of a day,
+#              seeding the books of the next day's parse
+#
+##############################################################################
+from auction.book import ClosingBookTable
+from tables import *
+
+__CLOSING_BOOKS__ = 'closing_books'
+
+def write_closing_books(h5_file, books, **attrs):
+    """
+    Store books, a dict of symbol to (bid_book, ask_book) as the CME book
+    builders keep them - a list per side of (px, qty) or None per level -
+    in the closing_books table of the file. attrs are kept with it, other
+    state of the parse carried from one day into the next.
+    """
+    table = h5_file.createTable('/', __CLOSING_BOOKS__, ClosingBookTable,
+                                "Closing books by symbol")
+    for name, value in attrs.iteritems():
+        setattr(table.attrs, name, value)
+    row = table.row
+    symbol_size = table.coldtypes['symbol'].itemsize
+    for symbol in sorted(books):
+        if len(symbol) > symbol_size:
+            raise RuntimeError("Symbol %s longer than the %d characters of %s" %
+                               (symbol, symbol_size, __CLOSING_BOOKS__))
+        row['symbol'] = symbol
+        for side, book in zip(('bid', 'ask'), books[symbol]):
+            row[side] = [ pair or (0, 0) for pair in book ]
+            row[side + '_set'] = [ pair is not None for pair in book ]
+        row.append()
+    table.flush()
+
+def read_closing_books(h5_path):
+    """
+    Returns tuple (books, attrs) of the closing_books table of the file, as
+    write_closing_books stored them
+    """
+    h5_file = openFile(h5_path)
+    try:
+        children = h5_file.root._v_children
+        if __CLOSING_BOOKS__ not in children:
+            raise RuntimeError("%s has no %s to seed books from" % (h5_path, __CLOSING_BOOKS__))
+        table = children[__CLOSING_BOOKS__]
+        books = {}
+        for record in table.read():
+            books[record['symbol']] = tuple(
+                [ (int(level[0]), int(level[1])) if is_set else None
+                  for level, is_set in zip(record[side], record[side + '_set']) ]
+                for side in ('bid', 'ask'))
+        attrs = dict((name, getattr(table.attrs, name))
+                     for name in table.attrs._v_attrnamesuser)
+        return (books, attrs)
+    finally:
+        h5_file.close()
+
+def copy_closing_books(h5_path, seed_path):
+    """
+    Copy the closing_books of the output file h5_path to a file of their
+    own, to seed the next day from while h5_path is being rewritten
+    """
+    books, attrs = read_closing_books(h5_path)
+    seed_file = openFile(seed_path, mode="w", title="Closing books")
+    try:
+        write_closing_books(seed_file, books, **attrs)
+    finally:
+        seed_file.close()
@@ -1,5 +1,7 @@
 from auction.time_utils import *
+from auction.paths import *
 from auction.parser.cme_date_utils import CmeRawFileSet
+from auction.parser.closing_books import copy_closing_books
 from multiprocessing import Process, Pool
 from path import path
 import subprocess
@@ -11,26 +13,56 @@ if __name__ == "__main__":
     fileset = CmeRawFileSet()
     __HERE__ = path(os.path.realpath(__file__))
 
-    def generate_book_data(d):
-        record = fileset.date_map.get(d)
-        if not record:
-            print "NO SUNDAY DATA FOR", d
-            return
-        ftype = fileset.date_map[d]['type']
-        week_dates = fileset.start_dates[d]
-        args = [ "-d" ]
-        for wd in week_dates:
-            args.append(get_date_string(wd))
-        logging.info("Generating data for week of", d, "=>", fileset.start_dates[d])
-        sunday = get_date_string(d)
+    def generate_book_data(date_seed):
+        d, seed = date_seed
+        args = [ "-d", get_date_string(d) ]
+        if seed:
+            args += [ "--seed-path", seed ]
+        logging.info("Generating data for %s seeded from %s", d, seed)
 
-        if ftype == 'FFIX':
+        if fileset.date_map[d]['type'] == 'FFIX':
             pass
             #subprocess.call(["python", __HERE__.parent / "cme_fix_parser.py",] + args)
         else:
             subprocess.call(["python", __HERE__.parent / "cme_rlc_parser.py",] + args)
 
-    #pprint.pprint(fileset.start_dates)
+    ############################################################
+    # Each day's books start from the closing books of the day
+    # before it in its week. Where an earlier parse left those in
+    # the prior day's output they are copied aside, since that
+    # output may be rewritten in this run, and the day is parsed
+    # straight away. The other days wait for their prior day.
+    ############################################################
+    seeds = {}
+    for d in fileset.ordered_dates:
+        prior = fileset.prior_date(d)
+        if prior:
+            prior_output = CME_OUT_PATH / get_date_string(prior)
+            seed = CME_OUT_PATH / (get_date_string(prior) + '_closing_books')
+            if prior_output.exists():
+                try:
+                    copy_closing_books(prior_output, seed)
+                    seeds[d] = seed
+                except RuntimeError:
+                    pass
+
+    def seed_of(d):
+        if d in seeds:
+            return seeds[d]
+        prior = fileset.prior_date(d)
+        return prior and CME_OUT_PATH / get_date_string(prior)
+
     p = Pool(24)
-    p.map(generate_book_data, fileset.start_dates.keys())
+    parsed = set()
+    remaining = list(fileset.ordered_dates)
+    while remaining:
+        ready = [ d for d in remaining if d in seeds or
+                  fileset.prior_date(d) is None or fileset.prior_date(d) in parsed ]
+        p.map(generate_book_data, [ (d, seed_of(d)) for d in ready ])
+        parsed.update(ready)
+        remaining = [ d for d in remaining if d not in parsed ]
+        print "Parsed", len(ready), "days,", len(remaining), "waiting on their prior day"
+
+    for seed in seeds.values():
+        seed.remove()
     print "There are ", len(fileset.start_dates), "weeks"
@@ -61,6 +61,15 @@ class CmeRawFileSet(object):
         for d in self.__ordered_dates:
             self.__start_dates.setdefault(get_previous_weekday(d, Sunday), []).append(d)
 
+    def prior_date(self, date):
+        """
+        The date before date in its week, whose closing books the books of
+        date start from, None if date starts its week
+        """
+        week = self.__start_dates[get_previous_weekday(date, Sunday)]
+        index = week.index(date)
+        return week[index-1] if index else None
+
     def get_files(self, date_list):
         """Given list of dates, returns the file for each"""
         result = []
@@ -71,6 +80,19 @@ class CmeRawFileSet(object):
             result.append(record['fname'])
         return result
 
+def seed_path(fileset, files, options):
+    """
+    The file of closing books the --seed or --seed-path options of a CME
+    parser of the files start its books from, None to start them empty
+    """
+    if options.seed_path:
+        return path(options.seed_path)
+    if options.seed:
+        prior = fileset.prior_date(get_date_of_file(files[0]))
+        if prior:
+            return CME_OUT_PATH / get_date_string(prior)
+    return None
+
 if __name__ == "__main__":
     import pprint
     fileset = CmeRawFileSet()
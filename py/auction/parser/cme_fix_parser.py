@@ -10,10 +10,17 @@ from attribute import readable, writable, attribute
 from auction.paths import *
 from auction.book import Book, BookTable
 from auction.parser.parser_summary import ParseManager
-from auction.parser.utils import PriceOrderedDict, FileRecordCounter, BookBuilder
+from auction.parser.zip_lines import ZipMemberLines
+from auction.parser.closing_books import write_closing_books, read_closing_books
+from auction.parser.utils import PriceOrderedDict, FileRecordCounter, BookBuilder, \
+    BookOptions, __BUFFER_ROWS__
+from auction.storage import storage_profile_names
+from auction.instruments import get_instrument
 from auction.time_utils import *
 from tables import *
-from numpy import array_equal
+from numpy import array, array_equal
+from collections import deque
+from multiprocessing import Pool
 
 import os
 import zipfile
@@ -120,12 +127,35 @@ TradeCondition = inv_tags['TradeCondition']
 #     "\nrepeated\n\t", string.join(sorted_repeated, "\n\t"), \
 #     "\nnon-repeated\n\t", string.join(sets.Set(tags.values()).difference(repeated),"\n\t")
 
+# MD entry fields CmeBookBuilder.process_record uses, as decoded by
+# CmeRefreshDecoder into a column each
+__ENTRY_TAGS__ = (SecurityDesc, MDUpdateAction, MDEntryType, MDEntryPx, MDEntrySize,
+                  MDPriceLevel, QuoteCondition, TradeCondition, AggressorSide)
+
+# Most MD entries a refresh message is expected to hold, the columns grow if needed
+__MAX_ENTRIES__ = 64
+
 def readable_update(record):
     r = { tags.get(k, k):v for k,v in record.items() }
     return pprint.pformat(r)
 
 
 __BOOK_ENTRY_TYPES__ = [ BidEntryType, AskEntryType, TradeEntryType ]
+
+__UPDATE_ACTIONS__ = [ ActionNew, ActionChange, ActionDelete, ActionOverlay ]
+
+def entry_values(entries, index):
+    """
+    Tuple (entry_type, action, px, qty, level, quoted, trade_type) of MD
+    entry index of the refresh message decoded by entries (a
+    CmeRefreshDecoder), as CmeBookBuilder.apply_entry takes them. level is
+    zero based, trade_type 1 for a buy aggressor, 2 sell, 3 unknown.
+    """
+    side = entries.aggressor_side[index]
+    return (entries.entry_type[index], entries.update_action[index],
+            int(entries.entry_px[index] or 0), int(entries.entry_size[index] or 0),
+            int(entries.price_level[index] or -1)-1, bool(entries.quote_condition[index]),
+            (1 if side=='1' else 2) if side else 3)
         
 class CmeBookBuilder(BookBuilder):
 
@@ -174,56 +204,38 @@ class CmeBookBuilder(BookBuilder):
                 array_equal(previous_asks, self._asks):
             return False
         else:
-            self._record['bid'] = self._bids
-            self._record['ask'] = self._asks
-            self._record['timestamp'] = ts
-            self._record['timestamp_s'] = ts_s
-            self._record['seqnum'] = seqnum
-            self._record.append()
-            self._file_record_counter.increment_count()
+            self.append_book(ts, ts_s, seqnum)
             return True
 
-    def process_record(self, update, ts, chi_ts, seqnum):
+    def process_record(self, entries, index, ts, chi_ts, seqnum):
         """
-        Incorporate the contents of the new record into the bids/asks
+        Incorporate MD entry index of the refresh message decoded by entries
+        (a CmeRefreshDecoder) into the bids/asks
         """
-        #print readable_update(update)
-        #print pprint.pformat(update)
-        entry_type = update[MDEntryType]
+        self.apply_entry(entry_values(entries, index), entries.trade_condition[index],
+                         ts, chi_ts, seqnum, lambda: entries.entry(index))
 
-        action = update[MDUpdateAction]
-        px = int(update.get(MDEntryPx, 0))
-        qty = int(update.get(MDEntrySize, 0))
-        level = int(update.get(MDPriceLevel, -1))-1
+    def apply_entry(self, values, trade_condition, ts, chi_ts, seqnum, describe):
+        """
+        Incorporate an MD entry, as the tuple entry_values gives, into the
+        bids/asks. describe() gives the dict of the entry's fields for
+        reporting it.
+        """
+        entry_type, action, px, qty, level, quoted, trade_type = values
 
-        if update.get(QuoteCondition, None):
-            #print "Skipping", readable_update(update)
+        if quoted:
             return
 
-        if update[MDEntryType] == TradeEntryType:
+        if entry_type == TradeEntryType:
             if self._trade:
-                self._trade['timestamp'] = ts
-                self._trade['timestamp_s'] = chi_ts
-                self._trade['price'] = px
-                self._trade['quantity'] = qty
-                self._trade['seqnum'] = seqnum
-                side = update.get(AggressorSide)
-                if side:
-                    self._trade['trade_type'] = '1' if side=='1' else '2'
-                else:
-                    self._trade['trade_type'] = '3'
-                self._trade.append()
+                self.append_trade(ts, chi_ts, px, qty, trade_type, seqnum)
 
-                if update.get(TradeCondition):
-                    print "Trade", action, px, qty,"aggressor", update.get(AggressorSide), \
-                        "tradecondition", update.get(TradeCondition)
-
-                if update.get(QuoteCondition):
-                    print "Trade", action, px, qty,"aggressor", update.get(AggressorSide), \
-                        "quotecondition", update.get(QuoteCondition)
+                if trade_condition:
+                    print "Trade", action, px, qty,"trade type", trade_type, \
+                        "tradecondition", trade_condition
         else:
 
-            assert (level >= 0), "WARNING: bad level: %s"%readable_update(update)
+            assert (level >= 0), "WARNING: bad level: %s"%readable_update(describe())
 
             if action == ActionNew:
                 is_bid = entry_type == BidEntryType
@@ -265,8 +277,9 @@ class CmeBookBuilder(BookBuilder):
             elif action == ActionOverlay:
                 pass
             else:
-                print "INVALID UPDATE:", str(update)
-                raise RuntimeError("Invalid update: " + str(update))
+                update = readable_update(describe())
+                print "INVALID UPDATE:", update
+                raise RuntimeError("Invalid update: " + update)
 
             assert(len(self.__bid_book) == __LEVELS__)
             assert(len(self.__ask_book) == __LEVELS__)
@@ -316,6 +329,205 @@ class CmeRefreshMessage(object):
         #print "NoMDEntries", self.no_md_entries, "entries", len(self.entries), self.entries
         assert((not self.is_refresh_message()) or self.no_md_entries == len(self.entries))
 
+class CmeRefreshDecoder(object):
+    """
+    Decodes the incremental refresh (35=X) messages of a FIX line, reused
+    from one message to the next. The message type is checked first, so
+    other messages cost a find. Of a refresh only the header fields and the
+    __ENTRY_TAGS__ of its MD entries are extracted, by a regular expression
+    matching just those tags, into columns preallocated per entry: entry i
+    of the last message decoded is security_desc[i], update_action[i], ...
+    with None for a field the entry does not have.
+
+    An entry starts at each occurrence of the first tag after NoMDEntries,
+    the delimiter of the repeating group. CmeRefreshMessage is the reference
+    decoding of every tag.
+    """
+    readable(msg_seq_num=None, sending_time=None, count=0, security_desc=None,
+             update_action=None, entry_type=None, entry_px=None, entry_size=None,
+             price_level=None, quote_condition=None, trade_condition=None,
+             aggressor_side=None)
+
+    # regular expression per group delimiter matching the fields decoded
+    __fields_re = {}
+
+    def __init__(self, max_entries = __MAX_ENTRIES__):
+        self.__columns = [ [None]*max_entries for tag in __ENTRY_TAGS__ ]
+        self.__column_of = dict((tag, column) for column, tag in zip(self.__columns, __ENTRY_TAGS__))
+        (self.__security_desc, self.__update_action, self.__entry_type, self.__entry_px,
+         self.__entry_size, self.__price_level, self.__quote_condition, self.__trade_condition,
+         self.__aggressor_side) = self.__columns
+        self.__msg_seq_num = None
+        self.__sending_time = None
+        self.__count = 0
+
+    @staticmethod
+    def fields_re(delimiter):
+        """
+        Regular expression finding the (tag, value) of the header fields,
+        entry fields and group delimiter decoded
+        """
+        result = CmeRefreshDecoder.__fields_re.get(delimiter)
+        if result is None:
+            decoded = set(__ENTRY_TAGS__ + (MsgSeqNum, SendingTime, NoMDEntries, delimiter))
+            result = re.compile('\x01(%s)=([^\x01]*)' %
+                                '|'.join(sorted(decoded, key=len, reverse=True)))
+            CmeRefreshDecoder.__fields_re[delimiter] = result
+        return result
+
+    def entry(self, index):
+        """
+        Dict of the fields entry index has, by tag, as CmeRefreshMessage gives
+        them but for just the __ENTRY_TAGS__
+        """
+        return dict((tag, column[index]) for tag, column in zip(__ENTRY_TAGS__, self.__columns)
+                    if column[index] is not None)
+
+    def decode(self, line):
+        """
+        Decode the line if it is a refresh message, returning True, else
+        return False
+        """
+        start = line.find('\x0135=')
+        if start < 0 or line[start+4:start+6] != 'X\x01':
+            return False
+        entries = line.find('\x01' + NoMDEntries + '=', start)
+        if entries < 0:
+            delimiter = NoMDEntries
+        else:
+            first = line.find('\x01', entries + 1) + 1
+            delimiter = line[first:line.find('=', first)]
+        columns = self.__columns
+        column_of = self.__column_of.get
+        index = -1
+        expected = 0
+        for tag, value in CmeRefreshDecoder.fields_re(delimiter).findall(line, start):
+            if tag == delimiter:
+                index += 1
+                if index == len(columns[0]):
+                    for column in columns:
+                        column.extend([None]*len(column))
+                for column in columns:
+                    column[index] = None
+            column = column_of(tag)
+            if column is not None:
+                if index >= 0:
+                    column[index] = value
+            elif tag == MsgSeqNum:
+                self.__msg_seq_num = value
+            elif tag == SendingTime:
+                self.__sending_time = value
+            elif tag == NoMDEntries:
+                expected = int(value)
+        self.__count = index + 1
+        assert(expected == self.__count)
+        return True
+
+# Fields of a row of CmeRefreshBatch.messages, one per refresh message
+__MESSAGE_DTYPE__ = [ ('seqnum', 'i8'), ('timestamp', 'i8'), ('sending_time', 'S24'),
+                      ('entries', 'i4') ]
+
+# Fields of a row of CmeRefreshBatch.entries, one per MD entry: the index of
+# its symbol in the batch's symbols (-1 if it has none) and the values
+# entry_values gives. entry_type is '' if not one of __BOOK_ENTRY_TYPES__,
+# those entries being skipped, and action '?' if not one of __UPDATE_ACTIONS__.
+__ENTRY_DTYPE__ = [ ('symbol', 'i4'), ('entry_type', 'S1'), ('action', 'S1'), ('px', 'i8'),
+                    ('qty', 'i8'), ('level', 'i4'), ('quoted', '?'), ('trade_type', 'i1') ]
+
+# Bytes of a FIX zip member per block handed to a decode worker
+__DECODE_BLOCK_SIZE__ = 1 << 20
+
+class CmeRefreshBatch(object):
+    """
+    The refresh messages of a block of FIX lines, decoded into columns by
+    decode_refresh_block for CmeFixParser.build_books_from_batch to apply.
+    messages has a row per refresh message (__MESSAGE_DTYPE__) and entries
+    a row per MD entry (__ENTRY_DTYPE__), the entries of each message
+    following those of the one before.
+
+    The few entries needing their fields reported - those with a trade
+    condition, or bids/asks with a bad level or update action - have the
+    dict of them in details by entry row. An error decoding a message's
+    header or an entry's values is kept by message or entry row in
+    message_errors or entry_errors, to be raised when it is applied.
+    """
+    readable(lines=0, symbols=None, messages=None, entries=None, details=None,
+             message_errors=None, entry_errors=None)
+
+    def __init__(self, lines, symbols, messages, entries, details, message_errors,
+                 entry_errors):
+        self.__lines = lines
+        self.__symbols = symbols
+        self.__messages = messages
+        self.__entries = entries
+        self.__details = details
+        self.__message_errors = message_errors
+        self.__entry_errors = entry_errors
+
+def decode_refresh_block(chunk):
+    """
+    CmeRefreshBatch of the refresh messages in a block of whole FIX lines
+    (see ZipMemberLines.chunks). Run by the decode workers of CmeFixParser.
+    """
+    decoder = CmeRefreshDecoder()
+    # an unterminated last line of the member is a line too
+    lines = chunk.count("\n") + (not chunk.endswith("\n"))
+    symbol_ids = {}
+    messages = []
+    entries = []
+    details = {}
+    message_errors = {}
+    entry_errors = {}
+    for line in chunk.split("\n"):
+        if not decoder.decode(line):
+            continue
+        sending_time = decoder.sending_time
+        try:
+            messages.append((int(decoder.msg_seq_num),
+                             fast_timestamp_from_cme_timestamp(sending_time),
+                             sending_time, decoder.count))
+        except Exception,e:
+            message_errors[len(messages)] = e.message
+            messages.append((0, 0, sending_time or '', decoder.count))
+        for index in xrange(decoder.count):
+            symbol = decoder.security_desc[index]
+            symbol_id = -1 if symbol is None else symbol_ids.setdefault(symbol, len(symbol_ids))
+            entry_type = decoder.entry_type[index]
+            if not entry_type in __BOOK_ENTRY_TYPES__:
+                entries.append((symbol_id, '', '', 0, 0, -1, False, 0))
+                continue
+            try:
+                values = entry_values(decoder, index)
+            except Exception,e:
+                entry_errors[len(entries)] = e.message
+                entries.append((symbol_id, entry_type, '', 0, 0, -1, False, 0))
+                continue
+            action, level, quoted = values[1], values[4], values[5]
+            if decoder.trade_condition[index] or \
+                    (entry_type != TradeEntryType and not quoted and
+                     (level < 0 or action not in __UPDATE_ACTIONS__)):
+                details[len(entries)] = decoder.entry(index)
+            if action not in __UPDATE_ACTIONS__:
+                values = (entry_type, '?') + values[2:]
+            entries.append((symbol_id,) + values)
+    return CmeRefreshBatch(lines, sorted(symbol_ids, key=symbol_ids.get),
+                           array(messages, dtype=__MESSAGE_DTYPE__),
+                           array(entries, dtype=__ENTRY_DTYPE__),
+                           details, message_errors, entry_errors)
+
+def decode_batches(pool, chunks, depth):
+    """
+    The CmeRefreshBatch of each block of FIX lines, in order, decoded by
+    the pool of worker processes with up to depth blocks in flight
+    """
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(decode_refresh_block, (chunk,)))
+        if len(pending) >= depth:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
 class CmeFixParser(object):
     r"""
 
@@ -325,9 +537,24 @@ class CmeFixParser(object):
 
     match_all = re.compile(".*")
 
-    def __init__(self, input_paths):
+    def __init__(self, input_paths, book_options = None, decode_workers = 0,
+                 seed_path = None):
         """
+        book_options - BookOptions for writing the books and trades, None
+        for the defaults
+
+        decode_workers - if > 1 the lines are decoded by a pool of that many
+        worker processes, each taking a block of lines at a time into a
+        CmeRefreshBatch, while this process applies the batches to the books
+        in order. Decoding is stateless, only building books is sequential.
+
+        seed_path - output file of the day before the first day parsed, whose
+        closing books (see closing_books) the first day's books start from
+        rather than empty, as when that day is parsed in the same run
         """
+        self.__book_options = book_options or BookOptions()
+        self.__decode_workers = decode_workers
+        self.__seed_path = seed_path
         self.__input_paths = input_paths
         self.__book_builders = {}
         self.__prior_day_books = {}
@@ -345,10 +572,20 @@ class CmeFixParser(object):
         self.__parse_manager.data_stop(self.__ts)
         self.__parse_manager.irrelevants(0)
         self.__parse_manager.processed(self.__line_number+1)
+        self.__parse_manager.writer_stats(BookBuilder.flush_books(self.__h5_file))
+        self.write_closing_books()
         self.__parse_manager.mark_stop(True)
         self.__h5_file.close()
         ParseManager.summarize_file(self.__output_path)
 
+    def write_closing_books(self):
+        """
+        Snapshot the books of the day's symbols as they close
+        """
+        write_closing_books(self.__h5_file,
+                            dict((symbol, (builder.bid_book, builder.ask_book))
+                                 for symbol, builder in self.__book_builders.iteritems()))
+
     def advance_date(self, new_date):
         if self.__h5_file:
             self.write_summary()
@@ -360,107 +597,199 @@ class CmeFixParser(object):
         self.__h5_file = openFile(self.__output_path, mode="w", title="CME Fix Data")
         self.__parse_manager = ParseManager(self.__current_input_path, self.__h5_file)
         self.__parse_manager.mark_start()
+        if self.__book_options.writer_queue:
+            BookBuilder.start_writer(self.__h5_file, self.__book_options.writer_queue)
         self.__prior_day_books = {}
+        if self.__seed_path:
+            self.__prior_day_books = read_closing_books(self.__seed_path)[0]
+            self.__seed_path = None
         self.__data_start_timestamp = 0
         self.__ts = 0
         for symbol, builder in self.__book_builders.items():
             self.__prior_day_books[symbol] = (builder.bid_book, builder.ask_book)
         self.__book_builders = {}
 
-    def build_books(self, msg):
-        try:
-            ts = timestamp_from_cme_timestamp(msg.sending_time)
+    def advance_timestamp(self, ts, sending_time):
+        """
+        Make ts, parsed from the SendingTime of the next refresh message,
+        the current timestamp
+        """
+        if 0 == self.__line_number % 100000:
+            print "st:", sending_time, "vs", ts, "vs", chicago_time_str(ts)
 
-            if 0 == self.__line_number % 100000:
-                print "st:", msg.sending_time, "vs", ts, "vs", chicago_time_str(ts)
+        if self.__ts:
+            if ts < self.__ts:
+                print "At", self.__line_number+1, "of", self.__current_file, \
+                    "previous ts:", self.__chi_ts, "new:", fast_chicago_time_str(ts), \
+                    "SendingTime:", sending_time
+                assert False, "Timestamps going backward"
+
+        self.__ts = ts
+        self.__chi_ts = fast_chicago_time_str(self.__ts)
+
+        if 0 == self.__data_start_timestamp:
+            self.__data_start_timestamp = self.__ts
+
+    def book_builder(self, symbol):
+        """
+        The CmeBookBuilder of the symbol, created on its first entry
+        """
+        builder = self.__book_builders.get(symbol, None)
+        if not builder:
+            instrument = get_instrument(symbol, 'CME')
+            builder = CmeBookBuilder(symbol, self.__h5_file, 
+                                     self.__prior_day_books.get(symbol, None),
+                                     tick_size = instrument.tick_size,
+                                     price_scale = instrument.price_scale,
+                                     include_trades = True,
+                                     **self.__book_options.builder_args())
+            self.__book_builders[symbol] = builder
+        return builder
+
+    def write_books(self, affected_builders, seqnum):
+        """
+        Warn of locked or crossed books among those a refresh message
+        changed and write them
+        """
+        for builder in affected_builders:
+            top_bid = builder.top_bid()
+            top_ask = builder.top_ask()
+            if top_bid and top_ask:
+                if top_bid == top_ask:
+                    warning_msg = builder.symbol + ': Locked (%s, %s)'%(top_bid, top_ask)
+                    print warning_msg
+                    self.__parse_manager.warning(warning_msg, 'L', self.__ts, self.__line_number+1)
+                elif top_bid > top_ask:
+                    warning_msg = builder.symbol + ': Crossed (%s, %s)'%(top_bid, top_ask)
+                    print warning_msg
+                    self.__parse_manager.warning(warning_msg, 'C', self.__ts, self.__line_number+1)
+                if not builder.write_record(self.__ts, self.__chi_ts, seqnum):
+                    #print "Msg no book change", msg.line
+                    pass
 
-            if self.__ts:
-                if ts < self.__ts:
-                    print "At", self.__line_number+1, "of", self.__current_file, \
-                        "previous ts:", self.__chi_ts, "new:", chi_ts, \
-                        "Current Message:", pprint.pformat(msg)
-                    assert False, "Timestamps going backward"
+    def message_failed(self, e):
+        """
+        Warn of the error e raised building books from the current message
+        """
+        print traceback.format_exc()
+        self.__parse_manager.warning(self.__current_file + ':' + e.message, 
+                                     'G', self.__ts,
+                                     self.__line_number+1)
 
-            self.__ts = ts
-            self.__chi_ts = chicago_time_str(self.__ts)
+    def build_books(self, msg):
+        try:
+            self.advance_timestamp(fast_timestamp_from_cme_timestamp(msg.sending_time),
+                                   msg.sending_time)
 
-            if 0 == self.__data_start_timestamp:
-                self.__data_start_timestamp = self.__ts
             affected_builders = sets.Set()
-            for update in msg.entries:
-                symbol = update[SecurityDesc]
-                builder = self.__book_builders.get(symbol, None)
-                if not builder:
-                    builder = CmeBookBuilder(symbol, self.__h5_file, 
-                                             self.__prior_day_books.get(symbol, None),
-                                             include_trades = True)
-                    self.__book_builders[symbol] = builder
-
-                if not update[MDEntryType] in __BOOK_ENTRY_TYPES__:
+            for index in xrange(msg.count):
+                symbol = msg.security_desc[index]
+                if symbol is None:
+                    raise KeyError(SecurityDesc)
+                builder = self.book_builder(symbol)
+
+                if not msg.entry_type[index] in __BOOK_ENTRY_TYPES__:
                     continue
         
-                builder.process_record(update, self.__ts, self.__chi_ts, msg.msg_seq_num)
+                builder.process_record(msg, index, self.__ts, self.__chi_ts, msg.msg_seq_num)
                 affected_builders.add(builder)
 
-            for builder in affected_builders:
-                top_bid = builder.top_bid()
-                top_ask = builder.top_ask()
-                if top_bid and top_ask:
-                    if top_bid == top_ask:
-                        warning_msg = builder.symbol + ': Locked (%s, %s)'%(top_bid, top_ask)
-                        print warning_msg
-                        self.__parse_manager.warning(warning_msg, 'L', self.__ts, self.__line_number+1)
-                    elif top_bid > top_ask:
-                        warning_msg = builder.symbol + ': Crossed (%s, %s)'%(top_bid, top_ask)
-                        print warning_msg
-                        self.__parse_manager.warning(warning_msg, 'C', self.__ts, self.__line_number+1)
-                    if not builder.write_record(self.__ts, self.__chi_ts, msg.msg_seq_num):
-                        #print "Msg no book change", msg.line
-                        pass
+            self.write_books(affected_builders, msg.msg_seq_num)
 
         except Exception,e:
-            print traceback.format_exc()
-            self.__parse_manager.warning(self.__current_file + ':' + e.message, 
-                                         'G', self.__ts,
-                                         self.__line_number+1)
+            self.message_failed(e)
+
+    def build_books_from_batch(self, batch):
+        """
+        Build books from the refresh messages of a CmeRefreshBatch in turn,
+        as build_books does from each message decoded
+        """
+        symbols = batch.symbols
+        entries = batch.entries.tolist()
+        details = batch.details
+        message_errors = batch.message_errors
+        entry_errors = batch.entry_errors
+        first = 0
+        for message, (seqnum, ts, sending_time, count) in enumerate(batch.messages.tolist()):
+            try:
+                if message in message_errors:
+                    raise RuntimeError(message_errors[message])
+                self.advance_timestamp(ts, sending_time)
+
+                affected_builders = sets.Set()
+                for row in xrange(first, first + count):
+                    entry = entries[row]
+                    if entry[0] < 0:
+                        raise KeyError(SecurityDesc)
+                    builder = self.book_builder(symbols[entry[0]])
+
+                    if not entry[1]:
+                        continue
+
+                    if row in entry_errors:
+                        raise RuntimeError(entry_errors[row])
+                    detail = details.get(row)
+                    builder.apply_entry(entry[1:], detail and detail.get(TradeCondition),
+                                        self.__ts, self.__chi_ts, seqnum, lambda: detail)
+                    affected_builders.add(builder)
+
+                self.write_books(affected_builders, seqnum)
+
+            except Exception,e:
+                self.message_failed(e)
+            first += count
+            self.__line_number += 1
 
     def parse(self):
         i = 0
-        for zfile in self.input_paths:
-            self.__current_input_path = zfile
-            zfile = path(zfile)
-            print "ZF", zfile
-            date = get_date_of_file(zfile)
-            self.advance_date(date)
-
-            print "Processing zip file", zfile, "count", i
-            if not zfile.exists():
-                raise RuntimeError("Input path does not exist " + zfile)
-
-            root = zipfile.ZipFile(zfile, 'r')
-            files = root.namelist()
-            files.sort()
-            files.reverse()
-            for f in files:
-                print "Processing file", f, "count", i
-                self.__line_number = 0
-                self.__current_file = f
-                for line in root.read(f).split("\n"):
-                    i =i+1
-                    msg = CmeRefreshMessage(line)
-                    if not msg.is_refresh_message():
+        decoder = CmeRefreshDecoder()
+        # forked before any output is open
+        pool = Pool(self.__decode_workers) if self.__decode_workers > 1 else None
+        try:
+            for zfile in self.input_paths:
+                self.__current_input_path = zfile
+                zfile = path(zfile)
+                print "ZF", zfile
+                date = get_date_of_file(zfile)
+                self.advance_date(date)
+
+                print "Processing zip file", zfile, "count", i
+                if not zfile.exists():
+                    raise RuntimeError("Input path does not exist " + zfile)
+
+                root = zipfile.ZipFile(zfile, 'r')
+                files = root.namelist()
+                files.sort()
+                files.reverse()
+                for f in files:
+                    print "Processing file", f, "count", i
+                    self.__line_number = 0
+                    self.__current_file = f
+                    if pool:
+                        chunks = ZipMemberLines(root, f, __DECODE_BLOCK_SIZE__).chunks()
+                        for batch in decode_batches(pool, chunks, 2*self.__decode_workers):
+                            i += batch.lines
+                            self.build_books_from_batch(batch)
                         continue
-                    self.build_books(msg)
-                    self.__line_number += 1
-
-            print "Completed", i , "records"
+                    for line in ZipMemberLines(root, f):
+                        i =i+1
+                        if not decoder.decode(line):
+                            continue
+                        self.build_books(decoder)
+                        self.__line_number += 1
+
+                print "Completed", i , "records"
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
 
         self.write_summary()
 
 if __name__ == "__main__":
     import pprint
     import argparse
-    from auction.parser.cme_date_utils import CmeRawFileSet
+    from auction.parser.cme_date_utils import CmeRawFileSet, seed_path
 
     parser = argparse.ArgumentParser("""
 Take input raw data and generate corresponding hdf5 data files as well as book
@@ -473,6 +802,74 @@ files for the raw data.
                         nargs='+',
                         help='Date(s) to process, if empty all dates assumed')
 
+    parser.add_argument('--no-timestamp-s', 
+                        dest='store_timestamp_s',
+                        action='store_false',
+                        help='Do not store the timestamp_s column with the books and trades')
+
+    parser.add_argument('--buffer-rows', 
+                        dest='buffer_rows',
+                        action='store',
+                        type=int,
+                        default=__BUFFER_ROWS__,
+                        help='Number of book and trade rows buffered per table between appends')
+
+    parser.add_argument('--storage', 
+                        dest='storage',
+                        action='store',
+                        choices=storage_profile_names(),
+                        default=None,
+                        help='Storage profile for the book and trade tables (see auction.storage)')
+
+    parser.add_argument('--columnar', 
+                        dest='book_layout',
+                        action='store_const',
+                        const='columns',
+                        default='rows',
+                        help='Store books an array per field and level (see BookColumns)')
+
+    parser.add_argument('--deltas', 
+                        dest='book_layout',
+                        action='store_const',
+                        const='deltas',
+                        help='Store only the levels changed per book (see BookDeltas)')
+
+    parser.add_argument('--compact', 
+                        dest='book_layout',
+                        action='store_const',
+                        const='compact',
+                        help='Store book levels as int32 tick offsets (see CompactBooks)')
+
+    parser.add_argument('--bbo', 
+                        dest='bbo',
+                        action='store_true',
+                        help='Also write a bbo table of the top of book changes (see BboTable)')
+
+    parser.add_argument('--writer-queue', 
+                        dest='writer_queue',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Append books and trades on a background thread queueing up to this many row blocks')
+
+    parser.add_argument('--decode-workers', 
+                        dest='decode_workers',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Decode blocks of lines on this many worker processes, applying them to the books in order')
+
+    parser.add_argument('--seed', 
+                        dest='seed',
+                        action='store_true',
+                        help='Start the books of the first date from the closing books of the date before it in its week')
+
+    parser.add_argument('--seed-path', 
+                        dest='seed_path',
+                        action='store',
+                        default=None,
+                        help='Start the books of the first date from the closing books in this file')
+
     parser.add_argument('-v', '--verbose', 
                         dest='verbose',
                         action='store_true',
@@ -495,7 +892,15 @@ files for the raw data.
     print "Files are", pprint.pformat(files)
 
 
-    parser = CmeFixParser(files)
+    book_options = BookOptions(store_timestamp_s = options.store_timestamp_s,
+                               buffer_rows = options.buffer_rows,
+                               writer_queue = options.writer_queue,
+                               storage = options.storage,
+                               book_layout = options.book_layout,
+                               bbo = options.bbo)
+    parser = CmeFixParser(files, book_options = book_options,
+                          decode_workers = options.decode_workers,
+                          seed_path = seed_path(fileset, files, options))
     parser.parse()
     pprint.pprint(vars(parser))
 
@@ -10,7 +10,13 @@ from attribute import readable, writable, attribute
 from auction.paths import *
 from auction.book import Book, BookTable
 from auction.parser.parser_summary import ParseManager
-from auction.parser.utils import PriceOrderedDict, FileRecordCounter, BookBuilder
+from auction.parser.utils import PriceOrderedDict, FileRecordCounter, BookBuilder, \
+    BookOptions, __BUFFER_ROWS__
+from auction.parser.checkpoint import Checkpoint
+from auction.parser.zip_lines import ZipMemberLines
+from auction.parser.closing_books import write_closing_books, read_closing_books
+from auction.storage import storage_profile_names
+from auction.instruments import get_instrument
 from auction.time_utils import *
 from tables import *
 from copy import copy
@@ -27,8 +33,6 @@ import traceback
 import datetime
 
 __CME_SRC_PATH__ = DATA_PATH / 'CME_GLOBEX2'
-__CmeDateTimeRe__ = re.compile(r"(\d{4})(\d{2})(\d{2})(\d{2})(\d{2})(\d{2})")
-__SecondCentisecondRe__ = re.compile(r"(\d{2})(\d{2})")
 __BLANK_LINE__ = re.compile(r'^\s*$')
 __LEVELS__ = 10
 
@@ -40,17 +44,17 @@ class RlcRecord(object):
 
     @staticmethod
     def make_timestamp(date_time, seconds_centis):
-        m = __CmeDateTimeRe__.match(date_time)
-        assert m, "Invalid timestamp:" + date_time
-        year, mon, day, hr, minutes, sec = [ int(i) for i in m.groups() ]
-        result = datetime.datetime(int(year), int(mon), int(day),
-                                   int(hr),int(minutes),int(sec), 0,
-                                   tzinfo=CHI_TZ).astimezone(UTC_TZ)
-        m = __SecondCentisecondRe__.match(seconds_centis)
-        if m:
-            seconds, centisec = [ int(i) for i in m.groups() ]
-            result = result + datetime.timedelta(0, (seconds-sec)%60, centisec*10000)
-        return timestamp_from_datetime(result)
+        """
+        Timestamp of the chicago date_time (YYYYMMDDHHMMSS) with the seconds
+        and centiseconds of seconds_centis (SSCC) if given
+        """
+        assert len(date_time) == 14 and date_time.isdigit(), "Invalid timestamp:" + date_time
+        result = fast_chicago_timestamp(date_time)
+        if len(seconds_centis) >= 4 and seconds_centis[:4].isdigit():
+            seconds = int(seconds_centis[:2])
+            result += ((seconds - int(date_time[12:14])) % 60)*1000000 + \
+                int(seconds_centis[2:4])*10000
+        return result
 
     def is_book_message(self):
         return self.__msg_type == 'MA'
@@ -139,9 +143,9 @@ class CmeRlcBookBuilder(BookBuilder):
             level = update['level']
             self.__bid_book[level] = (update['buy_px'], update['total_buy'])
             self.__ask_book[level] = (update['sell_px'], update['total_sell'])
-        self.write_record(record.timestamp, chicago_time_str(record.timestamp))
+        self.write_record(record.timestamp)
 
-    def write_record(self, ts, ts_s):
+    def write_record(self, ts, ts_s=None):
         # copy from book to record
         for i, pair in enumerate(self.__bid_book):
             if pair == None:
@@ -159,24 +163,13 @@ class CmeRlcBookBuilder(BookBuilder):
                 self._asks[i][0] = pair[0]
                 self._asks[i][1] = pair[1]
 
-        self._record['bid'] = self._bids
-        self._record['ask'] = self._asks
-        self._record['timestamp'] = ts
-        self._record['timestamp_s'] = ts_s
-        self._record['seqnum'] = RlcRecord.sequence_number
-        self._record.append()
-        self._file_record_counter.increment_count()
+        self.append_book(ts, ts_s, RlcRecord.sequence_number)
 
     def write_trade(self, record):
         if self._trade:
-            self._trade['timestamp'] = record.timestamp
-            self._trade['timestamp_s'] = chicago_time_str(record.timestamp)
             trade_details = record.trade_details
-            self._trade['price'] = trade_details[0]
-            self._trade['quantity'] = trade_details[1]
-            self._trade['trade_type'] = trade_details[2]
-            self._trade['seqnum'] = RlcRecord.sequence_number
-            self._trade.append()
+            self.append_trade(record.timestamp, None, trade_details[0], trade_details[1],
+                              trade_details[2], RlcRecord.sequence_number)
         
 
 class CmeRlcParser(object):
@@ -188,9 +181,25 @@ class CmeRlcParser(object):
 
     match_all = re.compile(".*")
 
-    def __init__(self, input_path_list):
+    def __init__(self, input_path_list, book_options = None, checkpoint_lines = 0,
+                 seed_path = None):
         """
+        book_options - BookOptions for writing the books and trades, None
+        for the defaults. Rows are appended on this thread, so its
+        writer_queue must be 0.
+
+        checkpoint_lines - if > 0 the state of the parse is saved every that
+        many input lines, for parse(resume=True) to continue from
+
+        seed_path - output file of the day before the first day parsed, whose
+        closing books (see closing_books) the first day's books start from
+        rather than empty, as when that day is parsed in the same run
         """
+        self.__book_options = book_options or BookOptions()
+        if self.__book_options.writer_queue:
+            raise RuntimeError("CmeRlcParser appends rows on the parsing thread, not a writer queue")
+        self.__checkpoint_lines = checkpoint_lines
+        self.__seed_path = seed_path
         self.__input_path_list = copy(input_path_list)
         self.__book_builders = {}
         self.__h5_file = None
@@ -209,10 +218,21 @@ class CmeRlcParser(object):
         self.__parse_manager.data_stop(self.__current_timestamp)
         self.__parse_manager.irrelevants(0)
         self.__parse_manager.processed(self.__line_number+1)
+        BookBuilder.flush_books(self.__h5_file)
+        self.write_closing_books()
         self.__parse_manager.mark_stop(True)
         self.__h5_file.close()
         ParseManager.summarize_file(self.__output_path)
 
+    def write_closing_books(self):
+        """
+        Snapshot the books of the day's symbols as they close
+        """
+        write_closing_books(self.__h5_file,
+                            dict((symbol, (builder.bid_book, builder.ask_book))
+                                 for symbol, builder in self.__book_builders.iteritems()),
+                            sequence_number = RlcRecord.sequence_number)
+
     def advance_date(self, new_date):
         if self.__h5_file:
             self.write_summary()
@@ -225,6 +245,10 @@ class CmeRlcParser(object):
         self.__parse_manager = ParseManager(self.__current_input_path, self.__h5_file)
         self.__parse_manager.mark_start()
         self.__prior_day_books = {}
+        if self.__seed_path:
+            self.__prior_day_books, attrs = read_closing_books(self.__seed_path)
+            RlcRecord.sequence_number = int(attrs['sequence_number'])
+            self.__seed_path = None
         self.__data_start_timestamp = 0
         self.__current_timestamp = 0
         for symbol, builder in self.__book_builders.items():
@@ -232,15 +256,72 @@ class CmeRlcParser(object):
         self.__book_builders = {}
 
 
+    def resume_date(self, state):
+        """
+        Reopen the output of the day being parsed at the checkpoint state,
+        returning it and the builders to that state
+        """
+        self.__output_path = state['output_path']
+        logging.info("Resuming %s at line %d" % (self.__output_path, state['line']))
+        self.__h5_file = openFile(self.__output_path, mode="a")
+        self.__checkpoint.restore(self.__h5_file, state)
+        self.__parse_manager = ParseManager(self.__current_input_path, self.__h5_file, resume=True)
+        self.__parse_manager.mark_start()
+        self.__parse_manager.restore_state(state['parse_manager'])
+        self.__prior_day_books = state['prior_day_books']
+        self.__seed_path = None
+        self.__data_start_timestamp = state['data_start']
+        self.__current_timestamp = state['current_timestamp']
+        RlcRecord.sequence_number = state['sequence_number']
+        self.__book_builders = {}
+        for symbol, builder_state in state['builders'].iteritems():
+            self.create_builder(symbol, resume=True).restore_state(builder_state)
+
+    def checkpoint_path(self):
+        """
+        Where checkpoints of the parse are kept, named for its first day
+        """
+        return CME_OUT_PATH / (get_date_string(get_date_of_file(self.__input_path_list[0])) +
+                               '_RLC.checkpoint')
+
+    def save_checkpoint(self, line, path_index, file_index):
+        """
+        Checkpoint the parse, line lines in and at the current line of file
+        file_index of input path_index
+        """
+        builders = dict((symbol, builder.checkpoint_state())
+                        for symbol, builder in self.__book_builders.iteritems())
+        self.__checkpoint.save(self.__h5_file, line,
+                               dict(input_paths = self.__input_path_list,
+                                    path_index = path_index,
+                                    file_index = file_index,
+                                    line_number = self.__line_number,
+                                    output_path = self.__output_path,
+                                    prior_day_books = self.__prior_day_books,
+                                    data_start = self.__data_start_timestamp,
+                                    current_timestamp = self.__current_timestamp,
+                                    sequence_number = RlcRecord.sequence_number,
+                                    builders = builders,
+                                    parse_manager = self.__parse_manager.checkpoint_state()))
+
+    def create_builder(self, symbol, resume = False):
+        instrument = get_instrument(symbol, 'CME')
+        builder = CmeRlcBookBuilder(symbol, self.__h5_file, 
+                                    self.__prior_day_books.get(symbol, None),
+                                    tick_size = instrument.tick_size,
+                                    price_scale = instrument.price_scale,
+                                    include_trades = True,
+                                    resume = resume,
+                                    **self.__book_options.builder_args())
+        self.__book_builders[symbol] = builder
+        return builder
+
     def build_books(self, record):
         try:
             symbol = record.symbol
             builder = self.__book_builders.get(symbol)
             if not builder:
-                builder = CmeRlcBookBuilder(symbol, self.__h5_file, 
-                                            self.__prior_day_books.get(symbol, None),
-                                            include_trades = True)
-                self.__book_builders[symbol] = builder
+                builder = self.create_builder(symbol)
 
 
             if record.is_book_message():
@@ -254,19 +335,47 @@ class CmeRlcParser(object):
                                          'G', self.__current_timestamp,
                                          self.__line_number+1)
 
-    def parse(self):
+    def parse(self, resume = False):
+        """
+        Parse the input files, writing the books of each day to its own
+        file. With resume=True the parse continues from its last checkpoint,
+        if any (see Checkpoint).
+        """
+        self.__checkpoint = Checkpoint(self.checkpoint_path(), self.__checkpoint_lines)
+        resumed = resume and self.__checkpoint.load() or None
+        if resumed and resumed['input_paths'] != self.__input_path_list:
+            raise RuntimeError("Checkpoint %s is of a parse of %s" %
+                               (self.__checkpoint.checkpoint_path, resumed['input_paths']))
         i = 0
-        for p in self.__input_path_list:
+        for path_index, p in enumerate(self.__input_path_list):
+            resuming = resumed and path_index == resumed['path_index']
+            if resumed and path_index < resumed['path_index']:
+                continue
             self.__current_input_path = p
             date = get_date_of_file(p)
-            self.advance_date(date)
+            if resuming:
+                self.resume_date(resumed)
+                i = resumed['line']
+            else:
+                self.advance_date(date)
             root = zipfile.ZipFile(self.__current_input_path, 'r')
             files = root.namelist()
-            for f in files:
+            for file_index, f in enumerate(files):
+                skip_lines = 0
+                if resuming:
+                    if file_index < resumed['file_index']:
+                        continue
+                    if file_index == resumed['file_index']:
+                        skip_lines = resumed['line_number']
                 print "Processing file", f, "count", i
                 self.__line_number = 0
                 self.__current_file = f
-                for line in root.read(f).split("\n"):
+                for line in ZipMemberLines(root, f):
+                    if self.__line_number < skip_lines:
+                        self.__line_number += 1
+                        continue
+                    if self.__checkpoint.due(i):
+                        self.save_checkpoint(i, path_index, file_index)
                     i =i+1
                     if not  __BLANK_LINE__.match(line):
                         record = RlcRecord(line)
@@ -283,11 +392,12 @@ class CmeRlcParser(object):
 
             print "Completed", i , "records"
         self.write_summary()
+        self.__checkpoint.remove()
 
 if __name__ == "__main__":
     import pprint
     import argparse
-    from auction.parser.cme_date_utils import CmeRawFileSet
+    from auction.parser.cme_date_utils import CmeRawFileSet, seed_path
 
     parser = argparse.ArgumentParser("""
 Take input raw data and generate corresponding hdf5 data files as well as book
@@ -300,6 +410,72 @@ files for the raw data.
                         action='store',
                         help='Dates to process')
 
+    parser.add_argument('--no-timestamp-s', 
+                        dest='store_timestamp_s',
+                        action='store_false',
+                        help='Do not store the timestamp_s column with the books and trades')
+
+    parser.add_argument('--buffer-rows', 
+                        dest='buffer_rows',
+                        action='store',
+                        type=int,
+                        default=__BUFFER_ROWS__,
+                        help='Number of book and trade rows buffered per table between appends')
+
+    parser.add_argument('--storage', 
+                        dest='storage',
+                        action='store',
+                        choices=storage_profile_names(),
+                        default=None,
+                        help='Storage profile for the book and trade tables (see auction.storage)')
+
+    parser.add_argument('--columnar', 
+                        dest='book_layout',
+                        action='store_const',
+                        const='columns',
+                        default='rows',
+                        help='Store books an array per field and level (see BookColumns)')
+
+    parser.add_argument('--deltas', 
+                        dest='book_layout',
+                        action='store_const',
+                        const='deltas',
+                        help='Store only the levels changed per book (see BookDeltas)')
+
+    parser.add_argument('--compact', 
+                        dest='book_layout',
+                        action='store_const',
+                        const='compact',
+                        help='Store book levels as int32 tick offsets (see CompactBooks)')
+
+    parser.add_argument('--bbo', 
+                        dest='bbo',
+                        action='store_true',
+                        help='Also write a bbo table of the top of book changes (see BboTable)')
+
+    parser.add_argument('--checkpoint-lines', 
+                        dest='checkpoint_lines',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='Checkpoint the parse every this many input lines, to --resume from')
+
+    parser.add_argument('--resume', 
+                        dest='resume',
+                        action='store_true',
+                        help='Continue the parse from its last checkpoint, if any')
+
+    parser.add_argument('--seed', 
+                        dest='seed',
+                        action='store_true',
+                        help='Start the books of the first date from the closing books of the date before it in its week')
+
+    parser.add_argument('--seed-path', 
+                        dest='seed_path',
+                        action='store',
+                        default=None,
+                        help='Start the books of the first date from the closing books in this file')
+
     parser.add_argument('-v', '--verbose', 
                         dest='verbose',
                         action='store_true',
@@ -315,7 +491,14 @@ files for the raw data.
     if len(files) != len(options.dates):
         print "Mismatch on files:", options.date, "\nvs\n\t", files
         exit(-1)
-    parser = CmeRlcParser(files)
-    parser.parse()
+    book_options = BookOptions(store_timestamp_s = options.store_timestamp_s,
+                               buffer_rows = options.buffer_rows,
+                               storage = options.storage,
+                               book_layout = options.book_layout,
+                               bbo = options.bbo)
+    parser = CmeRlcParser(files, book_options = book_options,
+                          checkpoint_lines = options.checkpoint_lines,
+                          seed_path = seed_path(fileset, files, options))
+    parser.parse(options.resume)
     pprint.pprint(vars(parser))
 
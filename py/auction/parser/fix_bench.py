@@ -0,0 +1,151 @@
+###############################################################################
+#
+# File: fix_bench.py
+#
+# Description: Micro-benchmark of decoding the lines of a CME FIX zip member
+#              with CmeRefreshMessage and with CmeRefreshDecoder, and of the
+#              decode stage of CmeFixParser across worker processes
+#
+##############################################################################
+from auction.parser.cme_fix_parser import CmeRefreshMessage, CmeRefreshDecoder, \
+    __ENTRY_TAGS__, __DECODE_BLOCK_SIZE__, decode_refresh_block, decode_batches
+from auction.parser.zip_lines import ZipMemberLines
+from multiprocessing import Pool
+import zipfile
+import time
+
+def read_lines(zip_path, member = None):
+    """
+    Lines of the member of the zip file, by default its first
+    """
+    root = zipfile.ZipFile(zip_path, 'r')
+    member = member or sorted(root.namelist())[0]
+    return root.read(member).split("\n")
+
+def read_chunks(zip_path, member = None):
+    """
+    Blocks of whole lines of the member of the zip file, as CmeFixParser
+    hands them to its decode workers
+    """
+    root = zipfile.ZipFile(zip_path, 'r')
+    member = member or sorted(root.namelist())[0]
+    return list(ZipMemberLines(root, member, __DECODE_BLOCK_SIZE__).chunks())
+
+def message_entries(lines):
+    """
+    Returns tuple (seconds, entries) decoding the lines with
+    CmeRefreshMessage, entries being the (msg_seq_num, sending_time, entry
+    dicts of just the __ENTRY_TAGS__) of each refresh
+    """
+    result = []
+    start = time.time()
+    for line in lines:
+        msg = CmeRefreshMessage(line)
+        if msg.is_refresh_message():
+            result.append((msg.msg_seq_num, msg.sending_time,
+                           [ dict((tag, value) for tag, value in entry.iteritems()
+                                  if tag in __ENTRY_TAGS__) for entry in msg.entries ]))
+    return (time.time() - start, result)
+
+def decoder_entries(lines):
+    """
+    Returns tuple (seconds, entries) as message_entries but decoding with
+    CmeRefreshDecoder
+    """
+    result = []
+    decoder = CmeRefreshDecoder()
+    start = time.time()
+    for line in lines:
+        if decoder.decode(line):
+            result.append((decoder.msg_seq_num, decoder.sending_time,
+                           [ decoder.entry(index) for index in range(decoder.count) ]))
+    return (time.time() - start, result)
+
+def decode_seconds(lines, decode):
+    """
+    Seconds to decode the lines, doing nothing with the messages
+    """
+    start = time.time()
+    for line in lines:
+        decode(line)
+    return time.time() - start
+
+def batch_seconds(chunks, workers):
+    """
+    Seconds to decode the blocks of lines into CmeRefreshBatch, in this
+    process if workers <= 1 else on that many worker processes
+    """
+    if workers <= 1:
+        start = time.time()
+        for chunk in chunks:
+            decode_refresh_block(chunk)
+        return time.time() - start
+    pool = Pool(workers)
+    try:
+        start = time.time()
+        for batch in decode_batches(pool, chunks, 2*workers):
+            pass
+        return time.time() - start
+    finally:
+        pool.terminate()
+        pool.join()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("""
+Compare decoding the lines of a CME FIX zip member with CmeRefreshMessage and
+CmeRefreshDecoder
+""")
+
+    parser.add_argument('-i', '--input',
+                        dest='input',
+                        action='store',
+                        required=True,
+                        help='FIX zip file')
+
+    parser.add_argument('-m', '--member',
+                        dest='member',
+                        action='store',
+                        default=None,
+                        help='Member of the zip file, by default the first')
+
+    parser.add_argument('-r', '--repeat',
+                        dest='repeat',
+                        action='store',
+                        type=int,
+                        default=3,
+                        help='Take the best of this many runs')
+
+    parser.add_argument('-w', '--workers',
+                        dest='workers',
+                        action='store',
+                        type=int,
+                        nargs='*',
+                        default=[],
+                        help='Also time the decode stage into batches with each of these numbers of worker processes')
+
+    options = parser.parse_args()
+
+    lines = read_lines(options.input, options.member)
+    message_seconds, expected = message_entries(lines)
+    decoder_seconds, entries = decoder_entries(lines)
+    assert entries == expected
+    decoder = CmeRefreshDecoder()
+    results = [ ('CmeRefreshMessage',
+                 min(decode_seconds(lines, CmeRefreshMessage) for i in range(options.repeat))),
+                ('CmeRefreshDecoder',
+                 min(decode_seconds(lines, decoder.decode) for i in range(options.repeat))) ]
+    print "%d lines, %d refresh messages, %d entries" % \
+        (len(lines), len(entries), sum(len(msg[2]) for msg in entries))
+    for name, seconds in results:
+        print "%-20s %8.2f sec %10.0f lines/sec %6.2fx" % \
+            (name, seconds, len(lines)/seconds, results[0][1]/seconds)
+
+    if options.workers:
+        chunks = read_chunks(options.input, options.member)
+        results = [ (workers, min(batch_seconds(chunks, workers) for i in range(options.repeat)))
+                    for workers in options.workers ]
+        for workers, seconds in results:
+            print "batches %2d workers %8.2f sec %10.0f lines/sec %6.2fx" % \
+                (workers, seconds, len(lines)/seconds, results[0][1]/seconds)
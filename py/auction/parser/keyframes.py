@@ -0,0 +1,85 @@
+###############################################################################
+#
+# File: keyframes.py
+#
+# Description: Keyframes of the full order state of a book, written
+#              periodically by a parse so a replay can start from the latest
+#              one before a time rather than from the start of the day
+#
+##############################################################################
+from tables import *
+from numpy import flatnonzero
+from auction.storage import get_storage_profile
+from auction.parser.async_writer import h5_lock
+
+# Tables in the symbol's group holding its keyframes and their orders
+__KEYFRAMES__ = 'keyframes'
+__KEYFRAME_ORDERS__ = 'keyframe_orders'
+
+class KeyframeTable(IsDescription):
+    """
+    A keyframe: the orders of the book after the record at timestamp,
+    seqnum and line (zero based, of the input) were applied, stored as rows
+    [first_order, first_order+orders) of the keyframe orders
+    """
+    timestamp   = Int64Col(pos=0)
+    seqnum      = Int64Col(pos=1)
+    line        = Int64Col(pos=2)
+    first_order = Int64Col(pos=3)
+    orders      = Int64Col(pos=4)
+
+class KeyframeOrder(IsDescription):
+    """
+    An order of a keyframe, as given by OrderTable.snapshot()
+    """
+    order_id    = Int64Col(pos=0)
+    is_buy      = BoolCol(pos=1)
+    price       = Int64Col(pos=2)
+    quantity    = Int64Col(pos=3)
+    stacked     = BoolCol(pos=4)
+
+def keyframe_tables(h5_file, symbol, storage = None, resume = False):
+    """
+    Tuple (keyframes, keyframe orders) tables of the symbol's group, created
+    unless resuming
+    """
+    with h5_lock:
+        group = h5_file.getNode('/', symbol)
+        if resume:
+            return (group._v_children[__KEYFRAMES__], group._v_children[__KEYFRAME_ORDERS__])
+        storage = get_storage_profile(storage)
+        return (storage.create_table(h5_file, group, __KEYFRAMES__, KeyframeTable,
+                                     "Keyframes for "+str(symbol)),
+                storage.create_table(h5_file, group, __KEYFRAME_ORDERS__, KeyframeOrder,
+                                     "Keyframe orders for "+str(symbol)))
+
+def append_keyframe(tables, timestamp, seqnum, line, orders):
+    """
+    Append a keyframe of the orders (see OrderTable.snapshot) to the tables
+    given by keyframe_tables
+    """
+    keyframes, keyframe_orders = tables
+    with h5_lock:
+        keyframes.append([ (timestamp, seqnum, line, keyframe_orders.nrows, len(orders)) ])
+        if orders:
+            keyframe_orders.append(orders)
+
+def find_keyframe(h5_file, symbol, timestamp):
+    """
+    Tuple (timestamp, seqnum, line, orders) of the last keyframe of the
+    symbol before any at a later timestamp, None if there is none
+    """
+    if symbol not in h5_file.root._v_children:
+        return None
+    group = h5_file.root._v_children[symbol]
+    if __KEYFRAMES__ not in group._v_children:
+        return None
+    keyframes = group._v_children[__KEYFRAMES__]
+    late = flatnonzero(keyframes.col('timestamp') > timestamp)
+    last = (late[0] if len(late) else keyframes.nrows) - 1
+    if last < 0:
+        return None
+    keyframe = keyframes[last]
+    first = keyframe['first_order']
+    orders = group._v_children[__KEYFRAME_ORDERS__].read(first, first + keyframe['orders'])
+    return (keyframe['timestamp'], keyframe['seqnum'], keyframe['line'], orders.tolist())
@@ -0,0 +1,88 @@
+###############################################################################
+#
+# File: ladder_bench.py
+#
+# Description: Micro-benchmark of the price level structures used by the book
+#              builders
+#
+##############################################################################
+from auction.parser.utils import PriceOrderedDict, PriceLadder
+import random
+import time
+
+__LEVELS__ = 10
+__TICK_SIZE__ = 10000
+
+def order_flow(count, depth=200, seed=1):
+    """
+    A list of (is_buy, price, quantity change) updates resembling an equity
+    book: orders added around a randomly walking mid and later removed
+    """
+    rng = random.Random(seed)
+    mid = 100000000
+    live = []
+    result = []
+    for i in range(count):
+        if live and (len(live) > depth or rng.random() < 0.5):
+            is_buy, px, qty = live.pop(rng.randrange(len(live)))
+            result.append((is_buy, px, -qty))
+        else:
+            mid += rng.choice((-1, 0, 1))*__TICK_SIZE__
+            is_buy = rng.random() < 0.5
+            offset = int(rng.expovariate(0.2)) + 1
+            px = mid - offset*__TICK_SIZE__ if is_buy else mid + offset*__TICK_SIZE__
+            qty = rng.randint(1, 50)*100
+            live.append((is_buy, px, qty))
+            result.append((is_buy, px, qty))
+    return result
+
+def replay(level_class, flow):
+    """
+    Apply the flow to a bid and ask structure of level_class, taking the top
+    levels after every update.
+
+    Returns tuple (seconds, hash of the top levels seen)
+    """
+    bids = level_class(False)
+    asks = level_class()
+    tops = []
+    start = time.time()
+    for is_buy, px, qty in flow:
+        if is_buy:
+            bids.update_quantity(px, qty)
+            tops.append(bids.top_n(__LEVELS__))
+        else:
+            asks.update_quantity(px, qty)
+            tops.append(asks.top_n(__LEVELS__))
+    elapsed = time.time() - start
+    return (elapsed, hash(str(tops)))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("""
+Compare PriceOrderedDict and PriceLadder on a synthetic order flow
+""")
+
+    parser.add_argument('-n', '--count',
+                        dest='count',
+                        action='store',
+                        type=int,
+                        default=500000,
+                        help='Number of updates')
+
+    parser.add_argument('-d', '--depth',
+                        dest='depth',
+                        action='store',
+                        type=int,
+                        default=200,
+                        help='Maximum number of live orders')
+
+    options = parser.parse_args()
+
+    flow = order_flow(options.count, options.depth)
+    results = [ (level_class.__name__, replay(level_class, flow))
+                for level_class in (PriceOrderedDict, PriceLadder) ]
+    assert len(set(digest for name, (seconds, digest) in results)) == 1
+    for name, (seconds, digest) in results:
+        print "%-20s %8.2f sec %10.0f updates/sec" % (name, seconds, options.count/seconds)
@@ -2,6 +2,8 @@ import tables
 from tables import *
 from datetime import datetime
 from auction.time_utils import *
+from auction.parser.async_writer import h5_lock
+from auction.storage import get_storage_profile
 import sys
 
 class ParseResults(IsDescription):
@@ -20,6 +22,10 @@ class ParseResults(IsDescription):
     processed       = Int64Col()
     # Track count of records that do not impact books (i.e. updates in the wings)
     irrelevants     = Int64Col()    
+    # Deepest queue of row blocks and total microseconds the parse waited on
+    # a full queue, when writing on a background thread (see AsyncWriter)
+    writer_queue_depth = Int64Col()
+    writer_stall    = Int64Col()
 
 class ParseWarnings(IsDescription):
     """
@@ -49,36 +55,57 @@ class ParseManager(object):
     @staticmethod
     def summarize_file(h5_file_path):
         h5_file = tables.openFile(h5_file_path)
-        summary_record = h5_file.root.parse_results.summary[0]
-        print "Summary of:", h5_file_path
-        print "\tis_valid:", summary_record['is_valid']
-        print "\tsrc_file:", summary_record['src_file']
-        print "\tsrc_file_size:", summary_record['src_file_size']
-        print "\tsrc_file_mtime:", chicago_time(summary_record['src_file_mtime'])
-        print "\tparse_start:", chicago_time(summary_record['parse_start'])
-        print "\tparse_stop:", chicago_time(summary_record['parse_stop'])
-        print "\tdata_start:", chicago_time(summary_record['data_start'])
-        print "\tdata_stop:", chicago_time(summary_record['data_stop'])
-        print "\tprocessed:", summary_record['processed']
-        print "\tirrelevants:", summary_record['irrelevants']
-        print "\ttotal warnings:", h5_file.root.parse_results.warnings.nrows
-
-
-    def __init__(self, src_file, out_h5_file):
+        try:
+            summary_record = h5_file.root.parse_results.summary[0]
+            print "Summary of:", h5_file_path
+            print "\tis_valid:", summary_record['is_valid']
+            print "\tsrc_file:", summary_record['src_file']
+            print "\tsrc_file_size:", summary_record['src_file_size']
+            print "\tsrc_file_mtime:", chicago_time(summary_record['src_file_mtime'])
+            print "\tparse_start:", chicago_time(summary_record['parse_start'])
+            print "\tparse_stop:", chicago_time(summary_record['parse_stop'])
+            print "\tdata_start:", chicago_time(summary_record['data_start'])
+            print "\tdata_stop:", chicago_time(summary_record['data_stop'])
+            print "\tprocessed:", summary_record['processed']
+            print "\tirrelevants:", summary_record['irrelevants']
+            if 'writer_stall' in summary_record.dtype.names:
+                print "\twriter_queue_depth:", summary_record['writer_queue_depth']
+                print "\twriter_stall:", summary_record['writer_stall']/1e6, "sec"
+            print "\ttotal warnings:", h5_file.root.parse_results.warnings.nrows
+        finally:
+            h5_file.close()
+
+
+    def __init__(self, src_file, out_h5_file, storage = 'none', resume = False):
+        """
+        storage - StorageProfile or name of one for the parse result tables,
+        by default not compressed
+
+        resume - continue with the parse results already in the file, e.g.
+        when resuming from a checkpoint (see checkpoint_state)
+        """
         self.__parse_start = 0
         self.__parse_stop = 0
         self.__data_start = 0
         self.__data_stop = 0
+        self.__writer_queue_depth = 0
+        self.__writer_stall = 0
         self.__out_h5_file = out_h5_file
-        group = self.__out_h5_file.createGroup("/", "parse_results", "Info about the parse")
-        self.__summary = self.__out_h5_file.createTable(group, 
-                                                        'summary', 
-                                                        ParseResults, 
-                                                        "Summary of parse results")
-        self.__warnings = self.__out_h5_file.createTable(group, 
-                                                         'warnings', 
-                                                         ParseWarnings, 
-                                                         "Any warnings during parsing")
+        if resume:
+            group = self.__out_h5_file.root.parse_results
+            self.__summary = group.summary
+            self.__warnings = group.warnings
+        else:
+            group = self.__out_h5_file.createGroup("/", "parse_results", "Info about the parse")
+            storage = get_storage_profile(storage)
+            self.__summary = storage.create_table(self.__out_h5_file, group, 
+                                                  'summary', 
+                                                  ParseResults, 
+                                                  "Summary of parse results")
+            self.__warnings = storage.create_table(self.__out_h5_file, group, 
+                                                   'warnings', 
+                                                   ParseWarnings, 
+                                                   "Any warnings during parsing")
         self.__summary_row = self.__summary.row
         self.__warning_row = self.__warnings.row        
 
@@ -91,12 +118,29 @@ class ParseManager(object):
         """
         Log a warning message with an optional src file line number
         """
-        self.__warning_row['msg'] = msg
-        self.__warning_row['msg_type'] = msg_type
-        self.__warning_row['src_timestamp'] = src_timestamp
-        self.__warning_row['src_timestamp_s'] = chicago_time(src_timestamp)
-        self.__warning_row['src_line'] = line
-        self.__warning_row.append()
+        with h5_lock:
+            self.__warning_row['msg'] = msg
+            self.__warning_row['msg_type'] = msg_type
+            self.__warning_row['src_timestamp'] = src_timestamp
+            self.__warning_row['src_timestamp_s'] = chicago_time(src_timestamp)
+            self.__warning_row['src_line'] = line
+            self.__warning_row.append()
+
+    def merge_results(self, h5_file):
+        """
+        Fold the results of another parse (e.g. of one shard of the input)
+        into this one. Its warnings are appended to these and its summary
+        record is returned.
+        """
+        with h5_lock:
+            results = h5_file.root.parse_results
+            warnings = results.warnings.read()
+            if len(warnings):
+                self.__warnings.append(warnings)
+            summary = results.summary[0]
+        self.__writer_queue_depth = max(self.__writer_queue_depth, summary['writer_queue_depth'])
+        self.__writer_stall += summary['writer_stall']
+        return summary
 
     def data_start(self, start):
         """
@@ -124,6 +168,28 @@ class ParseManager(object):
         """
         self.__summary_row['irrelevants'] = count
 
+    def writer_stats(self, writer):
+        """
+        Store the queue depth and stall time of the AsyncWriter used to
+        write the data, if any
+        """
+        if writer:
+            self.__writer_queue_depth = max(self.__writer_queue_depth, writer.max_depth)
+            self.__writer_stall += int(writer.stall*1e6)
+
+    def checkpoint_state(self):
+        """
+        Picklable state of the parse so far, for restore_state()
+        """
+        return dict(parse_start = self.__parse_start,
+                    writer_queue_depth = self.__writer_queue_depth,
+                    writer_stall = self.__writer_stall)
+
+    def restore_state(self, state):
+        self.__parse_start = state['parse_start']
+        self.__writer_queue_depth = state['writer_queue_depth']
+        self.__writer_stall = state['writer_stall']
+
     def mark_start(self):
         """
         Track the start time of the parse/generation
@@ -136,12 +202,15 @@ class ParseManager(object):
         This also writes out the summary info and flushes the file.
         """
         self.__parse_stop = timestamp()
-        summary = self.__summary.row
-        summary['parse_start'] = self.__parse_start
-        summary['parse_stop'] = self.__parse_stop
-        summary['is_valid'] = success and 1 or 0
-        summary.append()
-        self.__out_h5_file.flush()
+        with h5_lock:
+            summary = self.__summary.row
+            summary['parse_start'] = self.__parse_start
+            summary['parse_stop'] = self.__parse_stop
+            summary['is_valid'] = success and 1 or 0
+            summary['writer_queue_depth'] = self.__writer_queue_depth
+            summary['writer_stall'] = self.__writer_stall
+            summary.append()
+            self.__out_h5_file.flush()
 
 if __name__ == "__main__":
     from auction.paths import *
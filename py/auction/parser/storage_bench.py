@@ -0,0 +1,190 @@
+###############################################################################
+#
+# File: storage_bench.py
+#
+# Description: Compare book file size, parse/write throughput and read
+#              throughput across book storage options, and write speed, full
+#              scan read speed and file size across storage profiles
+#
+##############################################################################
+from path import path
+from auction.paths import *
+from auction.time_utils import *
+from auction.parser.arca_parser import ArcaParser, RunOptions
+from auction.parser.utils import BookOptions
+from auction.book_columns import book_dataset, read_books
+from auction.storage import get_storage_profile, storage_profile_names
+from tables import *
+import time
+import logging
+
+# Storage options to compare: name -> BookOptions of the parse
+__STORAGE_OPTIONS__ = [
+    ('timestamp_s', BookOptions(store_timestamp_s=True)),
+    ('no_timestamp_s', BookOptions(store_timestamp_s=False)),
+    ('columns', BookOptions(book_layout='columns')),
+    ('deltas', BookOptions(book_layout='deltas')),
+    ('compact', BookOptions(book_layout='compact')),
+    ]
+
+# Books per read when timing reads, as BookStream reads them
+__READ_ROWS__ = 4096
+
+def book_rows(h5_path):
+    """
+    Total number of book rows across all symbols in the file
+    """
+    h5_file = openFile(h5_path)
+    result = sum(book_dataset(node).nrows for node in h5_file.root
+                 if node._v_name != 'parse_results')
+    h5_file.close()
+    return result
+
+def read_seconds(h5_path, read_rows = __READ_ROWS__):
+    """
+    Seconds to read every book of every symbol in the file, read_rows at a
+    time, best of 3
+    """
+    best = None
+    for attempt in range(3):
+        start = time.time()
+        h5_file = openFile(h5_path)
+        for node in h5_file.root:
+            if node._v_name != 'parse_results':
+                dataset = book_dataset(node)
+                for first in range(0, dataset.nrows, read_rows):
+                    read_books(dataset, first, min(first + read_rows, dataset.nrows))
+        h5_file.close()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def book_tables(h5_file):
+    """
+    List of (symbol, books table) in the file
+    """
+    return [ (node._v_name, node.books) for node in h5_file.root
+             if node._v_name != 'parse_results' ]
+
+def bench_arca(src, symbols, block_mode=True, options=__STORAGE_OPTIONS__):
+    """
+    Parse the arca file once per storage option, returning a list of
+    (name, seconds, output size in bytes, book rows, read seconds)
+    """
+    date = get_date_of_file(src)
+    results = []
+    for name, book_options in options:
+        parser = ArcaParser(src, date, 'BENCH_' + name, symbols)
+        start = time.time()
+        parser.parse(True, run_options=RunOptions(block_mode=block_mode, force=True),
+                     book_options=book_options)
+        elapsed = time.time() - start
+        output = ARCA_OUT_PATH / (get_date_string(date) + '_BENCH_' + name + '.h5')
+        results.append((name, elapsed, output.getsize(), book_rows(output),
+                        read_seconds(output)))
+    return results
+
+def bench_profiles(books_path, profiles):
+    """
+    Rewrite the books in books_path with each storage profile, then read
+    them all back. Returns a list of (profile name, write seconds, read
+    seconds, output size in bytes, megabytes of rows)
+    """
+    h5_file = openFile(books_path)
+    books = [ (symbol, table.description, table.read()) for symbol, table in book_tables(h5_file) ]
+    h5_file.close()
+    megabytes = sum(rows.nbytes for symbol, description, rows in books)/1e6
+    results = []
+    for profile in profiles:
+        profile = get_storage_profile(profile)
+        output = path(books_path.stripext() + '_PROFILE_' + profile.name + '.h5')
+        start = time.time()
+        h5_file = openFile(output, mode = "w", title = "Storage profile " + profile.name)
+        for symbol, description, rows in books:
+            group = h5_file.createGroup("/", symbol, 'Book data')
+            table = profile.create_table(h5_file, group, 'books', description, "Data for " + symbol)
+            table.append(rows)
+        h5_file.close()
+        write_seconds = time.time() - start
+
+        start = time.time()
+        h5_file = openFile(output)
+        for symbol, table in book_tables(h5_file):
+            table.read()
+        h5_file.close()
+        read_seconds = time.time() - start
+
+        results.append((profile.name, write_seconds, read_seconds, output.getsize(), megabytes))
+        output.remove()
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    from sets import Set
+
+    parser = argparse.ArgumentParser("""
+Parse an arca file with each book storage option and report file size, book
+write throughput and read throughput. Then rewrite the books with each storage profile and
+report write speed, full scan read speed and file size.
+""")
+
+    parser.add_argument('-i', '--input',
+                        dest='input',
+                        action='store',
+                        help='Arca file to parse')
+
+    parser.add_argument('-b', '--books',
+                        dest='books',
+                        action='store',
+                        help='Existing book file to benchmark the storage profiles with, instead of parsing')
+
+    parser.add_argument('-p', '--profile',
+                        dest='profiles',
+                        action='store',
+                        nargs='*',
+                        choices=storage_profile_names(),
+                        default=storage_profile_names(),
+                        help='Storage profiles to compare, if empty all of them')
+
+    parser.add_argument('-s', '--symbol',
+                        dest='symbols',
+                        action='store',
+                        nargs='*',
+                        default=[],
+                        help='Symbols to include, if empty all symbols')
+
+    parser.add_argument('-l', '--line',
+                        dest='block_mode',
+                        action='store_false',
+                        help='Parse line by line rather than in blocks')
+
+    parser.add_argument('-v', '--verbose',
+                        dest='verbose',
+                        action='store_true',
+                        help='Output extra logging information')
+
+    options = parser.parse_args()
+
+    if options.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    if options.books:
+        books = path(options.books)
+    else:
+        if not options.input:
+            parser.error('One of --input or --books is required')
+        src = path(options.input)
+        results = bench_arca(src, Set(options.symbols), options.block_mode)
+        print "%-20s %10s %14s %12s %14s %10s %14s" % \
+            ('storage', 'seconds', 'bytes', 'books', 'books/sec', 'read sec', 'read books/sec')
+        for name, elapsed, size, rows, read in results:
+            print "%-20s %10.2f %14d %12d %14.0f %10.3f %14.0f" % \
+                (name, elapsed, size, rows, rows/elapsed, read, rows/read)
+        books = ARCA_OUT_PATH / (get_date_string(get_date_of_file(src)) + '_BENCH_' +
+                                 __STORAGE_OPTIONS__[0][0] + '.h5')
+
+    results = bench_profiles(books, options.profiles)
+    print "%-20s %10s %10s %10s %14s %8s" % ('profile', 'write MB/s', 'read MB/s', 'read sec', 'bytes', 'ratio')
+    for name, write_seconds, read_seconds, size, megabytes in results:
+        print "%-20s %10.1f %10.1f %10.3f %14d %8.2f" % \
+            (name, megabytes/write_seconds, megabytes/read_seconds, read_seconds, size, megabytes*1e6/size)
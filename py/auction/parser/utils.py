@@ -1,11 +1,28 @@
 from tables import *
 from numpy import *
 from attribute import readable, writable
-from auction.book import Book, BookTable
+from bisect import bisect_left
+from auction.book import Book, BookTable, BboTable, table_description
+from auction.book_columns import BookColumns, BookDeltas, CompactBooks, book_dataset
+from auction.storage import get_storage_profile
+from auction.time_utils import fast_chicago_time_str
 from auction.trade import TradeTable
+from auction.parser.async_writer import AsyncWriter, BlockRows, h5_lock, __BLOCK_ROWS__
 import string
+import sys
 
 __FLUSH_FREQ__ = 10000
+# rows buffered per table between appends, None for the PyTables default
+__BUFFER_ROWS__ = None
+# how books are stored: 'rows' in a books table, 'columns' as BookColumns,
+# 'deltas' as BookDeltas, 'compact' as CompactBooks
+__BOOK_LAYOUTS__ = ('rows', 'columns', 'deltas', 'compact')
+# BookBuilder attributes tied to the open file, left out of checkpoint state
+__FILE_ATTRIBUTES__ = frozenset(('_file_record_counter', '_book_table', '_record', '_book_blocks',
+                                 '_trade_table', '_trade', '_trade_blocks', '_keyframe_tables',
+                                 '_bbo_table', '_bbo', '_bbo_blocks'))
+# columns of the bbo table, as appended
+__BBO_COLUMNS__ = ('timestamp', 'seqnum', 'bid_px', 'bid_qty', 'ask_px', 'ask_qty')
 __LEVELS__ = 10
 __TICK_SIZE__ = 10000
 
@@ -74,20 +91,361 @@ class PriceOrderedDict(object):
         else:
             return [ x for x in reversed(self.L[-n:]) ]
 
+__UNCHANGED__ = sys.maxint
+
+class PriceLadder(object):
+    """
+    Drop in replacement for PriceOrderedDict. Quantities are kept by price
+    in a dict alongside a list of the prices kept sorted as they are added
+    and removed (bisect), rather than sorted again whenever the top is
+    asked for after a new price arrives. The best price is at one end of the
+    list and the top n levels are a slice of it.
+
+    Finding a price is O(log n), but adding or removing a price level is
+    O(n): the list moves the prices after it up or down one slot. That is
+    a single memmove of pointers, short for ladders of a few hundred
+    prices. Changing the quantity of a level already there is O(log n).
+
+    The ladder also tracks the best rank (0 being the best price) of any
+    level changed since take_changed() was last called, so only levels from
+    there down need to be looked at again.
+    """
+    def __init__(self, ascending = True):
+        self.d = {}
+        self.L = []
+        self.ascending = ascending
+        self.changed = __UNCHANGED__
+
+    def __len__(self):
+        return len(self.L)
+
+    def get_quantity(self, px):
+        return self.d.get(px, 0)
+
+    def is_bid(self):
+        return not self.ascending
+
+    def update_quantity(self, px, q):
+        qty = self.d.get(px)
+        index = bisect_left(self.L, px)
+        if qty:
+            qty += q
+            if qty:
+                self.d[px] = qty
+                assert(qty>0)
+            else:
+                del self.d[px]
+                del self.L[index]
+                # rank is of the level before it was removed
+                index -= not self.ascending
+        else:
+            if qty is None:
+                self.L.insert(index, px)
+            self.d[px] = q
+        rank = index if self.ascending else len(self.L) - 1 - index
+        if rank < self.changed:
+            self.changed = rank
+
+    def take_changed(self):
+        """
+        Best rank of a level changed since the last call, or __UNCHANGED__
+        """
+        result = self.changed
+        self.changed = __UNCHANGED__
+        return result
+
+    def levels(self, start, stop):
+        """
+        List of (price, quantity) for the levels of rank start to stop-1
+        """
+        if self.ascending:
+            prices = self.L[start:stop]
+        else:
+            prices = self.L[-start-1:-stop-1:-1]
+        d = self.d
+        return [ (px, d[px]) for px in prices ]
+
+    def top(self):
+        if not self.L:
+            return None
+        return self.L[0] if self.ascending else self.L[-1]
+
+    def top_n(self, n):
+        if self.ascending:
+            return self.L[:n]
+        else:
+            return self.L[:-n-1:-1]
+
+__EMPTY__ = -1
+__INITIAL_ORDERS__ = 1 << 10
+
+class OrderTable(object):
+    """
+    Live orders of a book keyed by (integer order id, side). The price and
+    quantity of each order are stored in numpy columns, found through an
+    open addressing (linear probing) hash of the key, and rows freed by
+    removed orders are reused.
+
+    Adding an order id that is already present stacks the new order on the
+    existing one and removing takes off the most recently added first, as
+    ArcaBookBuilder has always treated duplicate adds. A key that has had
+    duplicates stays marked as stacked until all of its orders are removed.
+    """
+
+    def __init__(self, capacity = __INITIAL_ORDERS__):
+        self.__keys = zeros(2*capacity, dtype=int64) + __EMPTY__
+        self.__rows = zeros(2*capacity, dtype=int64)
+        self.__mask = 2*capacity - 1
+        self.__price = zeros(capacity, dtype=int64)
+        self.__qty = zeros(capacity, dtype=int64)
+        # earlier order of a stacked key, or next row of the free list
+        self.__prev = zeros(capacity, dtype=int64)
+        self.__stacked = zeros(capacity, dtype=int8)
+        self.__free = __EMPTY__
+        self.__used = 0
+        self.__count = 0
+
+    def __len__(self):
+        """
+        Number of distinct order ids (per side) with live orders
+        """
+        return self.__count
+
+    def nbytes(self):
+        """
+        Bytes of storage held by the table
+        """
+        return sum(a.nbytes for a in (self.__keys, self.__rows, self.__price,
+                                      self.__qty, self.__prev, self.__stacked))
+
+    def get(self, order_id, is_buy):
+        """
+        Tuple (price, quantity, stacked) of the most recent order with the
+        id, or None if there is none
+        """
+        key = 2*order_id + is_buy
+        i = self.__find(key)
+        if self.__keys.item(i) != key:
+            return None
+        row = self.__rows.item(i)
+        return (self.__price.item(row), self.__qty.item(row), bool(self.__stacked.item(row)))
+
+    def add(self, order_id, is_buy, price, quantity):
+        """
+        Add an order, stacking it on any with the same id
+        """
+        key = 2*order_id + is_buy
+        keys = self.__keys
+        mask = self.__mask
+        i = key & mask
+        k = keys.item(i)
+        while k != key and k != __EMPTY__:
+            i = (i + 1) & mask
+            k = keys.item(i)
+        row = self.__new_row()
+        self.__price[row] = price
+        self.__qty[row] = quantity
+        if k == key:
+            previous = self.__rows.item(i)
+            self.__prev[row] = previous
+            self.__stacked[row] = 1
+            self.__stacked[previous] = 1
+        else:
+            self.__prev[row] = __EMPTY__
+            self.__stacked[row] = 0
+            keys[i] = key
+            self.__count += 1
+        self.__rows[i] = row
+        if 2*self.__count > len(self.__keys):
+            self.__rehash(2*len(self.__keys))
+
+    def replace(self, order_id, is_buy, price, quantity):
+        """
+        Replace the price and quantity of the most recent order with the id,
+        which must exist
+        """
+        key = 2*order_id + is_buy
+        i = self.__find(key)
+        assert self.__keys.item(i) == key
+        row = self.__rows.item(i)
+        self.__price[row] = price
+        self.__qty[row] = quantity
+
+    def pop(self, order_id, is_buy):
+        """
+        Remove the most recent order with the id, returning its tuple
+        (price, quantity), or None if there is none
+        """
+        key = 2*order_id + is_buy
+        keys = self.__keys
+        mask = self.__mask
+        i = key & mask
+        k = keys.item(i)
+        while k != key:
+            if k == __EMPTY__:
+                return None
+            i = (i + 1) & mask
+            k = keys.item(i)
+        row = self.__rows.item(i)
+        previous = self.__prev.item(row)
+        result = (self.__price.item(row), self.__qty.item(row))
+        self.__prev[row] = self.__free
+        self.__free = row
+        if previous == __EMPTY__:
+            self.__remove(i)
+            self.__count -= 1
+        else:
+            self.__rows[i] = previous
+        return result
+
+    def snapshot(self):
+        """
+        List of (order_id, is_buy, price, quantity, stacked) of the live
+        orders, those of each id in the order added, for load() to recreate
+        the table from
+        """
+        result = []
+        for i in flatnonzero(self.__keys != __EMPTY__).tolist():
+            key = self.__keys.item(i)
+            rows = []
+            row = self.__rows.item(i)
+            while row != __EMPTY__:
+                rows.append(row)
+                row = self.__prev.item(row)
+            for row in reversed(rows):
+                result.append((key >> 1, bool(key & 1), self.__price.item(row),
+                               self.__qty.item(row), bool(self.__stacked.item(row))))
+        return result
+
+    def load(self, orders):
+        """
+        Add the orders of a snapshot(), stacked as they were
+        """
+        for order_id, is_buy, price, quantity, stacked in orders:
+            self.add(order_id, is_buy, price, quantity)
+            row = self.__rows.item(self.__find(2*order_id + is_buy))
+            self.__stacked[row] = stacked
+
+    def __find(self, key):
+        """
+        Position of the key in the hash, or of the empty position it would
+        take
+        """
+        keys = self.__keys
+        mask = self.__mask
+        i = key & mask
+        while True:
+            k = keys.item(i)
+            if k == key or k == __EMPTY__:
+                return i
+            i = (i + 1) & mask
+
+    def __remove(self, i):
+        """
+        Empty position i of the hash, shifting back any following keys that
+        probed past it
+        """
+        keys = self.__keys
+        rows = self.__rows
+        mask = self.__mask
+        j = i
+        while True:
+            j = (j + 1) & mask
+            k = keys.item(j)
+            if k == __EMPTY__:
+                break
+            home = k & mask
+            if (i <= j and (home <= i or home > j)) or (i > j and home <= i and home > j):
+                keys[i] = k
+                rows[i] = rows[j]
+                i = j
+        keys[i] = __EMPTY__
+
+    def __new_row(self):
+        row = self.__free
+        if row != __EMPTY__:
+            self.__free = self.__prev.item(row)
+            return row
+        row = self.__used
+        if row == len(self.__price):
+            extra = len(self.__price)
+            self.__price = concatenate((self.__price, zeros(extra, dtype=int64)))
+            self.__qty = concatenate((self.__qty, zeros(extra, dtype=int64)))
+            self.__prev = concatenate((self.__prev, zeros(extra, dtype=int64)))
+            self.__stacked = concatenate((self.__stacked, zeros(extra, dtype=int8)))
+        self.__used += 1
+        return row
+
+    def __rehash(self, size):
+        occupied = flatnonzero(self.__keys != __EMPTY__)
+        keys = self.__keys[occupied].tolist()
+        rows = self.__rows[occupied].tolist()
+        self.__keys = zeros(size, dtype=int64) + __EMPTY__
+        self.__rows = zeros(size, dtype=int64)
+        self.__mask = size - 1
+        for key, row in zip(keys, rows):
+            i = self.__find(key)
+            self.__keys[i] = key
+            self.__rows[i] = row
+
 class FileRecordCounter(object):
     """
     Periodically the file gets flushed. Flushing too frequently can hurt
     performance. Multiple datasets are stored in a single file, so the count
     is based on number of adds to *any* of the data sets.
+
+    Rows are appended through Table.row, which collects them in a numpy
+    structured buffer of table.nrowsinbuf rows and appends the whole buffer
+    to the table when it fills. buffered_row() sizes that buffer and tracks
+    the table so flush() can write out whatever is left in every buffer.
+
+    With an AsyncWriter rows are instead collected into BlockRows, whose
+    blocks the writer appends on its own thread. Without one, BlockRows
+    append their blocks directly.
     """
-    readable(h5_file = None, count = 0)
+    readable(h5_file = None, count = 0, writer = None)
 
-    def __init__(self, h5_file):
+    def __init__(self, h5_file, writer = None):
         """
-        H5 file object to flush
+        H5 file object to flush, and optionally the AsyncWriter to append
+        rows with
         """
         self.__h5_file = h5_file
         self.__count = 0
+        self.__writer = writer
+        self.__tables = []
+        self.__blocks = []
+
+    def buffered_row(self, table, columns, buffer_rows = __BUFFER_ROWS__, blocks = False):
+        """
+        The row for appending to table, buffering buffer_rows rows at a
+        time. Without a writer this is table.row, with one (or if blocks,
+        as needed by tables without a row such as BookColumns) a BlockRows
+        taking tuples of values for columns.
+        """
+        if self.__writer or blocks:
+            result = BlockRows(table, columns, self.__writer, buffer_rows or __BLOCK_ROWS__)
+            self.__blocks.append(result)
+            return result
+        if buffer_rows:
+            table.nrowsinbuf = buffer_rows
+        self.__tables.append(table)
+        return table.row
+
+    def sync(self):
+        """
+        Write out the rows buffered for every table, waiting for any writer
+        to append them, then flush the file. Unlike flush() rows may still
+        be appended after.
+        """
+        for blocks in self.__blocks:
+            blocks.flush()
+        if self.__writer:
+            self.__writer.join()
+        with h5_lock:
+            for table in self.__tables:
+                table.flush()
+            self.__h5_file.flush()
 
     def increment_count(self):
         """
@@ -95,17 +453,125 @@ class FileRecordCounter(object):
         """
         self.__count += 1
         if 0 == (self.__count % __FLUSH_FREQ__):
-            self.__h5_file.flush()
+            with h5_lock:
+                self.__h5_file.flush()
+
+    def flush(self):
+        """
+        Append the rows still buffered for every table, stopping any writer
+        once it has appended them, then flush the file
+        """
+        for blocks in self.__blocks:
+            blocks.flush()
+        if self.__writer:
+            self.__writer.close()
+        for table in self.__tables:
+            table.flush()
+        self.__h5_file.flush()
+
+class BookOptions(object):
+    """
+    How a parser writes its books, trades and bbo tables, the same options
+    for ArcaParser.parse, CmeRlcParser and CmeFixParser:
+
+    store_timestamp_s - if False books and trades are written without the
+    timestamp_s column, readers compute it from timestamp as needed
+
+    buffer_rows - number of rows buffered per table between appends, None
+    for the PyTables default (see FileRecordCounter)
+
+    writer_queue - if > 0 rows are appended, and so compressed, on a
+    background thread taking up to this many blocks of rows at a time (see
+    AsyncWriter)
+
+    storage - StorageProfile, or name of one, for the tables, None for the
+    default (see auction.storage)
+
+    book_layout - 'columns' to store books as BookColumns, an array per
+    field and level, 'deltas' as BookDeltas, only the levels changed per
+    book, or 'compact' as CompactBooks, levels as int32 tick offsets,
+    rather than a books table ('rows')
+
+    bbo - if True each symbol also gets a bbo table of just its top of book
+    changes (see BboTable)
+    """
+    readable(store_timestamp_s=True, buffer_rows=__BUFFER_ROWS__, writer_queue=0,
+             storage=None, book_layout=__BOOK_LAYOUTS__[0], bbo=False)
+
+    def __init__(self, store_timestamp_s = True, buffer_rows = __BUFFER_ROWS__,
+                 writer_queue = 0, storage = None, book_layout = __BOOK_LAYOUTS__[0],
+                 bbo = False):
+        if book_layout not in __BOOK_LAYOUTS__:
+            raise RuntimeError("Unknown book layout %s, not one of %s" %
+                               (book_layout, __BOOK_LAYOUTS__))
+        self.__store_timestamp_s = store_timestamp_s
+        self.__buffer_rows = buffer_rows
+        self.__writer_queue = writer_queue
+        self.__storage = storage
+        self.__book_layout = book_layout
+        self.__bbo = bbo
+
+    def builder_args(self):
+        """
+        Keyword args for a BookBuilder to write per these options. The
+        writer_queue applies to the file (see BookBuilder.start_writer).
+        """
+        return dict(store_timestamp_s = self.__store_timestamp_s,
+                    buffer_rows = self.__buffer_rows,
+                    storage = self.__storage,
+                    book_layout = self.__book_layout,
+                    bbo = self.__bbo)
 
 class BookBuilder(object):
     """
     Processes Add/Modify/Delete records to build books per symbol
+
+    With bbo=True the builder also writes a bbo table (see BboTable) next to
+    the books, with a row for each book whose top level differs from the
+    one before, for readers needing only the best bid and ask.
+
+    With resume=True the builder appends to the tables already in the file
+    for its symbol, e.g. to continue a parse from a checkpoint (see
+    checkpoint_state).
     """
 
     readable(unchanged=0)
 
     _book_files_ = {}
 
+    @staticmethod
+    def start_writer(h5_file, queue_depth):
+        """
+        Have the builders of the file append their rows on a background
+        thread (see AsyncWriter). Call before any builder for the file is
+        created.
+        """
+        assert h5_file not in BookBuilder._book_files_
+        BookBuilder._book_files_[h5_file] = FileRecordCounter(h5_file, AsyncWriter(queue_depth))
+
+    @staticmethod
+    def flush_books(h5_file):
+        """
+        Write out the rows still buffered by the builders of the file. Call
+        before closing the file.
+
+        Returns the AsyncWriter used, if any, for its statistics
+        """
+        counter = BookBuilder._book_files_.pop(h5_file, None)
+        if counter:
+            counter.flush()
+            return counter.writer
+
+    @staticmethod
+    def sync_books(h5_file):
+        """
+        Write out the rows buffered by the builders of the file so far,
+        e.g. before a checkpoint, leaving them open for more
+        """
+        counter = BookBuilder._book_files_.get(h5_file, None)
+        if counter:
+            counter.sync()
+
     symbol = property(lambda self: self._symbol, None, None, 
                       r"Symbol for the book")
 
@@ -116,28 +582,90 @@ class BookBuilder(object):
             self._file_record_counter = BookBuilder._book_files_[h5_file]
 
         h5_file = self._file_record_counter.h5_file
-        filters = Filters(complevel=1, complib='zlib')
-        group = h5_file.createGroup("/", symbol, 'Book data')
-        self._book_table = h5_file.createTable(group, 'books', BookTable, 
-                                               "Data for "+str(symbol), filters=filters)
-        self._record = self._book_table.row
-        if rest.get('include_trades'):
-            self._trade_table = h5_file.createTable(group, 'trades', TradeTable, 
-                                                    "Trades for "+str(symbol), filters=filters)
-            self._trade = self._trade_table.row
-        else:
-            self._trade = None
-        self._tick_size = rest.get('tick_size', None) or __TICK_SIZE__ # TODO
+        storage = get_storage_profile(rest.get('storage'))
+        self._store_timestamp_s = rest.get('store_timestamp_s', True)
+        self._book_layout = rest.get('book_layout', __BOOK_LAYOUTS__[0])
+        if self._book_layout not in __BOOK_LAYOUTS__:
+            raise RuntimeError("Unknown book layout %s, not one of %s" %
+                               (self._book_layout, __BOOK_LAYOUTS__))
+        timestamp_columns = ('timestamp', 'timestamp_s') if self._store_timestamp_s else ('timestamp',)
+        buffer_rows = rest.get('buffer_rows', __BUFFER_ROWS__)
+        resume = rest.get('resume', False)
+        self._tick_size = rest.get('tick_size', None) or __TICK_SIZE__
+        with h5_lock:
+            if resume:
+                group = h5_file.getNode('/', symbol)
+                self._book_table = book_dataset(group)
+            else:
+                group = h5_file.createGroup("/", symbol, 'Book data')
+                description = table_description(BookTable, self._store_timestamp_s)
+                if self._book_layout == 'columns':
+                    self._book_table = BookColumns.create(h5_file, group, description,
+                                                          "Data for "+str(symbol), storage)
+                elif self._book_layout == 'deltas':
+                    self._book_table = BookDeltas.create(h5_file, group, description,
+                                                         "Data for "+str(symbol), storage)
+                elif self._book_layout == 'compact':
+                    self._book_table = CompactBooks.create(h5_file, group, description,
+                                                           "Data for "+str(symbol), storage,
+                                                           self._tick_size,
+                                                           rest.get('price_scale', 1))
+                else:
+                    self._book_table = storage.create_table(h5_file, group, 'books', description,
+                                                            "Data for "+str(symbol))
+            self._record = self._file_record_counter.buffered_row(
+                self._book_table, timestamp_columns + ('bid', 'ask', 'seqnum'), buffer_rows,
+                self._book_layout != 'rows')
+            self._book_blocks = isinstance(self._record, BlockRows)
+            if rest.get('include_trades'):
+                if resume:
+                    self._trade_table = group.trades
+                else:
+                    self._trade_table = storage.create_table(h5_file, group, 'trades', 
+                                                             table_description(TradeTable, self._store_timestamp_s),
+                                                             "Trades for "+str(symbol))
+                self._trade = self._file_record_counter.buffered_row(
+                    self._trade_table, timestamp_columns + ('price', 'quantity', 'trade_type', 'seqnum'),
+                    buffer_rows)
+                self._trade_blocks = isinstance(self._trade, BlockRows)
+            else:
+                self._trade = None
+            if rest.get('bbo'):
+                if resume:
+                    self._bbo_table = group.bbo
+                else:
+                    self._bbo_table = storage.create_table(h5_file, group, 'bbo', BboTable,
+                                                           "Top of book for "+str(symbol))
+                self._bbo = self._file_record_counter.buffered_row(
+                    self._bbo_table, __BBO_COLUMNS__, buffer_rows)
+                self._bbo_blocks = isinstance(self._bbo, BlockRows)
+            else:
+                self._bbo = None
+        # (bid_px, bid_qty, ask_px, ask_qty) last appended to the bbo table
+        self._top = None
         self._symbol = symbol
-        self._bids_to_qty = PriceOrderedDict(False)
-        self._asks_to_qty = PriceOrderedDict()
-        self._bids = zeros(shape=[__LEVELS__,2])
-        self._asks = zeros(shape=[__LEVELS__,2])
+        self._bids_to_qty = PriceLadder(False)
+        self._asks_to_qty = PriceLadder()
+        # bids and asks are views of one array, so a book is checked at once
+        self._levels = zeros(shape=[2,__LEVELS__,2], dtype=int64)
+        self._bids, self._asks = self._levels
         self._unchanged = 0
 
     def hanging_orders(self):
         return False
 
+    def checkpoint_state(self):
+        """
+        Picklable state of the builder - levels, orders and the like of it
+        and any subclass - for restore_state() to continue from in a builder
+        created on the same file with resume=True
+        """
+        return dict((name, value) for name, value in self.__dict__.iteritems()
+                    if name not in __FILE_ATTRIBUTES__)
+
+    def restore_state(self, state):
+        self.__dict__.update(state)
+
     def summary(self):
         """
         Prints some summary information for a parse
@@ -153,37 +681,103 @@ class BookBuilder(object):
         else:
             return True
 
+    def append_book(self, ts, ts_s, seqnum):
+        """
+        Append the current bids and asks as a book. ts_s is stored only if
+        timestamp_s is, and if None it is formatted from ts when needed.
+        """
+        if self._store_timestamp_s and ts_s is None:
+            ts_s = fast_chicago_time_str(ts)
+        if self._book_layout == 'compact':
+            # a book that cannot be stored fails here, not the block it would join
+            self._book_table.check(self._levels)
+        if self._book_blocks:
+            if self._store_timestamp_s:
+                self._record.append((ts, ts_s, self._bids, self._asks, seqnum))
+            else:
+                self._record.append((ts, self._bids, self._asks, seqnum))
+        else:
+            row = self._record
+            row['bid'] = self._bids
+            row['ask'] = self._asks
+            row['timestamp'] = ts
+            if self._store_timestamp_s:
+                row['timestamp_s'] = ts_s
+            row['seqnum'] = seqnum
+            row.append()
+        if self._bbo is not None:
+            self.append_bbo(ts, seqnum)
+        self._file_record_counter.increment_count()
+
+    def append_bbo(self, ts, seqnum):
+        """
+        Append the top of the current bids and asks to the bbo table, if it
+        differs from the last appended
+        """
+        top = (int(self._bids[0, 0]), int(self._bids[0, 1]),
+               int(self._asks[0, 0]), int(self._asks[0, 1]))
+        if top == self._top:
+            return
+        self._top = top
+        if self._bbo_blocks:
+            self._bbo.append((ts, seqnum) + top)
+        else:
+            row = self._bbo
+            row['timestamp'] = ts
+            row['seqnum'] = seqnum
+            row['bid_px'], row['bid_qty'], row['ask_px'], row['ask_qty'] = top
+            row.append()
+
+    def append_trade(self, ts, ts_s, price, quantity, trade_type, seqnum):
+        """
+        Append a trade, ts_s handled as by append_book
+        """
+        if self._store_timestamp_s and ts_s is None:
+            ts_s = fast_chicago_time_str(ts)
+        if self._trade_blocks:
+            if self._store_timestamp_s:
+                self._trade.append((ts, ts_s, price, quantity, trade_type, seqnum))
+            else:
+                self._trade.append((ts, price, quantity, trade_type, seqnum))
+        else:
+            row = self._trade
+            row['timestamp'] = ts
+            if self._store_timestamp_s:
+                row['timestamp_s'] = ts_s
+            row['price'] = price
+            row['quantity'] = quantity
+            row['trade_type'] = trade_type
+            row['seqnum'] = seqnum
+            row.append()
+
+    def update_levels(self, levels, ladder):
+        """
+        Rewrite the levels array from the first level changed in the ladder
+        down. Returns True if any level differs from before.
+        """
+        start = ladder.take_changed()
+        if start >= __LEVELS__:
+            return False
+        previous = levels[start:].copy()
+        changed = ladder.levels(start, __LEVELS__)
+        stop = start + len(changed)
+        if changed:
+            levels[start:stop] = changed
+        levels[stop:] = 0
+        return not array_equal(previous, levels[start:])
+
     def make_record(self, ts, ts_s, seqnum):
         """
         A new record has been processed and the bids and asks updated
         accordingly. This takes the new price data and updates the book and
-        timestamps for storing.
-        """
-        previous_bids = self._bids.copy()
-        previous_asks = self._asks.copy()
-
-        #print self.symbol, "Bid top_n:", self._bids_to_qty.top_n(__LEVELS__)
-        i = 0
-        for i, px in enumerate(self._bids_to_qty.top_n(__LEVELS__)):
-            self._bids[i][0] = px
-            self._bids[i][1] = self._bids_to_qty.get_quantity(px)
-        for j in range(i, __LEVELS__):
-            self._bids[j][0] = 0
-            self._bids[j][1] = 0
-
-        #print self.symbol, "Ask top_n:", self._asks_to_qty.top_n(__LEVELS__)
-        for i, px in enumerate(self._asks_to_qty.top_n(__LEVELS__)):
-            self._asks[i][0] = px
-            self._asks[i][1] = self._asks_to_qty.get_quantity(px)
-        for j in range(i, __LEVELS__):
-            self._asks[j][0] = 0
-            self._asks[j][1] = 0
-
-        self._record['bid'] = self._bids
-        self._record['ask'] = self._asks
-        self._record['timestamp'] = ts
-        self._record['timestamp_s'] = ts_s
-        self._record['seqnum'] = seqnum
+        timestamps for storing. ts_s may be None (see append_book).
+
+        Only levels at or below the best one changed since the last record
+        are rebuilt, and a record changing nothing in the top levels is
+        counted as unchanged without touching the arrays.
+        """
+        bids_changed = self.update_levels(self._bids, self._bids_to_qty)
+        asks_changed = self.update_levels(self._asks, self._asks_to_qty)
 
         top_bid = self._bids[0][0]
         top_ask = self._asks[0][0]
@@ -193,11 +787,10 @@ class BookBuilder(object):
             #print excp.message
             raise excp
 
-        if (self._bids == previous_bids).all() and (self._asks == previous_asks).all():
+        if not (bids_changed or asks_changed):
             self._unchanged += 1
         else:
-            self._record.append()
-            self._file_record_counter.increment_count()
+            self.append_book(ts, ts_s, seqnum)
         
     def process_record(self, amd_record):
         raise RuntimeError("process_record Subclass Responsibility")
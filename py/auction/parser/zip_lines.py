@@ -0,0 +1,124 @@
+###############################################################################
+#
+# File: zip_lines.py
+#
+# Description: Streaming iteration over the lines of a zip member, inflating
+#              the next block on a background thread while the current one
+#              is parsed
+#
+##############################################################################
+from attribute import readable
+from Queue import Queue, Full
+from threading import Thread, Event
+import sys
+
+# Bytes of the member decompressed per block
+__READ_SIZE__ = 1 << 22
+# Blocks decompressed ahead of the parse, 0 to decompress on the parsing thread
+__READ_AHEAD__ = 2
+
+class ZipMemberLines(object):
+    """
+    The lines of a member of an open ZipFile, the same as
+    root.read(member).split("\\n") gives, read through ZipFile.open
+    read_size bytes at a time. Only the blocks in flight are held in memory,
+    rather than the whole member and a list of all of its lines.
+
+    With read_ahead > 0 a background thread decompresses up to that many
+    blocks ahead of the iteration. zlib releases the GIL while inflating,
+    so decompressing overlaps with parsing on another cpu. Errors reading
+    the member are raised by the iteration.
+    """
+    readable(member=None, read_size=__READ_SIZE__, read_ahead=__READ_AHEAD__)
+
+    def __init__(self, root, member, read_size = __READ_SIZE__, read_ahead = __READ_AHEAD__):
+        self.__root = root
+        self.__member = member
+        self.__read_size = read_size
+        self.__read_ahead = read_ahead
+
+    def __iter__(self):
+        tail = ''
+        for chunk in self.chunks():
+            lines = chunk.split("\n")
+            tail = lines.pop()
+            for line in lines:
+                yield line
+        yield tail
+
+    def chunks(self):
+        """
+        The member as blocks of whole lines, about read_size bytes each. Each
+        block ends with "\\n" except the last if the member does not, so
+        chunk.count("\\n") is the number of lines ended in it and joining
+        the blocks gives the member.
+        """
+        carry = ''
+        for data in self.__blocks():
+            text = carry + data
+            end = text.rfind("\n")
+            if end < 0:
+                carry = text
+                continue
+            yield text[:end+1]
+            carry = text[end+1:]
+        if carry:
+            yield carry
+
+    def __read_blocks(self):
+        """
+        The decompressed blocks of the member, read on the calling thread
+        """
+        stream = self.__root.open(self.__member)
+        try:
+            for data in iter(lambda: stream.read(self.__read_size), ''):
+                yield data
+        finally:
+            stream.close()
+
+    def __blocks(self):
+        """
+        The decompressed blocks of the member, read ahead on a background
+        thread if read_ahead > 0
+        """
+        if self.__read_ahead <= 0:
+            for data in self.__read_blocks():
+                yield data
+            return
+        queue = Queue(self.__read_ahead)
+        stop = Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, True, 0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def read_ahead():
+            try:
+                for data in self.__read_blocks():
+                    if not put((data, None)):
+                        return
+            except Exception:
+                put((None, sys.exc_info()))
+                return
+            put((None, None))
+
+        thread = Thread(target=read_ahead)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                data, error = queue.get()
+                if error:
+                    raise error[0], error[1], error[2]
+                if data is None:
+                    break
+                yield data
+        finally:
+            # stops the thread if the iteration ends early
+            stop.set()
+            thread.join()
@@ -0,0 +1,87 @@
+###############################################################################
+#
+# File: storage.py
+#
+# Description: Storage profiles - compression codec, level, shuffle and chunk
+#              size used when creating book, trade and parse result tables
+#
+##############################################################################
+from attribute import readable
+from tables import Filters
+
+class StorageProfile(object):
+    """
+    How a table is stored: the compression library (any PyTables complib,
+    e.g. zlib, bzip2, blosc, blosc:lz4), compression level (0 for none),
+    whether to shuffle bytes before compressing and the number of rows per
+    chunk (None to let PyTables size the chunks, about 64KB for books).
+
+    Larger chunks compress better and read faster in full scans, at the cost
+    of reading a whole chunk for any single row.
+    """
+    readable(name=None, complib='zlib', complevel=1, shuffle=True, chunk_rows=None)
+
+    def __init__(self, name, complib='zlib', complevel=1, shuffle=True, chunk_rows=None):
+        self.__name = name
+        self.__complib = complib
+        self.__complevel = complevel
+        self.__shuffle = shuffle
+        self.__chunk_rows = chunk_rows
+
+    def filters(self):
+        return Filters(complevel=self.__complevel, complib=self.__complib,
+                       shuffle=self.__shuffle)
+
+    def create_table(self, h5_file, where, name, description, title):
+        """
+        Create the table in h5_file stored per this profile
+        """
+        chunkshape = (self.__chunk_rows,) if self.__chunk_rows else None
+        return h5_file.createTable(where, name, description, title,
+                                   filters=self.filters(), chunkshape=chunkshape)
+
+    def create_earray(self, h5_file, where, name, atom, title):
+        """
+        Create an extendable one dimensional array of atom in h5_file stored
+        per this profile
+        """
+        chunkshape = (self.__chunk_rows,) if self.__chunk_rows else None
+        return h5_file.createEArray(where, name, atom, (0,), title,
+                                    filters=self.filters(), chunkshape=chunkshape)
+
+    def __str__(self):
+        return "%s(%s level %d%s, %s rows/chunk)" % \
+            (self.__name, self.__complib, self.__complevel,
+             self.__shuffle and ' shuffled' or '', self.__chunk_rows or 'default')
+
+# Known profiles by name. 'zlib1' is how all tables were always written.
+__STORAGE_PROFILES__ = dict((profile.name, profile) for profile in [
+        StorageProfile('zlib1'),
+        StorageProfile('zlib1_big', chunk_rows=4096),
+        StorageProfile('zlib6_big', complevel=6, chunk_rows=4096),
+        StorageProfile('blosc_lz4', complib='blosc:lz4', complevel=5, chunk_rows=4096),
+        StorageProfile('blosc_lz4hc', complib='blosc:lz4hc', complevel=5, chunk_rows=4096),
+        StorageProfile('blosc_zlib', complib='blosc:zlib', complevel=5, chunk_rows=4096),
+        StorageProfile('bzip2', complib='bzip2', complevel=5, chunk_rows=4096),
+        StorageProfile('none', complevel=0),
+        ])
+
+DEFAULT_STORAGE = __STORAGE_PROFILES__['zlib1']
+
+def storage_profile_names():
+    return sorted(__STORAGE_PROFILES__.keys())
+
+def get_storage_profile(profile):
+    """
+    The StorageProfile named by profile, or profile itself if already one.
+    None gives DEFAULT_STORAGE.
+    """
+    if profile is None:
+        return DEFAULT_STORAGE
+    if isinstance(profile, StorageProfile):
+        return profile
+    result = __STORAGE_PROFILES__.get(profile)
+    if not result:
+        raise RuntimeError("Unknown storage profile %s, not one of %s" %
+                           (profile, storage_profile_names()))
+    return result
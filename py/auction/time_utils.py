@@ -74,6 +74,123 @@ def chicago_time(ts):
 def chicago_time_str(ts):
     return chicago_time(ts).strftime('%H:%M:%S.%f') if ts else 'Not Set'
 
+__SECONDS_PER_HOUR__ = 3600
+__SECONDS_PER_DAY__ = 86400
+__MAX_CACHED_SECONDS__ = 1 << 17
+
+class ChicagoTimeFormatter(object):
+    r"""
+
+Callable giving the same string as chicago_time_str, without the datetime
+construction and timezone conversion per call. The utc offset of chicago
+time is looked up once per utc hour (transitions between CST and CDT fall on
+utc hour boundaries) and the 'HH:MM:SS.' prefix is formatted once per whole
+second, leaving only the microseconds to format per call.
+
+"""
+
+    def __init__(self):
+        self.__offsets = {}
+        self.__prefixes = {}
+
+    def __call__(self, ts):
+        if not ts:
+            return 'Not Set'
+        second, micros = divmod(int(ts), __SUBSECOND_RESOLUTION__)
+        prefix = self.__prefixes.get(second)
+        if prefix is None:
+            prefix = self.__prefix(second)
+        return prefix + ('%06d' % micros)
+
+    def utc_offset(self, second):
+        """
+        Offset in seconds of chicago time from utc at the utc second
+        """
+        hour = second // __SECONDS_PER_HOUR__
+        offset = self.__offsets.get(hour)
+        if offset is None:
+            delta = chicago_time(hour*__SECONDS_PER_HOUR__*__SUBSECOND_RESOLUTION__).utcoffset()
+            offset = delta.days*__SECONDS_PER_DAY__ + delta.seconds
+            self.__offsets[hour] = offset
+        return offset
+
+    def __prefix(self, second):
+        if len(self.__prefixes) >= __MAX_CACHED_SECONDS__:
+            self.__prefixes.clear()
+        local = (second + self.utc_offset(second)) % __SECONDS_PER_DAY__
+        prefix = '%02d:%02d:%02d.' % (local // __SECONDS_PER_HOUR__, (local // 60) % 60, local % 60)
+        self.__prefixes[second] = prefix
+        return prefix
+
+fast_chicago_time_str = ChicagoTimeFormatter()
+
+# Microseconds per unit of the last digit, by number of digits of the second
+__SUBSECOND_SCALE__ = { 3 : 1000, 4 : 100, 5 : 10 }
+
+class CmeTimestampParser(object):
+    r"""
+
+Callable giving the same timestamp as timestamp_from_cme_timestamp for a CME
+SendingTime (utc YYYYMMDDHHMMSS followed by 3 to 5 digits of the second),
+without the regular expression and datetime per call. The epoch of the date
+is computed once per date, the time of day from the digits with integer
+arithmetic.
+
+"""
+
+    def __init__(self):
+        self.__date = None
+        self.__epoch = 0
+
+    def __call__(self, ts_str):
+        date = ts_str[:8]
+        if date != self.__date:
+            self.__epoch = calendar.timegm((int(date[:4]), int(date[4:6]), int(date[6:8]), 0, 0, 0))
+            self.__date = date
+        hms = int(ts_str[8:14])
+        subsecond = ts_str[14:19]
+        return (self.__epoch + (hms // 10000)*__SECONDS_PER_HOUR__ + ((hms // 100) % 100)*60 +
+                hms % 100)*__SUBSECOND_RESOLUTION__ + \
+                int(subsecond)*__SUBSECOND_SCALE__[len(subsecond)]
+
+fast_timestamp_from_cme_timestamp = CmeTimestampParser()
+
+class LocalTimestampParser(object):
+    r"""
+
+Callable giving the timestamp of a local time YYYYMMDDHHMMSS in tzinfo, the
+same as converting a datetime of it with the tzinfo to utc, without the
+datetime and timezone conversion per call. The utc second starting each
+local date and hour is looked up once (transitions between standard and
+daylight time fall on hour boundaries), the minutes and seconds added with
+integer arithmetic.
+
+"""
+
+    def __init__(self, tzinfo):
+        self.__tzinfo = tzinfo
+        self.__hours = {}
+
+    def __call__(self, date_time):
+        hour = date_time[:10]
+        start = self.__hours.get(hour)
+        if start is None:
+            start = self.hour_start(hour)
+        ms = int(date_time[10:14])
+        return (start + (ms // 100)*60 + ms % 100)*__SUBSECOND_RESOLUTION__
+
+    def hour_start(self, hour):
+        """
+        The utc second starting the local YYYYMMDDHH
+        """
+        local = dt(int(hour[:4]), int(hour[4:6]), int(hour[6:8]), int(hour[8:10]),
+                   tzinfo=self.__tzinfo)
+        result = timestamp_from_datetime(local.astimezone(UTC_TZ)) // __SUBSECOND_RESOLUTION__
+        self.__hours[hour] = result
+        return result
+
+fast_chicago_timestamp = LocalTimestampParser(CHI_TZ)
+
 def get_date_of_file(fileName):
     """
     Given a filename with a date in it (YYYYMMDD), parse out the date
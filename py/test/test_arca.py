@@ -7,3 +7,367 @@ def testIntPrice():
     assert(1200000 == int_price("1.2000"))
     assert(11000000 == int_price("11"))
     assert(3140000 == int_price("3.14"))
+
+from auction.parser.arca_parser import AddRecord, DeleteRecord, ModifyRecord, record_code, record_symbol
+from auction.parser.arca_block_parser import decode_block, ArcaBlockReader
+from StringIO import StringIO
+from numpy import array
+import re
+
+__SAMPLE__ = """A,199999935,121967691,P,B,1000,XLI,38.7300,57687,522,E,ARCAX,E
+I,199999936,XLI,P,E
+A,200000015,121967692,P,S,25900,SPY,151.31,57687,562,E,ARCAX,E
+M,200000020,121967692,2500,.0015,57687,600,SPY,P,E,ARCAX,S,E
+D,200000173,121967691,57687,632,XLI,P,E,ARCAX,B,E
+V,200000174,SPY
+D,200000180,121967692,57688,,SPY,P,E,ARCAX,S,E
+"""
+
+def testDecodeBlock():
+    sod = 1311321600000000
+    batch, lines = decode_block(__SAMPLE__, sod, 10)
+    assert(lines == 7)
+    assert(list(batch['code']) == ['A', 'A', 'M', 'D', 'D'])
+    assert(list(batch['line']) == [10, 12, 13, 14, 16])
+    classes = { 'A' : AddRecord, 'D' : DeleteRecord, 'M' : ModifyRecord }
+    lines = __SAMPLE__.split('\n')
+    for row in batch:
+        fields = re.split(r'\s*,\s*', lines[row['line']-10])
+        record = classes[row['code']](fields, sod)
+        assert(row['seq_num'] == int(record.seq_num))
+        assert(row['order_id'] == int(record.order_id))
+        assert(row['symbol'] == record.symbol)
+        assert((row['side'] == 'B') == record.is_buy)
+        assert(row['timestamp'] == record.timestamp)
+        if row['code'] != 'D':
+            assert(row['price'] == record.price)
+            assert(row['qty'] == record.quantity)
+
+def testDecodeBlockSymbols():
+    sod = 1311321600000000
+    batch, lines = decode_block(__SAMPLE__, sod, 0, array(['XLI']))
+    assert(lines == 7)
+    # last record (SPY delete) is kept for its timestamp
+    assert(list(batch['line']) == [0, 4, 6])
+    assert(list(batch['symbol']) == ['XLI', 'XLI', 'SPY'])
+    batch, lines = decode_block(__SAMPLE__, sod, 0, array(['IBM']))
+    assert(lines == 7)
+    assert(list(batch['line']) == [6])
+    assert(batch['timestamp'][0] == sod + 57688*1000000)
+
+def testRecordSymbol():
+    lines = __SAMPLE__.split('\n')
+    assert([ record_code(l) for l in lines[:3] ] == ['A', 'I', 'A'])
+    assert(record_symbol(lines[0], 'A') == 'XLI')
+    assert(record_symbol(lines[3], 'M') == 'SPY')
+    assert(record_symbol(lines[4], 'D') == 'XLI')
+
+def testBlockReader():
+    reader = ArcaBlockReader(StringIO(__SAMPLE__.rstrip()), 0, block_size=50)
+    batches = list(reader)
+    assert(reader.line_count == 7)
+    assert(sum(len(b) for b in batches) == 5)
+    assert([ l for b in batches for l in b['line'] ] == [0, 2, 3, 4, 6])
+
+from auction.parser.block_gzip import recompress, BlockGzipIndex
+import gzip
+
+def testBlockGzip(tmpdir):
+    src = str(tmpdir.join('arcabook20110722.csv.gz'))
+    dst = str(tmpdir.join('blocked.csv.gz'))
+    text = __SAMPLE__ * 20
+    out = gzip.open(src, 'wb')
+    out.write(text)
+    out.close()
+    recompress(src, dst, lambda block: len(block), block_size=100)
+    assert(gzip.open(dst, 'rb').read() == text)
+    index = BlockGzipIndex.find(dst)
+    assert(len(index.blocks) > 10)
+    assert(BlockGzipIndex.find(src) is None)
+    lines = text.splitlines(True)
+    for line in (0, 1, 13, 70, 139):
+        assert(index.lines(line, 3) == lines[line:line+3])
+    block = index.block_for_line(50)
+    stream, first_line = index.open(block)
+    assert(first_line <= 50 and stream.read() == ''.join(lines[first_line:]))
+
+from auction.parser import arca_parser
+from auction.parser.arca_parser import ArcaParser, RunOptions
+from path import path
+from sets import Set
+from tables import openFile
+from auction import book_processor
+import datetime
+
+def arca_sample(tmpdir, monkeypatch, sample):
+    """
+    Returns tuple (arca book file, date) of the gzipped sample in tmpdir,
+    which the parse output then also goes to
+    """
+    monkeypatch.setattr(arca_parser, '__ARCA_OUT_PATH__', path(str(tmpdir)))
+    monkeypatch.setattr(book_processor, 'ARCA_OUT_PATH', path(str(tmpdir)))
+    src = path(str(tmpdir.join('arcabook20110722.csv.gz')))
+    out = gzip.open(src, 'wb')
+    out.write(sample)
+    out.close()
+    return (src, datetime.date(2011, 7, 22))
+
+def testReplay(tmpdir, monkeypatch):
+    src, date = arca_sample(tmpdir, monkeypatch, __SAMPLE__)
+    ArcaParser(src, date, 'ALL').parse(False, run_options=RunOptions(block_mode=True))
+    amd = path(str(tmpdir.join('20110722_ALL_AMD_.h5')))
+    records = openFile(amd)
+    assert(list(records.root._AMD_Data_.records.cols.line) == [0, 2, 3, 4, 6])
+    records.close()
+    ArcaParser(src, date, 'TEXT', Set(['SPY'])).parse()
+    ArcaParser(amd, date, 'REPLAY', Set(['SPY'])).parse(run_options=RunOptions(replay=True))
+    text = openFile(str(tmpdir.join('20110722_TEXT.h5')))
+    replay = openFile(str(tmpdir.join('20110722_REPLAY.h5')))
+    assert([ node._v_name for node in replay.root ] == ['SPY', 'parse_results'])
+    assert(replay.root.SPY.books.nrows == 3)
+    assert((text.root.SPY.books.read() == replay.root.SPY.books.read()).all())
+    assert(text.root.parse_results.summary[0]['data_stop'] ==
+           replay.root.parse_results.summary[0]['data_stop'])
+    text.close()
+    replay.close()
+
+from auction.parser.arca_parser import replay_from
+from auction.parser.keyframes import find_keyframe
+from auction.time_utils import start_of_date, NY_TZ
+
+def testReplayFrom(tmpdir, monkeypatch):
+    src, date = arca_sample(tmpdir, monkeypatch, __SAMPLE__)
+    sod = start_of_date(2011, 7, 22, NY_TZ)
+    ArcaParser(src, date, 'ALL').parse(False, run_options=RunOptions(block_mode=True))
+    ArcaParser(src, date, 'KF').parse(run_options=RunOptions(keyframe_events=1))
+    books = openFile(str(tmpdir.join('20110722_KF.h5')))
+    assert(list(books.root.SPY.keyframes.cols.line) == [2, 3, 6])
+    assert(books.root.SPY.keyframe_orders[:].tolist() == [(121967692, False, 151310000, 25900, False),
+                                                          (121967692, False, 1500, 2500, False)])
+    for timestamp, line, orders in ((sod + 57687561000, -1, []),
+                                    (sod + 57687600000, 3, [(121967692, False, 1500, 2500, False)]),
+                                    (sod + 57687999000, 3, [(121967692, False, 1500, 2500, False)]),
+                                    (sod + 57688000000, 6, [])):
+        keyframe = find_keyframe(books, 'SPY', timestamp)
+        assert((keyframe[2] if keyframe else -1) == line)
+        h5_file = openFile('memory%d.h5' % timestamp, mode = 'w', driver = 'H5FD_CORE',
+                           driver_core_backing_store = 0)
+        builder = replay_from(date, 'SPY', timestamp, h5_file)
+        assert(builder._orders.snapshot() == orders)
+        assert(builder.asks()[0].tolist() == (list(orders[0][2:4]) if orders else [0, 0]))
+        h5_file.close()
+    books.close()
+
+from auction.book_processor import BookStream, H5Repository
+from auction.parser.utils import BookOptions
+
+__LADDER_SAMPLE__ = """A,1,1,P,S,100,SPY,151.31,57687,100,E,ARCAX,E
+A,2,2,P,S,200,SPY,151.32,57687,200,E,ARCAX,E
+A,3,3,P,B,300,SPY,151.30,57687,300,E,ARCAX,E
+D,4,2,57688,400,SPY,P,E,ARCAX,S,E
+"""
+
+def testBbo(tmpdir, monkeypatch):
+    src, date = arca_sample(tmpdir, monkeypatch, __LADDER_SAMPLE__)
+    for tag, block_mode in (('BBO', False), ('BLOCK', True)):
+        ArcaParser(src, date, tag).parse(run_options = RunOptions(block_mode = block_mode),
+                                         book_options = BookOptions(bbo = True))
+        books = openFile(str(tmpdir.join('20110722_%s.h5' % tag)))
+        assert(books.root.SPY.books.nrows == 4)
+        # the second ask and its delete leave the top unchanged
+        assert(list(books.root.SPY.bbo.cols.seqnum) == [1, 3])
+        bbo = books.root.SPY.bbo.read()
+        assert(list(bbo['bid_px']) == [0, 151300000])
+        assert(list(bbo['bid_qty']) == [0, 300])
+        assert(list(bbo['ask_px']) == [151310000, 151310000])
+        assert(list(bbo['ask_qty']) == [100, 100])
+        books.close()
+    path(str(tmpdir.join('20110722_BBO.h5'))).symlink(str(tmpdir.join('20110722')))
+    records = list(BookStream('20110722', 'SPY', bbo = True))
+    assert([ record['seqnum'] for record in records ] == [1, 3])
+    assert([ record['bid_qty'] for record in records ] == [0, 300])
+    H5Repository.close_all()
+
+from auction import instruments
+from auction.instruments import Instrument
+from auction.book_columns import book_dataset
+
+__OFF_GRID_SAMPLE__ = """A,1,1,P,S,100,SPY,151.31,57687,100,E,ARCAX,E
+A,2,2,P,S,200,SPY,151.320015,57687,200,E,ARCAX,E
+A,3,3,P,B,300,SPY,151.30,57687,300,E,ARCAX,E
+D,4,2,57688,400,SPY,P,E,ARCAX,S,E
+A,5,5,P,B,500,SPY,151.29,57688,500,E,ARCAX,E
+"""
+
+def testCompactOffGrid(tmpdir, monkeypatch):
+    src, date = arca_sample(tmpdir, monkeypatch, __OFF_GRID_SAMPLE__)
+    # any price is on the default one unit grid
+    compact = BookOptions(book_layout = 'compact', buffer_rows = 2)
+    ArcaParser(src, date, 'EXACT').parse(book_options = compact)
+    books = openFile(str(tmpdir.join('20110722_EXACT.h5')))
+    assert(book_dataset(books.root.SPY).nrows == 5)
+    assert(book_dataset(books.root.SPY)[2]['ask'][:2].tolist() == [[151310000, 100], [151320015, 200]])
+    assert(books.root.parse_results.warnings.nrows == 0)
+    books.close()
+    # on a $0.0001 grid each book with the off grid price is a warning and
+    # the others are stored
+    monkeypatch.setattr(instruments, '__instruments__',
+                        { ('SPY', 'ARCA') : Instrument('SPY', 'ARCA', 100, 1000000) })
+    for tag, block_mode in (('LINE', False), ('BLOCK', True)):
+        ArcaParser(src, date, tag).parse(run_options = RunOptions(block_mode = block_mode),
+                                         book_options = compact)
+        books = openFile(str(tmpdir.join('20110722_%s.h5' % tag)))
+        stored = book_dataset(books.root.SPY).read()
+        assert(list(stored['seqnum']) == [1, 4, 5])
+        assert(stored[2]['bid'][:2].tolist() == [[151300000, 300], [151290000, 500]])
+        warnings = books.root.parse_results.warnings.read()
+        assert(list(warnings['src_line']) == [2, 3])
+        books.close()
+
+from auction.parser.block_gzip import recompress
+from auction.parser.arca_block_parser import decode_block
+
+# three SPY adds a second from 57600, an I record after each second's adds
+__WINDOW_SAMPLE__ = ''.join('A,%d,%d,P,B,100,SPY,151.%02d,%d,%d,E,ARCAX,E\n' %
+                            (i + 1, 1000 + i, i % 50, 57600 + i // 3, (i % 3) * 100) +
+                            ('I,%d,SPY,P,E\n' % (i + 1) if i % 3 == 2 else '')
+                            for i in range(300))
+
+def window_parse(tmpdir, src, date, tag, block_mode, start_time, stop_time):
+    """
+    Tuple (summary, SPY books or None) of a parse of the time window
+    """
+    ArcaParser(src, date, tag).parse(run_options = RunOptions(block_mode = block_mode,
+                                                                start_time = start_time,
+                                                                stop_time = stop_time))
+    output, = path(str(tmpdir)).files('20110722_%s_W*.h5' % tag)
+    h5_file = openFile(output)
+    summary = h5_file.root.parse_results.summary[0]
+    books = h5_file.root.SPY.books.read() if 'SPY' in h5_file.root else None
+    h5_file.close()
+    return (summary, books)
+
+def testWindowProcessed(tmpdir, monkeypatch):
+    src, date = arca_sample(tmpdir, monkeypatch, __WINDOW_SAMPLE__)
+    sod = start_of_date(2011, 7, 22, NY_TZ)
+    blocked = path(str(tmpdir.join('blocked', src.basename())))
+    recompress(src, blocked, lambda block: int(decode_block(block, sod)[0]['timestamp'][0]),
+               block_size = 500)
+    start_time, stop_time = sod + 57650*1000000, sod + 57660*1000000
+    results = [ window_parse(tmpdir, input_path, date, 'P%d%d' % (blocks, block_mode),
+                             block_mode, start_time, stop_time)
+                for blocks, input_path in enumerate((src, blocked))
+                for block_mode in (False, True) ]
+    for summary, books in results:
+        # from the first add at 57650 (line 200) through the add at 57660 ending the window
+        assert(summary['processed'] == 41)
+        assert(summary['data_start'] == start_time)
+        assert(len(books) == 30 and (books == results[0][1]).all())
+    # a window without records
+    for blocks, input_path in enumerate((src, blocked)):
+        for block_mode in (False, True):
+            summary, books = window_parse(tmpdir, input_path, date, 'E%d%d' % (blocks, block_mode),
+                                          block_mode, start_time + 500000, start_time + 900000)
+            assert(summary['processed'] == 0 and summary['data_start'] == 0)
+            assert(books is None)
+
+def testReplaySymbolQueries(tmpdir, monkeypatch):
+    src, date = arca_sample(tmpdir, monkeypatch, __SAMPLE__)
+    ArcaParser(src, date, 'ALL').parse(False, run_options=RunOptions(block_mode=True))
+    amd = path(str(tmpdir.join('20110722_ALL_AMD_.h5')))
+    symbols = Set(['SPY', 'XLI', 'QQQ'])
+    ArcaParser(src, date, 'TEXT', symbols).parse()
+    # a query per symbol
+    monkeypatch.setattr(arca_parser, '__QUERY_SYMBOLS__', 1)
+    ArcaParser(amd, date, 'REPLAY', symbols).parse(run_options=RunOptions(replay=True))
+    ArcaParser(amd, date, 'WINDOW', symbols).parse(run_options=RunOptions(replay=True, start_line=3))
+    text = openFile(str(tmpdir.join('20110722_TEXT.h5')))
+    replay = openFile(str(tmpdir.join('20110722_REPLAY.h5')))
+    for symbol in ('SPY', 'XLI'):
+        assert((text.root._f_getChild(symbol).books.read() ==
+                replay.root._f_getChild(symbol).books.read()).all())
+    window, = path(str(tmpdir)).files('20110722_WINDOW_W*.h5')
+    window = openFile(window)
+    # every row of the archive is scanned, the window starting at its third
+    assert(window.root.parse_results.summary[0]['processed'] == 5)
+    for h5_file in (text, replay, window):
+        h5_file.close()
+
+import os
+import pytest
+
+# bids and asks for five symbols, each fourth deleting the add five before it, of the same symbol
+__SHARD_SYMBOLS__ = ('SPY', 'XLI', 'QQQ', 'IWM', 'DIA')
+__SHARD_SAMPLE__ = ''.join('A,%d,%d,P,%s,100,%s,%d.%02d,%d,%d,E,ARCAX,E\n' %
+                           (i + 1, 1000 + i, 'BS'[i % 2], __SHARD_SYMBOLS__[i % 5],
+                            30 + i % 2 * 20 + i % 7, i % 50, 57600 + i // 10, (i % 10) * 100) +
+                           ('D,%d,%d,%d,%d,%s,P,E,ARCAX,%s,E\n' %
+                            (i + 1, 995 + i, 57600 + i // 10, (i % 10) * 100,
+                             __SHARD_SYMBOLS__[i % 5], 'BS'[(i - 5) % 2])
+                            if i % 4 == 3 and i >= 5 else '')
+                           for i in range(400))
+
+def testShards(tmpdir, monkeypatch):
+    src, date = arca_sample(tmpdir, monkeypatch, __SHARD_SAMPLE__)
+    ArcaParser(src, date, 'ONE').parse()
+    # three workers, one of them owning none of the symbols
+    ArcaParser(src, date, 'SHARDED').parse(run_options=RunOptions(shards=3))
+    one = openFile(str(tmpdir.join('20110722_ONE.h5')))
+    sharded = openFile(str(tmpdir.join('20110722_SHARDED.h5')))
+    for symbol in __SHARD_SYMBOLS__:
+        books = one.root._f_getChild(symbol).books.read()
+        assert(len(books) > 0)
+        assert((books == sharded.root._f_getChild(symbol).books.read()).all())
+    assert(one.root.parse_results.summary[0]['processed'] ==
+           sharded.root.parse_results.summary[0]['processed'])
+    one.close()
+    sharded.close()
+    assert(path(str(tmpdir)).files('*.shard*') == [])
+
+    # a worker dying fails the parse rather than leaving out its symbols
+    monkeypatch.setattr(ArcaParser, 'build_shard', lambda self, shard_path, queue: os._exit(3))
+    parser = ArcaParser(src, date, 'DIED')
+    with pytest.raises(RuntimeError):
+        parser.parse(run_options=RunOptions(shards=2))
+    parser._ArcaParser__h5_file.close()
+
+from auction.parser.checkpoint import Checkpoint
+from auction.parser.arca_block_parser import ArcaBlockReader
+from functools import partial
+
+class Died(Exception):
+    pass
+
+def testResume(tmpdir, monkeypatch):
+    src, date = arca_sample(tmpdir, monkeypatch, __SHARD_SAMPLE__)
+    # blocks of about 40 lines, for block mode to checkpoint between them
+    monkeypatch.setattr(arca_parser, 'ArcaBlockReader', partial(ArcaBlockReader, block_size = 2000))
+    save = Checkpoint.save
+    def save_and_die(self, h5_file, line, state):
+        save(self, h5_file, line, state)
+        raise Died()
+    for block_mode in (False, True):
+        full_tag, tag = 'FULL%d' % block_mode, 'RESUMED%d' % block_mode
+        ArcaParser(src, date, full_tag).parse(run_options = RunOptions(block_mode = block_mode))
+        monkeypatch.setattr(Checkpoint, 'save', save_and_die)
+        parser = ArcaParser(src, date, tag)
+        with pytest.raises(Died):
+            parser.parse(run_options = RunOptions(block_mode = block_mode, checkpoint_lines = 150))
+        parser._ArcaParser__h5_file.close()
+        monkeypatch.setattr(Checkpoint, 'save', save)
+        checkpoint = Checkpoint(str(tmpdir.join('20110722_%s.h5.checkpoint' % tag))).load()
+        assert(150 <= checkpoint['line'] < 300)
+        ArcaParser(src, date, tag).parse(run_options = RunOptions(block_mode = block_mode,
+                                                                  checkpoint_lines = 150,
+                                                                  resume = True))
+        assert(not tmpdir.join('20110722_%s.h5.checkpoint' % tag).check())
+        full = openFile(str(tmpdir.join('20110722_%s.h5' % full_tag)))
+        resumed = openFile(str(tmpdir.join('20110722_%s.h5' % tag)))
+        for symbol in __SHARD_SYMBOLS__:
+            assert((full.root._f_getChild(symbol).books.read() ==
+                    resumed.root._f_getChild(symbol).books.read()).all())
+        full_summary, summary = full.root.parse_results.summary[0], resumed.root.parse_results.summary[0]
+        for field in ('data_start', 'data_stop', 'processed'):
+            assert(full_summary[field] == summary[field])
+        full.close()
+        resumed.close()
@@ -0,0 +1,162 @@
+from auction.book import BookTable, Book, InMemoryBook, table_description
+from auction.trade import TradeTable
+from auction.time_utils import chicago_time_str
+from tables import openFile
+
+def test_optional_timestamp_s(tmpdir):
+    h5_file = openFile(str(tmpdir.join('books.h5')), mode='w')
+    stored = h5_file.createTable('/', 'stored', table_description(BookTable))
+    bare = h5_file.createTable('/', 'bare', table_description(BookTable, False))
+    trades = h5_file.createTable('/', 'trades', table_description(TradeTable, False))
+    assert('timestamp_s' in stored.colnames)
+    assert('timestamp_s' not in bare.colnames)
+    assert('timestamp_s' not in trades.colnames)
+    assert(sorted(bare.colnames + ['timestamp_s']) == sorted(stored.colnames))
+    ts = 1311321600730001
+    for table in (stored, bare):
+        row = table.row
+        row['timestamp'] = ts
+        if table is stored:
+            row['timestamp_s'] = chicago_time_str(ts)
+        row.append()
+        table.flush()
+    for table in (stored, bare):
+        assert(Book(table[0]).timestamp_s() == chicago_time_str(ts))
+        assert(InMemoryBook(table[0])['timestamp_s'] == chicago_time_str(ts))
+        for row in table:
+            assert(Book(row).timestamp_s() == chicago_time_str(ts))
+    h5_file.close()
+
+def test_book_columns(tmpdir):
+    from auction.book_columns import BookColumns, book_dataset, read_books
+    from numpy import arange, array_equal
+    h5_file = openFile(str(tmpdir.join('columns.h5')), mode='w')
+    description = table_description(BookTable)
+    table = h5_file.createTable(h5_file.createGroup('/', 'rows'), 'books', description)
+    columns = BookColumns.create(h5_file, h5_file.createGroup('/', 'columns'), description, 'columns')
+    assert(columns.colnames == table.colnames)
+    assert(columns.dtype == table.dtype)
+    rows = table.read()
+    rows.resize(100)
+    rows['timestamp'] = arange(100) + 1311321600730001
+    rows['timestamp_s'] = [ chicago_time_str(ts) for ts in rows['timestamp'] ]
+    rows['bid'] = arange(100*20*2).reshape(100, 20, 2)[:, :10]
+    rows['ask'] = -rows['bid']
+    rows['seqnum'] = arange(100)
+    table.append(rows)
+    columns.append(rows[:60])
+    columns.append(rows[60:])
+    assert(book_dataset(h5_file.root.columns).nrows == 100)
+    assert(array_equal(columns.read(), rows))
+    assert(array_equal(columns.read(10, 20), rows[10:20]))
+    assert(Book(columns[42]).timestamp_s() == Book(table[42]).timestamp_s())
+    fields = ['timestamp', 'bid_px0', 'ask_qty9']
+    for dataset in (table, book_dataset(h5_file.root.columns)):
+        projected = read_books(dataset, 5, 50, fields)
+        assert(list(projected.dtype.names) == fields)
+        assert(array_equal(projected['timestamp'], rows['timestamp'][5:50]))
+        assert(array_equal(projected['bid_px0'], rows['bid'][5:50, 0, 0]))
+        assert(array_equal(projected['ask_qty9'], rows['ask'][5:50, 9, 1]))
+    h5_file.close()
+
+def test_book_deltas(tmpdir):
+    from auction.book_columns import BookDeltas, book_dataset, read_books
+    from numpy import arange, array_equal
+    import random
+    h5_file = openFile(str(tmpdir.join('deltas.h5')), mode='w')
+    description = table_description(BookTable)
+    table = h5_file.createTable('/', 'books', description)
+    deltas = BookDeltas.create(h5_file, h5_file.createGroup('/', 'SPY'), description, 'deltas',
+                               keyframe_books = 16)
+    assert(deltas.colnames == table.colnames)
+    assert(deltas.dtype == table.dtype)
+    rows = table.read()
+    rows.resize(100)
+    rows['timestamp'] = arange(100) + 1311321600730001
+    rows['timestamp_s'] = [ chicago_time_str(ts) for ts in rows['timestamp'] ]
+    rows['seqnum'] = arange(100)
+    rng = random.Random(5)
+    for i in range(1, 100):
+        # each book changes one level of the one before
+        rows['bid'][i] = rows['bid'][i-1]
+        rows['ask'][i] = rows['ask'][i-1]
+        rows[rng.choice(['bid', 'ask'])][i, rng.randint(0, 9)] = (rng.randint(1, 99), rng.randint(1, 9))
+    deltas.append(rows[:7])
+    deltas.append(rows[7:60])
+    h5_file.close()
+
+    h5_file = openFile(str(tmpdir.join('deltas.h5')), mode='a')
+    deltas = book_dataset(h5_file.root.SPY)
+    deltas.append(rows[60:])
+    assert(deltas.nrows == 100)
+    # 7 keyframes of 20 cells, at most one cell for each other book
+    assert(h5_file.root.SPY.book_deltas.cell_slots.nrows <= 7*20 + 93)
+    assert(array_equal(deltas.read(), rows))
+    for start, stop in ((0, 1), (15, 17), (33, 90), (99, 100)):
+        assert(array_equal(deltas.read(start, stop), rows[start:stop]))
+    assert(len(deltas.read(50, 50)) == 0)
+    assert(array_equal(deltas[42]['ask'], rows[42]['ask']))
+    fields = ['timestamp', 'bid_px0', 'ask_qty9']
+    projected = read_books(deltas, 5, 50, fields)
+    assert(list(projected.dtype.names) == fields)
+    assert(array_equal(projected['bid_px0'], rows['bid'][5:50, 0, 0]))
+    assert(array_equal(projected['ask_qty9'], rows['ask'][5:50, 9, 1]))
+    assert(array_equal(read_books(deltas, 5, 50, ['seqnum'])['seqnum'], arange(5, 50)))
+    h5_file.close()
+
+def test_compact_books(tmpdir):
+    from auction.book_columns import CompactBooks, book_dataset, read_books
+    from auction.instruments import get_instrument
+    from numpy import arange, array_equal
+    import pytest
+    instrument = get_instrument('SPY', 'ARCA')
+    # ARCA prices have up to 6 decimals, so any unit is on the default grid
+    assert(instrument.tick_size == 1)
+    # a $0.0001 grid
+    tick_size = 100
+    h5_file = openFile(str(tmpdir.join('compact.h5')), mode='w')
+    description = table_description(BookTable)
+    table = h5_file.createTable('/', 'books', description)
+    compact = CompactBooks.create(h5_file, h5_file.createGroup('/', 'SPY'), description, 'compact',
+                                  tick_size = tick_size,
+                                  price_scale = instrument.price_scale)
+    assert(compact.colnames == table.colnames)
+    assert(compact.dtype == table.dtype)
+    assert(h5_file.root.SPY.compact_books.coldescrs['bid'].dtype.base.itemsize == 4)
+    rows = table.read()
+    rows.resize(50)
+    rows['timestamp'] = arange(50) + 1311321600730001
+    rows['timestamp_s'] = [ chicago_time_str(ts) for ts in rows['timestamp'] ]
+    rows['seqnum'] = arange(50)
+    for i in range(1, 50):
+        # bids below 133.50 and asks above it, the last level of each empty
+        rows['bid'][i, :9, 0] = 133500000 - (arange(9) + i)*tick_size
+        rows['ask'][i, :9, 0] = 133510000 + (arange(9) + i)*10000
+        rows['bid'][i, :9, 1] = rows['ask'][i, :9, 1] = 100*i
+    compact.append(rows[:20])
+    h5_file.close()
+
+    h5_file = openFile(str(tmpdir.join('compact.h5')), mode='a')
+    compact = book_dataset(h5_file.root.SPY)
+    assert(compact.reference in (rows['bid'][1, 0, 0], rows['ask'][1, 0, 0]))
+    compact.append(rows[20:])
+    assert(compact.nrows == 50)
+    assert(array_equal(compact.read(), rows))
+    assert(array_equal(compact[0]['bid'], rows[0]['bid']))
+    projected = read_books(compact, 5, 40, ['seqnum', 'ask_px3'])
+    assert(array_equal(projected['ask_px3'], rows['ask'][5:40, 3, 0]))
+    off_grid = rows[:1].copy()
+    off_grid['bid'][0, 0, 0] = 133500001
+    with pytest.raises(RuntimeError):
+        compact.check(off_grid[0]['bid'], off_grid[0]['ask'])
+    with pytest.raises(RuntimeError):
+        compact.append(off_grid)
+    too_large = rows[:1].copy()
+    too_large['ask'][0, 0, 1] = 1 << 40
+    with pytest.raises(RuntimeError):
+        compact.check(too_large[0]['bid'], too_large[0]['ask'])
+    with pytest.raises(RuntimeError):
+        compact.append(too_large)
+    compact.check(rows[7]['bid'], rows[7]['ask'])
+    assert(compact.nrows == 50)
+    h5_file.close()
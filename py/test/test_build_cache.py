@@ -0,0 +1,37 @@
+from auction.build_cache import build_record, write_build_record, read_build_record, stale_reason
+from tables import openFile
+import os
+
+def test_build_cache(tmpdir):
+    src = tmpdir.join('arcabookftp20110722.csv.gz')
+    src.write('some market data')
+    output = str(tmpdir.join('20110722.h5'))
+    options = dict(symbols = ['SPY'], store_timestamp_s = True)
+    assert(stale_reason(output, [ str(src) ], 1, options) == 'missing')
+    h5_file = openFile(output, mode = "w")
+    h5_file.close()
+    assert(read_build_record(output) is None)
+    assert(stale_reason(output, [ str(src) ], 1, options) == 'no build record')
+
+    h5_file = openFile(output, mode = "a")
+    write_build_record(h5_file, build_record([ str(src) ], 1, options))
+    h5_file.close()
+    assert(read_build_record(output)['sources'][0]['name'] == src.basename)
+    assert(stale_reason(output, [ str(src) ], 1, options) is None)
+    assert(stale_reason(output, [ str(src) ], 2, options) == 'parser version 1, now 2')
+    assert(stale_reason(output, [ str(src) ], 1, dict(options, store_timestamp_s = False)) ==
+           'options changed: store_timestamp_s')
+
+    # without a digest a touched source has changed
+    assert('md5' not in read_build_record(output)['sources'][0])
+    os.utime(str(src), (0, 0))
+    assert(stale_reason(output, [ str(src) ], 1, options).startswith('source'))
+
+    # with one, touched but the same content is still up to date, new content is not
+    h5_file = openFile(output, mode = "a")
+    write_build_record(h5_file, build_record([ str(src) ], 1, options, digest = True))
+    h5_file.close()
+    os.utime(str(src), (1, 1))
+    assert(stale_reason(output, [ str(src) ], 1, options) is None)
+    src.write('more market data')
+    assert(stale_reason(output, [ str(src) ], 1, options).startswith('source'))
@@ -0,0 +1,111 @@
+from auction.parser.checkpoint import Checkpoint
+from auction.parser.utils import BookBuilder
+from tables import openFile
+
+def test_checkpoint(tmpdir):
+    h5_file = openFile(str(tmpdir.join('books.h5')), mode = "w")
+    checkpoint = Checkpoint(str(tmpdir.join('books.checkpoint')), 10)
+    assert(checkpoint.load() is None)
+    builder = BookBuilder('SPY', h5_file, book_layout = 'columns')
+    for seqnum in range(5):
+        builder.append_book(1311321600730001 + seqnum, None, seqnum)
+    assert(not checkpoint.due(5))
+    assert(checkpoint.due(10))
+    checkpoint.save(h5_file, 10, dict(builder = builder.checkpoint_state()))
+    assert(not checkpoint.due(15))
+    for seqnum in range(5, 8):
+        builder.append_book(1311321600730001 + seqnum, None, seqnum)
+    BookBuilder('QQQ', h5_file).append_book(1311321600730001, None, 0)
+    BookBuilder.flush_books(h5_file)
+    h5_file.close()
+
+    h5_file = openFile(str(tmpdir.join('books.h5')), mode = "a")
+    state = Checkpoint(str(tmpdir.join('books.checkpoint'))).load()
+    assert(state['line'] == 10)
+    checkpoint.restore(h5_file, state)
+    assert('QQQ' not in h5_file.root._v_children)
+    builder = BookBuilder('SPY', h5_file, book_layout = 'columns', resume = True)
+    builder.restore_state(state['builder'])
+    assert(builder.symbol == 'SPY')
+    builder.append_book(1311321600730001 + 5, None, 5)
+    BookBuilder.flush_books(h5_file)
+    assert(h5_file.root.SPY.book_columns.seqnum.read().tolist() == range(6))
+    h5_file.close()
+    checkpoint.remove()
+    assert(Checkpoint(str(tmpdir.join('books.checkpoint'))).load() is None)
+
+from auction.parser import cme_rlc_parser
+from auction.parser.cme_rlc_parser import CmeRlcParser, RlcRecord
+from path import path
+import zipfile
+import pytest
+
+def rlc_book_line(date, second, symbol, bid, ask):
+    """
+    An MA book message of RLC (fixed width) setting the top level
+    """
+    line = list(' ' * 153)
+    def put(start, text):
+        line[start:start + len(text)] = text
+    put(12, '%02d000' % (second % 60))
+    put(17, '%s1000%02d' % (date, second % 60))
+    put(33, 'MA')
+    put(41, date)
+    put(49, symbol.ljust(20))
+    put(76, '10000')
+    put(82, '%012d%04d%019d%019d%04d%012d' % (10 + second % 7, 1, bid, ask, 1, 20 + second % 5))
+    return ''.join(line)
+
+def rlc_sample(tmpdir, date):
+    """
+    Zip of the RLC sample for the date, two members of 100 book messages
+    """
+    zip_path = str(tmpdir.join('rlc_%s.zip' % date))
+    root = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED)
+    for member in range(2):
+        root.writestr('rlc_%s_%d' % (date, member),
+                      ''.join(rlc_book_line(date, i // 2, ('ESU1', 'NQU1')[i % 2],
+                                            1000 + i % 9, 1010 + i % 11) + '\n'
+                              for i in range(member * 100, member * 100 + 100)))
+    root.close()
+    return path(zip_path)
+
+class Died(Exception):
+    pass
+
+def test_resume_rlc(tmpdir, monkeypatch):
+    inputs = [ rlc_sample(tmpdir, date) for date in ('20110103', '20110104') ]
+    def parser(out, checkpoint_lines = 0):
+        monkeypatch.setattr(cme_rlc_parser, 'CME_OUT_PATH', path(str(tmpdir.join(out))))
+        # as in a new process
+        monkeypatch.setattr(RlcRecord, 'sequence_number', 0)
+        return CmeRlcParser(inputs, checkpoint_lines = checkpoint_lines)
+    parser('full').parse()
+
+    # die at the first checkpoint, part way into the second day
+    save = Checkpoint.save
+    def save_and_die(self, h5_file, line, state):
+        save(self, h5_file, line, state)
+        raise Died()
+    monkeypatch.setattr(Checkpoint, 'save', save_and_die)
+    died = parser('resumed', 250)
+    with pytest.raises(Died):
+        died.parse()
+    died._CmeRlcParser__h5_file.close()
+    monkeypatch.setattr(Checkpoint, 'save', save)
+    state = Checkpoint(str(tmpdir.join('resumed', '20110103_RLC.checkpoint'))).load()
+    assert(state['path_index'] == 1 and state['file_index'] == 0 and state['line_number'] > 0)
+    parser('resumed', 250).parse(resume = True)
+    assert(not tmpdir.join('resumed', '20110103_RLC.checkpoint').check())
+
+    for date in ('20110103', '20110104'):
+        full = openFile(str(tmpdir.join('full', date)))
+        resumed = openFile(str(tmpdir.join('resumed', date)))
+        for symbol in ('ESU1', 'NQU1'):
+            books = full.root._f_getChild(symbol).books.read()
+            assert(len(books) == 100)
+            assert((books == resumed.root._f_getChild(symbol).books.read()).all())
+        assert(full.root.parse_results.summary[0]['processed'] ==
+               resumed.root.parse_results.summary[0]['processed'])
+        full.close()
+        resumed.close()
@@ -0,0 +1,20 @@
+from auction.parser.closing_books import write_closing_books, read_closing_books, \
+    copy_closing_books
+from tables import openFile
+import pytest
+
+def test_closing_books(tmpdir):
+    books = { 'ESZ1' : ([ (121000, 5), (120975, 12) ] + [ None ]*8, [ None ]*10),
+              'GEZ1-GEH2' : ([ None ]*10, [ (0, 0) ] + [ None ]*8 + [ (99000, 1) ]) }
+    h5_file = openFile(str(tmpdir.join('20110103')), mode = "w")
+    write_closing_books(h5_file, books, sequence_number = 6000)
+    h5_file.close()
+    assert(read_closing_books(str(tmpdir.join('20110103'))) == (books, { 'sequence_number' : 6000 }))
+
+    copy_closing_books(str(tmpdir.join('20110103')), str(tmpdir.join('20110103_closing_books')))
+    assert(read_closing_books(str(tmpdir.join('20110103_closing_books')))[0] == books)
+
+    h5_file = openFile(str(tmpdir.join('20110104')), mode = "w")
+    h5_file.close()
+    with pytest.raises(RuntimeError):
+        read_closing_books(str(tmpdir.join('20110104')))
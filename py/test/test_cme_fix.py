@@ -0,0 +1,70 @@
+from auction.parser.cme_fix_parser import CmeRefreshMessage, CmeRefreshDecoder, \
+    __ENTRY_TAGS__, decode_refresh_block
+from auction.time_utils import timestamp_from_cme_timestamp
+
+def fix_line(fields):
+    return '8=FIX.4.4\x019=100\x01' + ''.join('%s=%s\x01' % field for field in fields) + '10=123\x01'
+
+def entry(action, symbol, entry_type, px, size, level = None):
+    result = [ ('279', action), ('22', '8'), ('83', '7'), ('107', symbol), ('269', entry_type),
+               ('270', px), ('271', size), ('273', '083000000') ]
+    if level:
+        result += [ ('346', '3'), ('1023', level) ]
+    else:
+        result += [ ('5797', '1') ]
+    return result
+
+def test_refresh_decoder():
+    decoder = CmeRefreshDecoder(max_entries = 2)
+    assert(not decoder.decode(fix_line([ ('35', '0'), ('34', '1'), ('52', '20111017083000123') ])))
+    entries = entry('0', 'ESZ1', '0', '121000', '5', '1') + entry('1', 'ESZ1', '1', '121025', '9', '2') + \
+        [ ('276', 'K') ] + entry('0', 'NQZ1', '2', '230050', '1')
+    line = fix_line([ ('35', 'X'), ('49', 'CME'), ('34', '17'), ('52', '20111017083000123'),
+                      ('268', '3') ] + entries)
+    assert(decoder.decode(line))
+    msg = CmeRefreshMessage(line)
+    assert(decoder.count == 3)
+    assert(decoder.msg_seq_num == msg.msg_seq_num == '17')
+    assert(decoder.sending_time == msg.sending_time)
+    for index, expected in enumerate(msg.entries):
+        assert(decoder.entry(index) == dict((tag, value) for tag, value in expected.iteritems()
+                                            if tag in __ENTRY_TAGS__))
+    assert(decoder.price_level[2] is None)
+    assert(decoder.quote_condition[1] == 'K')
+    assert(decoder.decode(fix_line([ ('35', 'X'), ('34', '18'), ('52', '20111017083000125'),
+                                     ('268', '1') ] + entry('2', 'ESZ1', '0', '121000', '0', '1'))))
+    assert(decoder.count == 1)
+    assert(decoder.entry(0)['279'] == '2')
+    assert(decoder.quote_condition[0] is None)
+
+def test_decode_refresh_block():
+    header = [ ('35', 'X'), ('34', '17'), ('52', '20111017083000123') ]
+    lines = [ fix_line([ ('35', '0'), ('34', '16'), ('52', '20111017083000120') ]),
+              fix_line(header + [ ('268', '4') ] + entry('0', 'ESZ1', '0', '121000', '5', '1') +
+                       entry('1', 'NQZ1', '1', '230050', '9', '2') + [ ('276', 'K') ] +
+                       entry('0', 'ESZ1', '2', '121025', '1') + [ ('277', 'E') ] +
+                       entry('0', 'ESZ1', 'J', '3', '1')),
+              fix_line([ ('35', 'X'), ('34', '18'), ('52', 'bad'), ('268', '1') ] +
+                       entry('9', 'ESZ1', '1', '121050', '2', '1')),
+              fix_line(header + [ ('268', '2') ] + entry('0', 'ESZ1', '0', 'x', '5', '1') +
+                       entry('0', 'ESZ1', '1', '121050', '5', '0')),
+              '' ]
+    batch = decode_refresh_block("\n".join(lines))
+    assert(batch.lines == 4)
+    assert(decode_refresh_block("\n".join(lines[:-1])).lines == 4)
+    assert(batch.symbols == [ 'ESZ1', 'NQZ1' ])
+    messages = batch.messages.tolist()
+    assert(messages[0] == (17, timestamp_from_cme_timestamp('20111017083000123'),
+                           '20111017083000123', 4))
+    assert([ message[3] for message in messages ] == [ 4, 1, 2 ])
+    assert(batch.message_errors.keys() == [ 1 ])
+    entries = batch.entries.tolist()
+    assert(entries[0] == (0, '0', '0', 121000, 5, 0, False, 3))
+    assert(entries[1] == (1, '1', '1', 230050, 9, 1, True, 3))
+    assert(entries[2] == (0, '2', '0', 121025, 1, -2, False, 1))
+    assert(entries[3][:2] == (0, ''))
+    assert(entries[4][:3] == (0, '1', '?'))
+    assert(batch.entry_errors.keys() == [ 5 ])
+    assert(sorted(batch.details) == [ 2, 4, 6 ])
+    assert(batch.details[4]['279'] == '9')
+    assert(decode_refresh_block('').messages.size == 0)
@@ -0,0 +1,20 @@
+from auction.storage import get_storage_profile, storage_profile_names, DEFAULT_STORAGE
+from auction.book import BookTable
+from tables import openFile
+import pytest
+
+def test_storage_profile(tmpdir):
+    assert(get_storage_profile(None) is DEFAULT_STORAGE)
+    assert('zlib1' in storage_profile_names())
+    with pytest.raises(RuntimeError):
+        get_storage_profile('no_such_profile')
+
+    h5_file = openFile(str(tmpdir.join('books.h5')), mode = "w")
+    profile = get_storage_profile('blosc_lz4')
+    table = profile.create_table(h5_file, '/', 'books', BookTable, "Books")
+    assert(table.filters.complib == 'blosc:lz4')
+    assert(table.filters.complevel == 5)
+    assert(table.chunkshape == (profile.chunk_rows,))
+    table = get_storage_profile('none').create_table(h5_file, '/', 'plain', BookTable, "Books")
+    assert(table.filters.complevel == 0)
+    h5_file.close()
@@ -31,3 +31,47 @@ def test_timestamp():
     assert(delta.microseconds > 0)
     assert(delta.seconds == 0)
 
+
+from auction.time_utils import chicago_time_str, ChicagoTimeFormatter
+from numpy import int64
+import random
+
+def test_chicago_time_formatter():
+    formatter = ChicagoTimeFormatter()
+    assert(formatter(0) == chicago_time_str(0))
+    # around the 2011 transitions to and from daylight time, and a regular day
+    for sod in (start_of_date(2011, 3, 13, CHI_TZ), start_of_date(2011, 11, 6, CHI_TZ),
+                start_of_date(2011, 7, 22, NY_TZ)):
+        for second in range(0, 12*3600, 13):
+            ts = sod + second*1000000 + (second*7919) % 1000000
+            assert(formatter(ts) == chicago_time_str(ts))
+    rng = random.Random(7)
+    for i in range(5000):
+        ts = rng.randint(start_of_date(2008, 1, 1, UTC_TZ), start_of_date(2013, 1, 1, UTC_TZ))
+        assert(formatter(ts) == chicago_time_str(ts))
+        assert(formatter(int64(ts)) == chicago_time_str(ts))
+
+from auction.time_utils import timestamp_from_cme_timestamp, CmeTimestampParser, \
+    LocalTimestampParser, timestamp_from_datetime
+
+def test_cme_timestamp_parser():
+    parser = CmeTimestampParser()
+    rng = random.Random(3)
+    for i in range(5000):
+        ts = rng.randint(start_of_date(2008, 1, 1, UTC_TZ), start_of_date(2013, 1, 1, UTC_TZ))
+        digits = rng.choice((3, 4, 5))
+        ts_str = datetime_from_timestamp(ts).strftime('%Y%m%d%H%M%S%f')[:14 + digits]
+        assert(parser(ts_str) == timestamp_from_cme_timestamp(ts_str))
+    assert(parser('2011102813300000175') == timestamp_from_cme_timestamp('2011102813300000175'))
+
+def test_local_timestamp_parser():
+    parser = LocalTimestampParser(CHI_TZ)
+    # every minute around the 2011 transitions to and from daylight time
+    for sod in (start_of_date(2011, 3, 13, CHI_TZ), start_of_date(2011, 11, 6, CHI_TZ)):
+        for second in range(0, 6*3600, 59):
+            local = chicago_time(sod + second*1000000)
+            date_time = local.strftime('%Y%m%d%H%M%S')
+            expected = datetime(*[ int(date_time[start:stop]) for start, stop in
+                                   ((0, 4), (4, 6), (6, 8), (8, 10), (10, 12), (12, 14)) ],
+                                tzinfo=CHI_TZ).astimezone(UTC_TZ)
+            assert(parser(date_time) == timestamp_from_datetime(expected))
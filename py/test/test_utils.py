@@ -0,0 +1,186 @@
+from auction.parser.utils import OrderTable
+import random
+
+def test_order_table():
+    # compare against the dict of tuples/lists ArcaBookBuilder used to keep
+    rng = random.Random(11)
+    table = OrderTable(4)
+    model = {}
+    for i in range(20000):
+        order_id = rng.randint(0, 3000)
+        is_buy = rng.random() < 0.5
+        key = (order_id, is_buy)
+        action = rng.random()
+        if action < 0.45:
+            price, qty = rng.randint(1, 100), rng.randint(1, 10)
+            table.add(order_id, is_buy, price, qty)
+            current = model.get(key)
+            if not current:
+                model[key] = (price, qty)
+            else:
+                if type(current) != list:
+                    model[key] = [current]
+                model[key].append((price, qty))
+        elif action < 0.9:
+            current = model.get(key)
+            result = table.pop(order_id, is_buy)
+            if not current:
+                assert(result is None)
+            elif type(current) == list:
+                assert(result == current.pop())
+                if not current:
+                    del model[key]
+            else:
+                assert(result == current)
+                del model[key]
+        else:
+            current = model.get(key)
+            result = table.get(order_id, is_buy)
+            if not current:
+                assert(result is None)
+            elif type(current) == list:
+                assert(result == current[-1] + (True,))
+            else:
+                assert(result == current + (False,))
+                table.replace(order_id, is_buy, 7, 7)
+                model[key] = (7, 7)
+        assert(len(table) == len(model))
+    copy = OrderTable(4)
+    copy.load(table.snapshot())
+    assert(len(copy) == len(model))
+    for (order_id, is_buy), current in model.items():
+        stacked = type(current) == list
+        for entry in (reversed(current) if stacked else [current]):
+            for orders in (table, copy):
+                assert(orders.get(order_id, is_buy) == entry + (stacked,))
+                assert(orders.pop(order_id, is_buy) == entry)
+    assert(len(table) == 0 and len(copy) == 0)
+
+from auction.parser.utils import PriceOrderedDict, PriceLadder
+
+def test_price_ladder():
+    rng = random.Random(5)
+    for ascending in (True, False):
+        ladder = PriceLadder(ascending)
+        reference = PriceOrderedDict(ascending)
+        live = []
+        for i in range(5000):
+            if live and rng.random() < 0.5:
+                px, qty = live.pop(rng.randrange(len(live)))
+                qty = -qty
+            else:
+                px, qty = rng.randint(90, 110)*10000, rng.randint(1, 9)*100
+                live.append((px, qty))
+            ladder.update_quantity(px, qty)
+            reference.update_quantity(px, qty)
+            assert(len(ladder) == len(reference))
+            assert(ladder.top() == reference.top())
+            for n in (1, 3, 10, 40):
+                assert(ladder.top_n(n) == reference.top_n(n))
+            assert(ladder.get_quantity(px) == reference.get_quantity(px))
+
+def test_price_ladder_changed():
+    # levels above the changed rank must be untouched since the last take
+    rng = random.Random(9)
+    for ascending in (True, False):
+        ladder = PriceLadder(ascending)
+        live = []
+        previous = []
+        for i in range(5000):
+            for j in range(rng.randint(1, 3)):
+                if live and rng.random() < 0.5:
+                    px, qty = live.pop(rng.randrange(len(live)))
+                    qty = -qty
+                else:
+                    px, qty = rng.randint(90, 110)*10000, rng.randint(1, 9)*100
+                    live.append((px, qty))
+                ladder.update_quantity(px, qty)
+            current = [ (px, ladder.get_quantity(px)) for px in ladder.top_n(40) ]
+            start = ladder.take_changed()
+            assert(current[:start] == previous[:start])
+            assert(ladder.levels(start, 10) == current[start:10])
+            assert(ladder.take_changed() > 40)
+            previous = current
+
+from auction.parser.utils import FileRecordCounter
+from auction.book import BookTable
+from tables import openFile
+
+def test_buffered_row(tmpdir):
+    h5_file = openFile(str(tmpdir.join('books.h5')), mode = "w")
+    counter = FileRecordCounter(h5_file)
+    table = h5_file.createTable('/', 'books', BookTable)
+    row = counter.buffered_row(table, ('timestamp', 'seqnum'), 8)
+    for i in range(20):
+        row['timestamp'] = i
+        row['seqnum'] = i
+        row.append()
+    assert(table.nrows == 16)
+    counter.flush()
+    assert(table.nrows == 20)
+    assert(table.col('seqnum').tolist() == range(20))
+    h5_file.close()
+
+from auction.parser.async_writer import AsyncWriter
+
+def test_async_writer(tmpdir):
+    h5_file = openFile(str(tmpdir.join('books.h5')), mode = "w")
+    writer = AsyncWriter(2)
+    counter = FileRecordCounter(h5_file, writer)
+    table = h5_file.createTable('/', 'books', BookTable)
+    row = counter.buffered_row(table, ('seqnum', 'timestamp'), 8)
+    for i in range(20):
+        row.append((i, 1000+i))
+    counter.flush()
+    assert(table.nrows == 20)
+    assert(table.col('seqnum').tolist() == range(20))
+    assert(table.col('timestamp').tolist() == range(1000, 1020))
+    assert(set(table.col('timestamp_s')) == set(['']))
+    h5_file.close()
+
+from auction.parser.async_writer import BlockRows
+import pytest
+
+class FailingTable(object):
+    """
+    Table whose appends of the given blocks fail
+    """
+    def __init__(self, table, failing):
+        self.table = table
+        self.failing = failing
+        self.appends = 0
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+    def append(self, rows):
+        self.appends += 1
+        if self.appends in self.failing:
+            raise RuntimeError("append %d failed" % self.appends)
+        self.table.append(rows)
+
+def test_block_rows_failed_append(tmpdir):
+    h5_file = openFile(str(tmpdir.join('books.h5')), mode = "w")
+    table = h5_file.createTable('/', 'books', BookTable)
+    rows = BlockRows(FailingTable(table, [ 1 ]), ('seqnum', 'timestamp'), None, 4)
+    for i in range(3):
+        rows.append((i, 1000+i))
+    with pytest.raises(RuntimeError):
+        rows.append((3, 1003))
+    for i in range(4, 10):
+        rows.append((i, 1000+i))
+    rows.flush()
+    assert(table.col('seqnum').tolist() == range(4, 10))
+    h5_file.close()
+
+from auction.parser.utils import BookOptions
+
+def test_book_options():
+    options = BookOptions()
+    assert(options.store_timestamp_s and options.book_layout == 'rows' and not options.bbo)
+    options = BookOptions(book_layout = 'compact', buffer_rows = 2, writer_queue = 4, bbo = True)
+    # the writer applies to the file, not each builder
+    assert(options.builder_args() == dict(store_timestamp_s = True, buffer_rows = 2,
+                                          storage = None, book_layout = 'compact', bbo = True))
+    with pytest.raises(RuntimeError):
+        BookOptions(book_layout = 'rowz')
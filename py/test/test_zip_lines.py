@@ -0,0 +1,27 @@
+from auction.parser.zip_lines import ZipMemberLines
+import zipfile
+
+def test_zip_member_lines(tmpdir):
+    zip_path = str(tmpdir.join('rlc_20110103.zip'))
+    members = { 'empty' : '', 'one' : 'no newline', 'trailing' : 'a\nbb\n\nccc\n',
+                'lines' : ''.join('line %d %s\n' % (i, 'x'*(i % 37)) for i in range(1000)) + 'tail' }
+    root = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED)
+    for name, text in members.iteritems():
+        root.writestr(name, text)
+    root.close()
+    root = zipfile.ZipFile(zip_path, 'r')
+    for name, text in members.iteritems():
+        for read_size in (5, 61, 4096, 1 << 22):
+            for read_ahead in (0, 1, 3):
+                lines = list(ZipMemberLines(root, name, read_size, read_ahead))
+                assert(lines == text.split("\n"))
+            chunks = list(ZipMemberLines(root, name, read_size).chunks())
+            assert("".join(chunks) == text)
+            assert(all(chunk.endswith("\n") for chunk in chunks[:-1]))
+            assert(sum(chunk.count("\n") + (not chunk.endswith("\n")) for chunk in chunks) ==
+                   len(text.splitlines()))
+    # stopping early stops the read ahead
+    for line in ZipMemberLines(root, 'lines', 64, 1):
+        if line.startswith('line 10 '):
+            break
+    root.close()